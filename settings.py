@@ -11,3 +11,5 @@ PROGRAMS_DIR = os.path.join(PROJECT_DIR, "programs")
 VIEWVOX_EXE = os.path.join(PROGRAMS_DIR, "viewvox.exe")
 
 REPORTS_DIR = os.path.join(PROJECT_DIR, "reports")
+
+VOXEL_CACHE_DIR = os.path.join(DATA_DIR, "voxel_cache")
@@ -22,6 +22,14 @@ __C.DATASETS.MVS                          = edict()
 __C.DATASETS.MVS.TAXONOMY_FILE_PATH       = 'data/mvs_dataset/MVS_taxonomy_for_training.json'
 __C.DATASETS.MVS.RENDERING_PATH           = 'data/mvs_dataset/images/scan%d/clean_%03d_max.png'
 __C.DATASETS.MVS.VOXEL_PATH               = 'data/mvs_dataset/processed_voxels_pix2vox/stl%s_total_no_ground.binvox'
+__C.DATASETS.MVS.IMAGE_CACHE_DIR          = 'data/mvs_dataset/resized_images'    # output of utils/image_cache.py
+
+__C.DATASETS.SHARDED                      = edict()
+__C.DATASETS.SHARDED.SHARD_DIR            = 'data/shards'    # output of utils/shard_packer.py
+
+__C.DATASETS.FILE_INDEX                   = edict()
+__C.DATASETS.FILE_INDEX.INDEX_DIR         = 'data/file_index'    # set to None to resolve files on every run
+__C.DATASETS.FILE_INDEX.REVALIDATE        = True                 # check folder mtimes of cached samples
 #
 # Dataset
 #
@@ -44,6 +52,7 @@ __C.CONST.N_VIEWS_RENDERING                 = 1         # Dummy property for Pas
 __C.CONST.CROP_IMG_W                        = 128       # Dummy property for Pascal 3D
 __C.CONST.CROP_IMG_H                        = 128       # Dummy property for Pascal 3D
 __C.CONST.NUM_WORKER                        = 4         # number of data workers
+__C.CONST.N_DECODE_THREADS                  = 4         # threads decoding the views of a sample in a worker
 __C.CONST.SHAPENET_RATIO                    = 10
 
 #
@@ -60,6 +69,8 @@ __C.NETWORK.LEAKY_VALUE                     = .2
 __C.NETWORK.TCONV_USE_BIAS                  = False
 __C.NETWORK.USE_REFINER                     = True
 __C.NETWORK.USE_MERGER                      = True
+__C.NETWORK.FOLD_VIEWS_INTO_BATCH           = True      # run all views as one batch in eval mode, see Encoder.forward
+__C.NETWORK.FOLDED_BATCH_SIZE               = 64        # max number of images in one folded backbone pass
 
 #
 # Training
@@ -87,7 +98,9 @@ __C.TRAIN.BETAS                             = (.9, .999)
 __C.TRAIN.MOMENTUM                          = .9
 __C.TRAIN.GAMMA                             = .5
 __C.TRAIN.SAVE_FREQ                         = 10            # weights will be overwritten every save_freq epoch
-__C.TRAIN.UPDATE_N_VIEWS_RENDERING          = False
+__C.TRAIN.UPDATE_N_VIEWS_RENDERING          = False         # random number of views for every batch
+__C.TRAIN.AMP_DTYPE                         = None          # None for fp32, float16 or bfloat16 for autocast
+__C.TRAIN.BATCH_AUGMENTATION                = False         # opt in to augment whole batches on the device of the models
 
 #
 # Testing options
@@ -95,3 +108,5 @@ __C.TRAIN.UPDATE_N_VIEWS_RENDERING          = False
 __C.TEST                                    = edict()
 __C.TEST.RANDOM_BG_COLOR_RANGE              = [[240, 240], [240, 240], [240, 240]]
 __C.TEST.VOXEL_THRESH                       = [.2, .3, .4, .5]
+__C.TEST.STREAMING_VIEW_CHUNK_SIZE          = 0         # merge views online in chunks of this size, 0 to disable
+__C.TEST.AMP_DTYPE                          = None      # None for fp32, float16 or bfloat16 (also on CPU)
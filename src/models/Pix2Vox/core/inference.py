@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+
+import torch
+
+import utils.helpers
+
+
+class StreamingViewMerger(object):
+    """Merges the coarse volumes of views that arrive one chunk at a time.
+
+    The merger softmax over all views is computed online: for every voxel the running maximum of the view scores,
+    the sum of exp(score - max) and the sum of exp(score - max) * coarse_volume are kept, and both sums are rescaled
+    whenever the maximum grows. Memory stays the same for any number of views and the merged volume equals
+    Merger.forward over all views up to float rounding. Without a merger the coarse volumes are averaged, as in
+    test_net.
+    """
+
+    def __init__(self, merger=None):
+        # The scores are computed by calling the merger directly, so unwrap torch.nn.DataParallel
+        self.merger = getattr(merger, 'module', merger)
+        self.n_views = 0
+        self.max_scores = None
+        self.weight_sums = None
+        self.volume_sums = None
+
+    def update(self, raw_features, coarse_volumes):
+        # print(raw_features.size())      # torch.Size([batch_size, n_views_in_chunk, 9, 32, 32, 32])
+        # print(coarse_volumes.size())    # torch.Size([batch_size, n_views_in_chunk, 32, 32, 32])
+        self.n_views += coarse_volumes.size(1)
+        # Accumulate in fp32 also under autocast, the sums grow with the number of views
+        coarse_volumes = coarse_volumes.float()
+
+        if self.merger is None:
+            chunk_volume_sums = torch.sum(coarse_volumes, dim=1)
+            self.volume_sums = chunk_volume_sums if self.volume_sums is None else self.volume_sums + chunk_volume_sums
+            return
+
+        scores = self.merger.get_view_scores(raw_features).float()
+        chunk_max_scores = torch.max(scores, dim=1)[0]
+        if self.max_scores is None:
+            self.max_scores = chunk_max_scores
+            self.weight_sums = torch.zeros_like(chunk_max_scores)
+            self.volume_sums = torch.zeros_like(chunk_max_scores)
+        else:
+            max_scores = torch.max(self.max_scores, chunk_max_scores)
+            rescale = torch.exp(self.max_scores - max_scores)
+            self.weight_sums = self.weight_sums * rescale
+            self.volume_sums = self.volume_sums * rescale
+            self.max_scores = max_scores
+
+        weights = torch.exp(scores - self.max_scores.unsqueeze(dim=1))
+        self.weight_sums = self.weight_sums + torch.sum(weights, dim=1)
+        self.volume_sums = self.volume_sums + torch.sum(weights * coarse_volumes, dim=1)
+
+    def get_merged_volumes(self):
+        if self.n_views == 0:
+            raise ValueError('[ERROR] No views were merged.')
+        if self.merger is None:
+            return self.volume_sums / self.n_views
+
+        return torch.clamp(self.volume_sums / self.weight_sums, min=0, max=1)
+
+
+def split_views(rendering_images, chunk_size):
+    """Splits a [batch_size, n_views, C, H, W] batch into chunks of at most chunk_size views"""
+    return torch.split(rendering_images, chunk_size, dim=1)
+
+
+def reconstruct_streaming(view_chunks, encoder, decoder, merger=None, refiner=None):
+    """Reconstructs volumes from views given as an iterable of [batch_size, n_views_in_chunk, C, H, W] tensors.
+
+    Only one chunk of views is on the device at a time, so the number of views is not limited by memory. Pass
+    merger=None to average the coarse volumes instead of merging them, and refiner=None to return the merged volumes
+    without refinement. Models are expected to be in eval mode.
+    """
+    streaming_merger = StreamingViewMerger(merger)
+    with torch.no_grad():
+        for rendering_images in view_chunks:
+            rendering_images = utils.helpers.var_or_cuda(rendering_images)
+            image_features = encoder(rendering_images)
+            raw_features, coarse_volumes = decoder(image_features)
+            streaming_merger.update(raw_features, coarse_volumes)
+
+        generated_volumes = streaming_merger.get_merged_volumes()
+        if refiner is not None:
+            generated_volumes = refiner(generated_volumes)
+
+    return generated_volumes
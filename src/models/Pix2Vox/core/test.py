@@ -15,6 +15,8 @@ import utils.binvox_rw as br
 import utils.data_loaders
 import utils.data_transforms
 import utils.helpers
+import utils.mixed_precision
+from core.inference import reconstruct_streaming, split_views
 from models.decoder import Decoder
 from models.encoder import Encoder
 from models.merger import Merger
@@ -25,6 +27,28 @@ from utils.average_meter import AverageMeter
 from utils.results_saver import save_test_results_to_csv, save_times_to_csv
 
 
+def get_sample_losses(generated_volumes, ground_truth_volumes, amp_dtype=None):
+    """Scaled BCE loss of every sample in the batch, the mean of which is the loss used in training"""
+    losses = utils.mixed_precision.binary_cross_entropy(generated_volumes, ground_truth_volumes, amp_dtype,
+                                                        reduction='none')
+    return torch.mean(losses.view(losses.size(0), -1), dim=1) * 10
+
+
+def get_volume_ious(generated_volumes, ground_truth_volumes, thresholds):
+    """IoU of every sample in the batch for all thresholds at once, as a [batch_size, n_thresholds] tensor"""
+    batch_size = generated_volumes.size(0)
+    generated_volumes = generated_volumes.view(batch_size, 1, -1)
+    ground_truth_volumes = torch.ge(ground_truth_volumes.view(batch_size, 1, -1), 1)
+    # print(generated_volumes.size())     # torch.Size([batch_size, 1, 32768])
+
+    _volumes = torch.ge(generated_volumes, thresholds.view(1, -1, 1))
+    # print(_volumes.size())              # torch.Size([batch_size, n_thresholds, 32768])
+    intersection = torch.sum(_volumes & ground_truth_volumes, dim=2).float()
+    union = torch.sum(_volumes | ground_truth_volumes, dim=2).float()
+
+    return intersection / union
+
+
 def test_net(cfg,
              model_type,
              dataset_type,
@@ -59,10 +83,12 @@ def test_net(cfg,
             utils.data_transforms.ToTensor(),
         ])
 
+        # Timing runs read one sample per batch, so that the times CSV holds per-sample times comparable with the
+        # earlier timing runs
         dataset_loader = utils.data_loaders.DATASET_LOADER_MAPPING[cfg.DATASET.TEST_DATASET](cfg)
         test_data_loader = torch.utils.data.DataLoader(dataset=dataset_loader.get_dataset(
             dataset_type, cfg.CONST.N_VIEWS_RENDERING, test_transforms),
-            batch_size=1,
+            batch_size=1 if path_to_times_csv is not None else cfg.CONST.BATCH_SIZE,
             num_workers=cfg.CONST.NUM_WORKER,
             pin_memory=True,
             shuffle=False)
@@ -93,11 +119,8 @@ def test_net(cfg,
         if cfg.NETWORK.USE_MERGER:
             merger.load_state_dict(checkpoint['merger_state_dict'])
 
-    # Set up loss functions
-    bce_loss = torch.nn.BCELoss()
-
     # Testing loop
-    n_samples = len(test_data_loader)
+    n_samples = len(test_data_loader.dataset)
     test_iou = dict()
     encoder_losses = AverageMeter()
     if use_refiner:
@@ -117,93 +140,126 @@ def test_net(cfg,
     for iou_threshold in cfg.TEST.VOXEL_THRESH:
         ious_dict[iou_threshold] = []
 
+    use_streaming = cfg.TEST.STREAMING_VIEW_CHUNK_SIZE > 0
+    amp_dtype = cfg.TEST.AMP_DTYPE
+
     if path_to_times_csv is not None:
         n_view_list = []
         times_list = []
-
-    for sample_idx, (taxonomy_id, sample_name, rendering_images, ground_truth_volume) in enumerate(test_data_loader):
-        taxonomy_id = taxonomy_id[0] if isinstance(taxonomy_id[0], str) else taxonomy_id[0].item()
-        sample_name = sample_name[0]
-        with torch.no_grad():
+        batch_size_list = []
+
+    thresholds = utils.helpers.var_or_cuda(torch.tensor(cfg.TEST.VOXEL_THRESH))
+    sample_idx = 0
+    for taxonomy_ids, sample_names, rendering_images, ground_truth_volumes in test_data_loader:
+        taxonomy_ids = [t if isinstance(t, str) else t.item() for t in taxonomy_ids]
+        batch_size = len(sample_names)
+        with torch.no_grad(), utils.mixed_precision.autocast(amp_dtype):
             # Get data from data loader
-            rendering_images = utils.helpers.var_or_cuda(rendering_images)
-            ground_truth_volume = utils.helpers.var_or_cuda(ground_truth_volume)
+            # In the streaming mode the views are moved to the GPU chunk by chunk
+            if not use_streaming:
+                rendering_images = utils.helpers.var_or_cuda(rendering_images)
+            ground_truth_volumes = utils.helpers.var_or_cuda(ground_truth_volumes)
 
             if path_to_times_csv is not None:
                 start_time = time.time()
 
             # Test the encoder, decoder, refiner and merger
-            image_features = encoder(rendering_images)
-            raw_features, generated_volume = decoder(image_features)
-
-            if cfg.NETWORK.USE_MERGER and epoch_idx >= cfg.TRAIN.EPOCH_START_USE_MERGER:
-                generated_volume = merger(raw_features, generated_volume)
+            use_merger = cfg.NETWORK.USE_MERGER and epoch_idx >= cfg.TRAIN.EPOCH_START_USE_MERGER
+            if use_streaming:
+                view_chunks = split_views(rendering_images, cfg.TEST.STREAMING_VIEW_CHUNK_SIZE)
+                generated_volumes = reconstruct_streaming(view_chunks, encoder, decoder,
+                                                          merger if use_merger else None)
             else:
-                generated_volume = torch.mean(generated_volume, dim=1)
-            encoder_loss = bce_loss(generated_volume, ground_truth_volume) * 10
+                image_features = encoder(rendering_images)
+                raw_features, generated_volumes = decoder(image_features)
+
+                if use_merger:
+                    generated_volumes = merger(raw_features, generated_volumes)
+                else:
+                    generated_volumes = torch.mean(generated_volumes, dim=1)
+            encoder_loss = get_sample_losses(generated_volumes, ground_truth_volumes, amp_dtype)
 
             if use_refiner and epoch_idx >= cfg.TRAIN.EPOCH_START_USE_REFINER:
-                generated_volume = refiner(generated_volume)
-                refiner_loss = bce_loss(generated_volume, ground_truth_volume) * 10
+                generated_volumes = refiner(generated_volumes)
+                refiner_loss = get_sample_losses(generated_volumes, ground_truth_volumes, amp_dtype)
             else:
                 refiner_loss = encoder_loss
+            # Autocast outputs can be float16 or bfloat16
+            generated_volumes = generated_volumes.float()
 
             if path_to_times_csv is not None:
+                if torch.cuda.is_available():
+                    torch.cuda.synchronize()
                 end_time = time.time()
+                # One row per batch, the time of the whole batch with its size
                 n_view_list.append(rendering_images.size()[1])
                 times_list.append(end_time - start_time)
+                batch_size_list.append(batch_size)
+
+            # IoU per sample and threshold
+            sample_ious = get_volume_ious(generated_volumes, ground_truth_volumes, thresholds)
+
+            # Copy the losses and IoUs of the whole batch to the host at once
+            batch_results = torch.cat([encoder_loss.unsqueeze(dim=1),
+                                       refiner_loss.unsqueeze(dim=1), sample_ious], dim=1).cpu().numpy()
+            batch_encoder_losses = batch_results[:, 0]
+            batch_refiner_losses = batch_results[:, 1]
+            batch_ious = batch_results[:, 2:]
 
             # Append loss and accuracy to average metrics
-            encoder_losses.update(encoder_loss.item())
-            if use_refiner:
-                refiner_losses.update(refiner_loss.item())
-
-            # IoU per sample
-            sample_iou = []
-            for th in cfg.TEST.VOXEL_THRESH:
-                _volume = torch.ge(generated_volume, th).float()
-                intersection = torch.sum(_volume.mul(ground_truth_volume)).float()
-                union = torch.sum(torch.ge(_volume.add(ground_truth_volume), 1)).float()
-                sample_iou.append((intersection / union).item())
-
-                ious_dict[th].append((intersection / union).item())
-
-            # IoU per taxonomy
-            if taxonomy_id not in test_iou:
-                test_iou[taxonomy_id] = {'n_samples': 0, 'iou': []}
-            test_iou[taxonomy_id]['n_samples'] += 1
-            test_iou[taxonomy_id]['iou'].append(sample_iou)
-
-            # Append generated volumes to TensorBoard
-            if show_voxels:
-                with open("model.binvox", "wb") as f:
-                    v = br.Voxels(torch.ge(generated_volume, 0.2).float().cpu().numpy()[0], (32, 32, 32), (0, 0, 0), 1,
-                                  "xyz")
-                    v.write(f)
-
-                subprocess.run([VIEWVOX_EXE, "model.binvox"])
-
-                with open("model.binvox", "wb") as f:
-                    v = br.Voxels(ground_truth_volume.cpu().numpy()[0], (32, 32, 32), (0, 0, 0), 1, "xyz")
-                    v.write(f)
-
-                subprocess.run([VIEWVOX_EXE, "model.binvox"])
-
-            # Print sample loss and IoU
-            logging.info('Test[%d/%d] Taxonomy = %s Sample = %s EDLoss = %.4f RLoss = %.4f IoU = %s' %
-                         (sample_idx + 1, n_samples, taxonomy_id, sample_name, encoder_loss.item(),
-                          refiner_loss.item(), ['%.4f' % si for si in sample_iou]))
-
-            samples_names.append(sample_name)
-            edlosses.append(encoder_loss.item())
+            encoder_losses.update(np.mean(batch_encoder_losses), batch_size)
             if use_refiner:
-                rlosses.append(refiner_loss.item())
+                refiner_losses.update(np.mean(batch_refiner_losses), batch_size)
+
+            for taxonomy_id, sample_name, edloss, rloss, sample_iou, generated_volume, ground_truth_volume in zip(
+                    taxonomy_ids, sample_names, batch_encoder_losses, batch_refiner_losses, batch_ious.tolist(),
+                    generated_volumes, ground_truth_volumes):
+                sample_idx += 1
+                for th, iou in zip(cfg.TEST.VOXEL_THRESH, sample_iou):
+                    ious_dict[th].append(iou)
+
+                # IoU per taxonomy
+                if taxonomy_id not in test_iou:
+                    test_iou[taxonomy_id] = {'n_samples': 0, 'iou': []}
+                test_iou[taxonomy_id]['n_samples'] += 1
+                test_iou[taxonomy_id]['iou'].append(sample_iou)
+
+                # Append generated volumes to TensorBoard
+                if show_voxels:
+                    with open("model.binvox", "wb") as f:
+                        v = br.Voxels(torch.ge(generated_volume, 0.2).float().cpu().numpy(), (32, 32, 32), (0, 0, 0),
+                                      1, "xyz")
+                        v.write(f)
+
+                    subprocess.run([VIEWVOX_EXE, "model.binvox"])
+
+                    with open("model.binvox", "wb") as f:
+                        v = br.Voxels(ground_truth_volume.cpu().numpy(), (32, 32, 32), (0, 0, 0), 1, "xyz")
+                        v.write(f)
+
+                    subprocess.run([VIEWVOX_EXE, "model.binvox"])
+
+                # Print sample loss and IoU
+                logging.info('Test[%d/%d] Taxonomy = %s Sample = %s EDLoss = %.4f RLoss = %.4f IoU = %s' %
+                             (sample_idx, n_samples, taxonomy_id, sample_name, edloss, rloss,
+                              ['%.4f' % si for si in sample_iou]))
+
+                samples_names.append(sample_name)
+                edlosses.append(edloss.item())
+                if use_refiner:
+                    rlosses.append(rloss.item())
 
     if save_results_to_file:
         save_test_results_to_csv(samples_names, edlosses, rlosses, ious_dict, path_to_csv=results_file_name)
 
     if path_to_times_csv is not None:
-        save_times_to_csv(times_list, n_view_list, path_to_csv=path_to_times_csv)
+        mode = 'folded views' if cfg.NETWORK.FOLD_VIEWS_INTO_BATCH else 'per-view loop'
+        if use_streaming:
+            mode = '%s, streaming chunks of %d' % (mode, cfg.TEST.STREAMING_VIEW_CHUNK_SIZE)
+        if amp_dtype is not None:
+            mode = '%s, %s autocast' % (mode, amp_dtype)
+        save_times_to_csv(times_list, n_view_list, path_to_csv=path_to_times_csv, mode=mode,
+                          batch_sizes=batch_size_list)
 
     # Output testing results
     mean_iou = []
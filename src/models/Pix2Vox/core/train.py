@@ -2,9 +2,10 @@
 #
 # Developed by Haozhe Xie <cshzxie@gmail.com>
 
+import bisect
+import inspect
 import logging
 import os
-import random
 from datetime import datetime as dt
 from time import time
 
@@ -13,9 +14,11 @@ import torch.backends.cudnn
 import torch.utils.data
 from tensorboardX import SummaryWriter
 
+import utils.batch_transforms
 import utils.data_loaders
 import utils.data_transforms
 import utils.helpers
+import utils.mixed_precision
 from core.test import test_net
 from models.decoder import Decoder
 from models.encoder import Encoder
@@ -26,6 +29,34 @@ from utils.average_meter import AverageMeter
 from utils.data_loaders import DatasetType
 
 
+def get_solver(cfg, param_groups):
+    if cfg.TRAIN.POLICY == 'adam':
+        solver_class, solver_kwargs = torch.optim.Adam, {'betas': cfg.TRAIN.BETAS}
+    elif cfg.TRAIN.POLICY == 'sgd':
+        solver_class, solver_kwargs = torch.optim.SGD, {'momentum': cfg.TRAIN.MOMENTUM}
+    else:
+        raise Exception('[FATAL] %s Unknown optimizer %s.' % (dt.now(), cfg.TRAIN.POLICY))
+
+    # Update all parameters with a few multi-tensor kernels instead of a loop over the parameters, where the
+    # installed PyTorch supports it
+    solver_parameters = inspect.signature(solver_class).parameters
+    if 'fused' in solver_parameters and torch.cuda.is_available():
+        solver_kwargs['fused'] = True
+    elif 'foreach' in solver_parameters:
+        solver_kwargs['foreach'] = True
+
+    return solver_class(param_groups, **solver_kwargs)
+
+
+def get_lr_scheduler(solver, lr_milestones, gamma):
+    """MultiStepLR with separate milestones for every parameter group of the solver"""
+    lr_lambdas = [
+        lambda epoch_idx, milestones=sorted(milestones): gamma ** bisect.bisect_right(milestones, epoch_idx)
+        for milestones in lr_milestones
+    ]
+    return torch.optim.lr_scheduler.LambdaLR(solver, lr_lambdas)
+
+
 def train_net(cfg, model_type):
     if model_type == Pix2VoxTypes.Pix2Vox_A or model_type == Pix2VoxTypes.Pix2Vox_Plus_Plus_A:
         use_refiner = True
@@ -38,16 +69,34 @@ def train_net(cfg, model_type):
     # Set up data augmentation
     IMG_SIZE = cfg.CONST.IMG_H, cfg.CONST.IMG_W
     CROP_SIZE = cfg.CONST.CROP_IMG_H, cfg.CONST.CROP_IMG_W
-    train_transforms = utils.data_transforms.Compose([
-        utils.data_transforms.RandomCrop(IMG_SIZE, CROP_SIZE),
-        utils.data_transforms.RandomBackground(cfg.TRAIN.RANDOM_BG_COLOR_RANGE),
-        utils.data_transforms.ColorJitter(cfg.TRAIN.BRIGHTNESS, cfg.TRAIN.CONTRAST, cfg.TRAIN.SATURATION),
-        utils.data_transforms.RandomNoise(cfg.TRAIN.NOISE_STD),
-        utils.data_transforms.Normalize(mean=cfg.DATASET.MEAN, std=cfg.DATASET.STD),
-        utils.data_transforms.RandomFlip(),
-        utils.data_transforms.RandomPermuteRGB(),
-        utils.data_transforms.ToTensor(),
-    ])
+    if cfg.TRAIN.BATCH_AUGMENTATION:
+        # The DataLoader workers only decode and crop the images, the random augmentation runs on whole batches
+        # after they are moved to the device of the models
+        train_transforms = utils.data_transforms.Compose([
+            utils.data_transforms.RandomCrop(IMG_SIZE, CROP_SIZE),
+            utils.data_transforms.AddAlphaChannel(),
+            utils.data_transforms.ToTensor(),
+        ])
+        batch_transforms = utils.data_transforms.Compose([
+            utils.batch_transforms.RandomBackground(cfg.TRAIN.RANDOM_BG_COLOR_RANGE),
+            utils.batch_transforms.ColorJitter(cfg.TRAIN.BRIGHTNESS, cfg.TRAIN.CONTRAST, cfg.TRAIN.SATURATION),
+            utils.batch_transforms.RandomNoise(cfg.TRAIN.NOISE_STD),
+            utils.batch_transforms.Normalize(mean=cfg.DATASET.MEAN, std=cfg.DATASET.STD),
+            utils.batch_transforms.RandomFlip(),
+            utils.batch_transforms.RandomPermuteRGB(),
+        ])
+    else:
+        train_transforms = utils.data_transforms.Compose([
+            utils.data_transforms.RandomCrop(IMG_SIZE, CROP_SIZE),
+            utils.data_transforms.RandomBackground(cfg.TRAIN.RANDOM_BG_COLOR_RANGE),
+            utils.data_transforms.ColorJitter(cfg.TRAIN.BRIGHTNESS, cfg.TRAIN.CONTRAST, cfg.TRAIN.SATURATION),
+            utils.data_transforms.RandomNoise(cfg.TRAIN.NOISE_STD),
+            utils.data_transforms.Normalize(mean=cfg.DATASET.MEAN, std=cfg.DATASET.STD),
+            utils.data_transforms.RandomFlip(),
+            utils.data_transforms.RandomPermuteRGB(),
+            utils.data_transforms.ToTensor(),
+        ])
+        batch_transforms = None
     val_transforms = utils.data_transforms.Compose([
         utils.data_transforms.CenterCrop(IMG_SIZE, CROP_SIZE),
         utils.data_transforms.RandomBackground(cfg.TEST.RANDOM_BG_COLOR_RANGE),
@@ -58,16 +107,29 @@ def train_net(cfg, model_type):
     # Set up data loader
     train_dataset_loader = utils.data_loaders.DATASET_LOADER_MAPPING[cfg.DATASET.TRAIN_DATASET](cfg)
     val_dataset_loader = utils.data_loaders.DATASET_LOADER_MAPPING[cfg.DATASET.TEST_DATASET](cfg)
-    train_data_loader = torch.utils.data.DataLoader(dataset=train_dataset_loader.get_dataset(
-        utils.data_loaders.DatasetType.TRAIN, cfg.CONST.N_VIEWS_RENDERING, train_transforms),
-        batch_size=cfg.CONST.BATCH_SIZE,
-        num_workers=cfg.CONST.NUM_WORKER,
-        pin_memory=True,
-        shuffle=True,
-        drop_last=True)
+    train_dataset = train_dataset_loader.get_dataset(utils.data_loaders.DatasetType.TRAIN,
+                                                     cfg.CONST.N_VIEWS_RENDERING, train_transforms)
+    if cfg.TRAIN.UPDATE_N_VIEWS_RENDERING:
+        # Every batch has its own number of views, from 1 to N_VIEWS_RENDERING, and up to as many images as a batch
+        # with N_VIEWS_RENDERING views
+        train_data_loader = torch.utils.data.DataLoader(
+            dataset=utils.data_loaders.ViewCountDataset(train_dataset),
+            batch_sampler=utils.data_loaders.ViewCountBatchSampler(
+                len(train_dataset), range(1, cfg.CONST.N_VIEWS_RENDERING + 1),
+                cfg.CONST.BATCH_SIZE * cfg.CONST.N_VIEWS_RENDERING),
+            collate_fn=utils.data_loaders.collate_view_count_batch,
+            num_workers=cfg.CONST.NUM_WORKER,
+            pin_memory=True)
+    else:
+        train_data_loader = torch.utils.data.DataLoader(dataset=train_dataset,
+                                                        batch_size=cfg.CONST.BATCH_SIZE,
+                                                        num_workers=cfg.CONST.NUM_WORKER,
+                                                        pin_memory=True,
+                                                        shuffle=True,
+                                                        drop_last=True)
     val_data_loader = torch.utils.data.DataLoader(dataset=val_dataset_loader.get_dataset(
         utils.data_loaders.DatasetType.VAL, cfg.CONST.N_VIEWS_RENDERING, val_transforms),
-        batch_size=1,
+        batch_size=cfg.CONST.BATCH_SIZE,
         num_workers=cfg.CONST.NUM_WORKER,
         pin_memory=True,
         shuffle=False)
@@ -91,51 +153,6 @@ def train_net(cfg, model_type):
         refiner.apply(utils.helpers.init_weights)
     merger.apply(utils.helpers.init_weights)
 
-    # Set up solver
-    if cfg.TRAIN.POLICY == 'adam':
-        encoder_solver = torch.optim.Adam(filter(lambda p: p.requires_grad, encoder.parameters()),
-                                          lr=cfg.TRAIN.ENCODER_LEARNING_RATE,
-                                          betas=cfg.TRAIN.BETAS)
-        decoder_solver = torch.optim.Adam(decoder.parameters(),
-                                          lr=cfg.TRAIN.DECODER_LEARNING_RATE,
-                                          betas=cfg.TRAIN.BETAS)
-        if use_refiner:
-            refiner_solver = torch.optim.Adam(refiner.parameters(),
-                                              lr=cfg.TRAIN.REFINER_LEARNING_RATE,
-                                              betas=cfg.TRAIN.BETAS)
-        merger_solver = torch.optim.Adam(merger.parameters(), lr=cfg.TRAIN.MERGER_LEARNING_RATE, betas=cfg.TRAIN.BETAS)
-    elif cfg.TRAIN.POLICY == 'sgd':
-        encoder_solver = torch.optim.SGD(filter(lambda p: p.requires_grad, encoder.parameters()),
-                                         lr=cfg.TRAIN.ENCODER_LEARNING_RATE,
-                                         momentum=cfg.TRAIN.MOMENTUM)
-        decoder_solver = torch.optim.SGD(decoder.parameters(),
-                                         lr=cfg.TRAIN.DECODER_LEARNING_RATE,
-                                         momentum=cfg.TRAIN.MOMENTUM)
-        if use_refiner:
-            refiner_solver = torch.optim.SGD(refiner.parameters(),
-                                             lr=cfg.TRAIN.REFINER_LEARNING_RATE,
-                                             momentum=cfg.TRAIN.MOMENTUM)
-        merger_solver = torch.optim.SGD(merger.parameters(),
-                                        lr=cfg.TRAIN.MERGER_LEARNING_RATE,
-                                        momentum=cfg.TRAIN.MOMENTUM)
-    else:
-        raise Exception('[FATAL] %s Unknown optimizer %s.' % (dt.now(), cfg.TRAIN.POLICY))
-
-    # Set up learning rate scheduler to decay learning rates dynamically
-    encoder_lr_scheduler = torch.optim.lr_scheduler.MultiStepLR(encoder_solver,
-                                                                milestones=cfg.TRAIN.ENCODER_LR_MILESTONES,
-                                                                gamma=cfg.TRAIN.GAMMA)
-    decoder_lr_scheduler = torch.optim.lr_scheduler.MultiStepLR(decoder_solver,
-                                                                milestones=cfg.TRAIN.DECODER_LR_MILESTONES,
-                                                                gamma=cfg.TRAIN.GAMMA)
-    if use_refiner:
-        refiner_lr_scheduler = torch.optim.lr_scheduler.MultiStepLR(refiner_solver,
-                                                                    milestones=cfg.TRAIN.REFINER_LR_MILESTONES,
-                                                                    gamma=cfg.TRAIN.GAMMA)
-    merger_lr_scheduler = torch.optim.lr_scheduler.MultiStepLR(merger_solver,
-                                                               milestones=cfg.TRAIN.MERGER_LR_MILESTONES,
-                                                               gamma=cfg.TRAIN.GAMMA)
-
     if torch.cuda.is_available():
         encoder = torch.nn.DataParallel(encoder).cuda()
         decoder = torch.nn.DataParallel(decoder).cuda()
@@ -143,8 +160,24 @@ def train_net(cfg, model_type):
             refiner = torch.nn.DataParallel(refiner).cuda()
         merger = torch.nn.DataParallel(merger).cuda()
 
-    # Set up loss functions
-    bce_loss = torch.nn.BCELoss()
+    # Set up solver, after the models are on the GPU for the fused updates
+    param_groups = [
+        {'params': filter(lambda p: p.requires_grad, encoder.parameters()), 'lr': cfg.TRAIN.ENCODER_LEARNING_RATE},
+        {'params': decoder.parameters(), 'lr': cfg.TRAIN.DECODER_LEARNING_RATE},
+        {'params': merger.parameters(), 'lr': cfg.TRAIN.MERGER_LEARNING_RATE},
+    ]
+    lr_milestones = [cfg.TRAIN.ENCODER_LR_MILESTONES, cfg.TRAIN.DECODER_LR_MILESTONES, cfg.TRAIN.MERGER_LR_MILESTONES]
+    if use_refiner:
+        param_groups.append({'params': refiner.parameters(), 'lr': cfg.TRAIN.REFINER_LEARNING_RATE})
+        lr_milestones.append(cfg.TRAIN.REFINER_LR_MILESTONES)
+    solver = get_solver(cfg, param_groups)
+
+    # Set up learning rate scheduler to decay learning rates dynamically
+    lr_scheduler = get_lr_scheduler(solver, lr_milestones, cfg.TRAIN.GAMMA)
+
+    # Set up mixed precision, the loss is computed in fp32 by utils.mixed_precision.binary_cross_entropy
+    amp_dtype = cfg.TRAIN.AMP_DTYPE
+    grad_scaler = utils.mixed_precision.get_grad_scaler(amp_dtype)
 
     # Load pretrained model if exists
     init_epoch = 0
@@ -203,41 +236,43 @@ def train_net(cfg, model_type):
             # Get data from data loader
             rendering_images = utils.helpers.var_or_cuda(rendering_images)
             ground_truth_volumes = utils.helpers.var_or_cuda(ground_truth_volumes)
+            if batch_transforms:
+                rendering_images = batch_transforms(rendering_images)
 
             # Train the encoder, decoder, refiner, and merger
-            image_features = encoder(rendering_images)
-            raw_features, generated_volumes = decoder(image_features)
-
-            if cfg.NETWORK.USE_MERGER and epoch_idx >= cfg.TRAIN.EPOCH_START_USE_MERGER:
-                generated_volumes = merger(raw_features, generated_volumes)
-            else:
-                generated_volumes = torch.mean(generated_volumes, dim=1)
-            encoder_loss = bce_loss(generated_volumes, ground_truth_volumes) * 10
-
-            if use_refiner and epoch_idx >= cfg.TRAIN.EPOCH_START_USE_REFINER:
-                generated_volumes = refiner(generated_volumes)
-                refiner_loss = bce_loss(generated_volumes, ground_truth_volumes) * 10
-            else:
-                refiner_loss = encoder_loss
+            use_merger = cfg.NETWORK.USE_MERGER and epoch_idx >= cfg.TRAIN.EPOCH_START_USE_MERGER
+            train_refiner = use_refiner and epoch_idx >= cfg.TRAIN.EPOCH_START_USE_REFINER
+            with utils.mixed_precision.autocast(amp_dtype):
+                image_features = encoder(rendering_images)
+                raw_features, generated_volumes = decoder(image_features)
+
+                if use_merger:
+                    generated_volumes = merger(raw_features, generated_volumes)
+                else:
+                    generated_volumes = torch.mean(generated_volumes, dim=1)
+                encoder_loss = utils.mixed_precision.binary_cross_entropy(generated_volumes, ground_truth_volumes,
+                                                                          amp_dtype) * 10
+
+                if train_refiner:
+                    generated_volumes = refiner(generated_volumes)
+                    refiner_loss = utils.mixed_precision.binary_cross_entropy(generated_volumes, ground_truth_volumes,
+                                                                              amp_dtype) * 10
+                else:
+                    refiner_loss = encoder_loss
 
             # Gradient decent
-            encoder.zero_grad()
-            decoder.zero_grad()
-            if use_refiner:
-                refiner.zero_grad()
-            merger.zero_grad()
+            solver.zero_grad()
 
-            if use_refiner and epoch_idx >= cfg.TRAIN.EPOCH_START_USE_REFINER:
-                encoder_loss.backward(retain_graph=True)
-                refiner_loss.backward()
+            # One backward of the summed losses gives the same gradients as a backward of each of them, without
+            # keeping the graph alive in between
+            if train_refiner:
+                grad_scaler.scale(encoder_loss + refiner_loss).backward()
             else:
-                encoder_loss.backward()
+                grad_scaler.scale(encoder_loss).backward()
 
-            encoder_solver.step()
-            decoder_solver.step()
-            if use_refiner:
-                refiner_solver.step()
-            merger_solver.step()
+            # Parameters of modules that are not used yet have no gradients and are skipped by the solver
+            grad_scaler.step(solver)
+            grad_scaler.update()
 
             # Append loss to average metrics
             encoder_losses.update(encoder_loss.item())
@@ -258,11 +293,7 @@ def train_net(cfg, model_type):
                  encoder_loss.item(), refiner_loss.item()))
 
         # Adjust learning rate
-        encoder_lr_scheduler.step()
-        decoder_lr_scheduler.step()
-        if use_refiner:
-            refiner_lr_scheduler.step()
-        merger_lr_scheduler.step()
+        lr_scheduler.step()
 
         # Append epoch loss to TensorBoard
         train_writer.add_scalar('EncoderDecoder/EpochLoss', encoder_losses.avg, epoch_idx + 1)
@@ -279,13 +310,6 @@ def train_net(cfg, model_type):
             logging.info('[Epoch %d/%d] EpochTime = %.3f (s) EDLoss = %.4f' %
                          (epoch_idx + 1, cfg.TRAIN.NUM_EPOCHS, epoch_end_time - epoch_start_time, encoder_losses.avg))
 
-        # Update Rendering Views
-        if cfg.TRAIN.UPDATE_N_VIEWS_RENDERING:
-            n_views_rendering = random.randint(1, cfg.CONST.N_VIEWS_RENDERING)
-            train_data_loader.dataset.set_n_views_rendering(n_views_rendering)
-            logging.info('Epoch [%d/%d] Update #RenderingViews to %d' %
-                         (epoch_idx + 2, cfg.TRAIN.NUM_EPOCHS, n_views_rendering))
-
         # Validate the training models
         if use_refiner:
             iou = test_net(cfg, model_type, DatasetType.VAL, epoch_idx + 1, val_data_loader, val_writer, encoder,
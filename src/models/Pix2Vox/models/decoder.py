@@ -140,6 +140,10 @@ class Decoder(torch.nn.Module):
         )
 
     def forward(self, image_features):
+        # See Encoder.forward for why views are folded into the batch only in eval mode
+        if self.cfg.NETWORK.FOLD_VIEWS_INTO_BATCH and not self.training:
+            return self.forward_folded(image_features)
+
         image_features = image_features.permute(1, 0, 2, 3, 4).contiguous()
         image_features = torch.split(image_features, 1, dim=0)
 
@@ -265,3 +269,23 @@ class Decoder(torch.nn.Module):
         # print(gen_volumes.size())      # torch.Size([batch_size, n_views, 32, 32, 32])
         # print(raw_features.size())      # torch.Size([batch_size, n_views, 9, 32, 32, 32])
         return raw_features, gen_volumes
+
+    def forward_folded(self, image_features):
+        batch_size, n_views = image_features.size()[:2]
+        gen_volumes = image_features.reshape(batch_size * n_views, -1, 2, 2, 2)
+        # print(gen_volumes.size())      # torch.Size([batch_size * n_views, n_channels, 2, 2, 2])
+        gen_volumes = self.layer1(gen_volumes)
+        gen_volumes = self.layer2(gen_volumes)
+        gen_volumes = self.layer3(gen_volumes)
+        raw_features = self.layer4(gen_volumes)
+        # print(raw_features.size())     # torch.Size([batch_size * n_views, 8, 32, 32, 32])
+        gen_volumes = self.layer5(raw_features)
+        # print(gen_volumes.size())      # torch.Size([batch_size * n_views, 1, 32, 32, 32])
+        raw_features = torch.cat((raw_features, gen_volumes), dim=1)
+        # print(raw_features.size())     # torch.Size([batch_size * n_views, 9, 32, 32, 32])
+
+        gen_volumes = gen_volumes.view(batch_size, n_views, *gen_volumes.size()[2:])
+        raw_features = raw_features.view(batch_size, n_views, *raw_features.size()[1:])
+        # print(gen_volumes.size())      # torch.Size([batch_size, n_views, 32, 32, 32])
+        # print(raw_features.size())     # torch.Size([batch_size, n_views, 9, 32, 32, 32])
+        return raw_features, gen_volumes
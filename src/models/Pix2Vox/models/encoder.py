@@ -131,6 +131,11 @@ class Encoder(torch.nn.Module):
         )
 
     def forward(self, rendering_images):
+        # Folding views into the batch gives the same features as the per-view loop only when BatchNorm uses its
+        # running statistics, so in training mode the loop is kept
+        if self.cfg.NETWORK.FOLD_VIEWS_INTO_BATCH and not self.training:
+            return self.forward_folded(rendering_images)
+
         rendering_images = rendering_images.permute(1, 0, 2, 3, 4).contiguous()
         rendering_images = torch.split(rendering_images, 1, dim=0)
 
@@ -164,3 +169,27 @@ class Encoder(torch.nn.Module):
 
         image_features = torch.stack(image_features).permute(1, 0, 2, 3, 4).contiguous()
         return image_features
+
+    def forward_folded(self, rendering_images):
+        batch_size, n_views = rendering_images.size()[:2]
+        # print(rendering_images.size())  # torch.Size([batch_size, n_views, img_c, img_h, img_w])
+        rendering_images = rendering_images.reshape(batch_size * n_views, *rendering_images.size()[2:])
+
+        # Chunks bound the memory of a single backbone pass when there are many views
+        image_features = [
+            self.forward_features(images)
+            for images in torch.split(rendering_images, self.cfg.NETWORK.FOLDED_BATCH_SIZE, dim=0)
+        ]
+        image_features = torch.cat(image_features, dim=0)
+        # print(image_features.size())    # torch.Size([batch_size * n_views, c, h, w])
+        return image_features.view(batch_size, n_views, *image_features.size()[1:])
+
+    def forward_features(self, images):
+        if self.model_type.value == Pix2VoxTypes.Pix2Vox_Plus_Plus_A.value or self.model_type.value == Pix2VoxTypes.Pix2Vox_Plus_Plus_F.value:
+            features = self.resnet(images)
+        else:
+            features = self.vgg(images)
+        features = self.layer1(features)
+        features = self.layer2(features)
+        features = self.layer3(features)
+        return features
@@ -83,6 +83,10 @@ class Merger(torch.nn.Module):
         )
 
     def forward(self, raw_features, coarse_volumes):
+        # See Encoder.forward for why views are folded into the batch only in eval mode
+        if self.cfg.NETWORK.FOLD_VIEWS_INTO_BATCH and not self.training:
+            return self.forward_folded(raw_features, coarse_volumes)
+
         n_views_rendering = coarse_volumes.size(1)
         raw_features = torch.split(raw_features, 1, dim=1)
 
@@ -99,21 +103,7 @@ class Merger(torch.nn.Module):
         for i in range(n_views_rendering):
             raw_feature = torch.squeeze(raw_features[i], dim=1)
             # print(raw_feature.size())       # torch.Size([batch_size, 9, 32, 32, 32])
-
-            volume_weight = self.layer1(raw_feature)
-            # print(volume_weight.size())     # torch.Size([batch_size, 16, 32, 32, 32])
-            volume_weight = self.layer2(volume_weight)
-            # print(volume_weight.size())     # torch.Size([batch_size, 8, 32, 32, 32])
-            volume_weight = self.layer3(volume_weight)
-            # print(volume_weight.size())     # torch.Size([batch_size, 4, 32, 32, 32])
-            volume_weight = self.layer4(volume_weight)
-            # print(volume_weight.size())     # torch.Size([batch_size, 2, 32, 32, 32])
-            volume_weight = self.layer5(volume_weight)
-            # print(volume_weight.size())     # torch.Size([batch_size, 1, 32, 32, 32])
-
-            volume_weight = torch.squeeze(volume_weight, dim=1)
-            # print(volume_weight.size())     # torch.Size([batch_size, 32, 32, 32])
-            volume_weights.append(volume_weight)
+            volume_weights.append(self.get_volume_weights_pix2vox(raw_feature))
 
         volume_weights = torch.stack(volume_weights).permute(1, 0, 2, 3, 4).contiguous()
         volume_weights = torch.softmax(volume_weights, dim=1)
@@ -130,23 +120,7 @@ class Merger(torch.nn.Module):
         for i in range(n_views_rendering):
             raw_feature = torch.squeeze(raw_features[i], dim=1)
             # print(raw_feature.size())       # torch.Size([batch_size, 9, 32, 32, 32])
-            volume_weight1 = self.layer1(raw_feature)
-            # print(volume_weight1.size())    # torch.Size([batch_size, 9, 32, 32, 32])
-            volume_weight2 = self.layer2(volume_weight1)
-            # print(volume_weight2.size())    # torch.Size([batch_size, 9, 32, 32, 32])
-            volume_weight3 = self.layer3(volume_weight2)
-            # print(volume_weight3.size())    # torch.Size([batch_size, 9, 32, 32, 32])
-            volume_weight4 = self.layer4(volume_weight3)
-            # print(volume_weight4.size())    # torch.Size([batch_size, 9, 32, 32, 32])
-            volume_weight = self.layer5(torch.cat([
-                volume_weight1, volume_weight2, volume_weight3, volume_weight4
-            ], dim=1))
-            # print(volume_weight.size())     # torch.Size([batch_size, 9, 32, 32, 32])
-            volume_weight = self.layer6(volume_weight)
-            # print(volume_weight.size())     # torch.Size([batch_size, 1, 32, 32, 32])
-            volume_weight = torch.squeeze(volume_weight, dim=1)
-            # print(volume_weight.size())     # torch.Size([batch_size, 32, 32, 32])
-            volume_weights.append(volume_weight)
+            volume_weights.append(self.get_volume_weights_pix2vox_plus_plus(raw_feature))
 
         volume_weights = torch.stack(volume_weights).permute(1, 0, 2, 3, 4).contiguous()
         volume_weights = torch.softmax(volume_weights, dim=1)
@@ -156,3 +130,58 @@ class Merger(torch.nn.Module):
         coarse_volumes = torch.sum(coarse_volumes, dim=1)
 
         return torch.clamp(coarse_volumes, min=0, max=1)
+
+    def forward_folded(self, raw_features, coarse_volumes):
+        volume_weights = self.get_view_scores(raw_features)
+        volume_weights = torch.softmax(volume_weights, dim=1)
+        # print(volume_weights.size())        # torch.Size([batch_size, n_views, 32, 32, 32])
+        coarse_volumes = coarse_volumes * volume_weights
+        coarse_volumes = torch.sum(coarse_volumes, dim=1)
+
+        return torch.clamp(coarse_volumes, min=0, max=1)
+
+    def get_view_scores(self, raw_features):
+        """Unnormalized weights of all views, computed with the views folded into the batch"""
+        batch_size, n_views = raw_features.size()[:2]
+        raw_features = raw_features.reshape(batch_size * n_views, *raw_features.size()[2:])
+        # print(raw_features.size())          # torch.Size([batch_size * n_views, 9, 32, 32, 32])
+
+        if self.model_type.value == Pix2VoxTypes.Pix2Vox_Plus_Plus_A.value or self.model_type.value == Pix2VoxTypes.Pix2Vox_Plus_Plus_F.value:
+            volume_weights = self.get_volume_weights_pix2vox_plus_plus(raw_features)
+        else:
+            volume_weights = self.get_volume_weights_pix2vox(raw_features)
+
+        # print(volume_weights.size())        # torch.Size([batch_size, n_views, 32, 32, 32])
+        return volume_weights.view(batch_size, n_views, *volume_weights.size()[1:])
+
+    def get_volume_weights_pix2vox(self, raw_feature):
+        volume_weight = self.layer1(raw_feature)
+        # print(volume_weight.size())     # torch.Size([batch_size, 16, 32, 32, 32])
+        volume_weight = self.layer2(volume_weight)
+        # print(volume_weight.size())     # torch.Size([batch_size, 8, 32, 32, 32])
+        volume_weight = self.layer3(volume_weight)
+        # print(volume_weight.size())     # torch.Size([batch_size, 4, 32, 32, 32])
+        volume_weight = self.layer4(volume_weight)
+        # print(volume_weight.size())     # torch.Size([batch_size, 2, 32, 32, 32])
+        volume_weight = self.layer5(volume_weight)
+        # print(volume_weight.size())     # torch.Size([batch_size, 1, 32, 32, 32])
+
+        return torch.squeeze(volume_weight, dim=1)
+
+    def get_volume_weights_pix2vox_plus_plus(self, raw_feature):
+        volume_weight1 = self.layer1(raw_feature)
+        # print(volume_weight1.size())    # torch.Size([batch_size, 9, 32, 32, 32])
+        volume_weight2 = self.layer2(volume_weight1)
+        # print(volume_weight2.size())    # torch.Size([batch_size, 9, 32, 32, 32])
+        volume_weight3 = self.layer3(volume_weight2)
+        # print(volume_weight3.size())    # torch.Size([batch_size, 9, 32, 32, 32])
+        volume_weight4 = self.layer4(volume_weight3)
+        # print(volume_weight4.size())    # torch.Size([batch_size, 9, 32, 32, 32])
+        volume_weight = self.layer5(torch.cat([
+            volume_weight1, volume_weight2, volume_weight3, volume_weight4
+        ], dim=1))
+        # print(volume_weight.size())     # torch.Size([batch_size, 9, 32, 32, 32])
+        volume_weight = self.layer6(volume_weight)
+        # print(volume_weight.size())     # torch.Size([batch_size, 1, 32, 32, 32])
+
+        return torch.squeeze(volume_weight, dim=1)
@@ -87,6 +87,11 @@ def test_show_times(path_to_mvs_dataset: str, path_to_outputs: str, path_to_resu
                    weights_path=os.path.join(path_to_outputs, "checkpoints_Pix2VoxTypes.Pix2Vox_A_Mixed_10/checkpoint-best.pth"),
                    n_views=n_views, save_results_to_file=False, show_voxels=False,
                    path_to_times_csv=os.path.join(path_to_results_dir,f"MVS_time_processing_n_views_{n_views}.csv"))
+        test_model(Pix2VoxTypes.Pix2Vox_A, "MVS", 8, os.path.join(path_to_mvs_dataset,"MVS_taxonomy.json"),
+                   weights_path=os.path.join(path_to_outputs, "checkpoints_Pix2VoxTypes.Pix2Vox_A_Mixed_10/checkpoint-best.pth"),
+                   n_views=n_views, save_results_to_file=False, show_voxels=False,
+                   path_to_times_csv=os.path.join(path_to_results_dir,f"MVS_time_processing_per_view_loop_n_views_{n_views}.csv"),
+                   fold_views_into_batch=False)
 
 
 @click.command()
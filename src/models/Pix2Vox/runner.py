@@ -17,13 +17,15 @@ from utils.data_loaders import DatasetType
 
 def test_model(model_type, test_dataset: str, batch_size: int,
                mvs_taxonomy_file: str, results_file_name=None, weights_path=None, dataset_type=DatasetType.TEST,
-               n_views: int = 1, save_results_to_file: bool = True, show_voxels: bool = False, path_to_times_csv=None):
+               n_views: int = 1, save_results_to_file: bool = True, show_voxels: bool = False, path_to_times_csv=None,
+               fold_views_into_batch: bool = True):
     logging.basicConfig(format='[%(levelname)s] %(asctime)s %(message)s', level=logging.DEBUG)
 
     cfg.DATASET.TEST_DATASET = test_dataset
     cfg.DATASETS.MVS.TAXONOMY_FILE_PATH = mvs_taxonomy_file
     cfg.CONST.BATCH_SIZE = batch_size
     cfg.CONST.N_VIEWS_RENDERING = n_views
+    cfg.NETWORK.FOLD_VIEWS_INTO_BATCH = fold_views_into_batch
 
     # Set GPU to use
     if type(cfg.CONST.DEVICE) == str:
@@ -0,0 +1,175 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# This script compares fp32 with autocast to float16 and bfloat16 (see utils.mixed_precision) on random inputs.
+# For every dtype it reports the inference and training throughput, the peak CUDA memory and the IoU of the
+# generated volumes with the fp32 volumes at cfg.TEST.VOXEL_THRESH. Run it from src/models/Pix2Vox:
+#   python -m utils.amp_benchmark -m Pix2Vox_Plus_Plus_A -w Pix2Vox++-A-ShapeNet.pth -v 5
+
+from time import perf_counter
+
+import click
+import torch
+
+import utils.helpers
+import utils.mixed_precision
+from config import cfg
+from core.test import get_volume_ious
+from models.decoder import Decoder
+from models.encoder import Encoder
+from models.merger import Merger
+from models.model_types import Pix2VoxTypes
+from models.refiner import Refiner
+
+DTYPE_NAMES = [None, 'float16', 'bfloat16']
+
+
+def build_models(model_type, weights_path=None):
+    models = {'encoder': Encoder(cfg, model_type), 'decoder': Decoder(cfg, model_type),
+              'merger': Merger(cfg, model_type)}
+    if model_type in (Pix2VoxTypes.Pix2Vox_A, Pix2VoxTypes.Pix2Vox_Plus_Plus_A):
+        models['refiner'] = Refiner(cfg)
+
+    if weights_path is None:
+        for model in models.values():
+            model.apply(utils.helpers.init_weights)
+    else:
+        checkpoint = torch.load(weights_path, map_location='cpu')
+        for name, model in models.items():
+            # Checkpoints are saved from torch.nn.DataParallel models
+            state_dict = checkpoint['%s_state_dict' % name]
+            model.load_state_dict({key.replace('module.', '', 1): value for key, value in state_dict.items()})
+
+    return {name: model.to(utils.mixed_precision.get_device_type()) for name, model in models.items()}
+
+
+def forward(models, rendering_images):
+    image_features = models['encoder'](rendering_images)
+    raw_features, generated_volumes = models['decoder'](image_features)
+    generated_volumes = models['merger'](raw_features, generated_volumes)
+    if 'refiner' in models:
+        generated_volumes = models['refiner'](generated_volumes)
+
+    return generated_volumes
+
+
+def synchronize():
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+
+
+def reset_peak_memory():
+    if torch.cuda.is_available():
+        torch.cuda.reset_peak_memory_stats()
+
+
+def get_peak_memory_mb():
+    return torch.cuda.max_memory_allocated() / 1024 ** 2 if torch.cuda.is_available() else float('nan')
+
+
+def benchmark_inference(models, rendering_images, dtype_name, n_iterations):
+    for model in models.values():
+        model.eval()
+
+    reset_peak_memory()
+    with torch.no_grad(), utils.mixed_precision.autocast(dtype_name):
+        # The first pass also selects the cudnn algorithms
+        generated_volumes = forward(models, rendering_images).float()
+        synchronize()
+        start_time = perf_counter()
+        for _ in range(n_iterations):
+            forward(models, rendering_images)
+        synchronize()
+
+    return generated_volumes, rendering_images.size(0) * n_iterations / (perf_counter() - start_time), \
+        get_peak_memory_mb()
+
+
+def benchmark_training(models, rendering_images, ground_truth_volumes, dtype_name, n_iterations):
+    for model in models.values():
+        model.train()
+    parameters = [parameter for model in models.values() for parameter in model.parameters()]
+    solver = torch.optim.Adam(parameters, lr=cfg.TRAIN.ENCODER_LEARNING_RATE, betas=cfg.TRAIN.BETAS)
+    grad_scaler = utils.mixed_precision.get_grad_scaler(dtype_name)
+
+    reset_peak_memory()
+    for iteration_idx in range(n_iterations + 1):
+        # The first iteration is a warm-up
+        if iteration_idx == 1:
+            synchronize()
+            start_time = perf_counter()
+        with utils.mixed_precision.autocast(dtype_name):
+            generated_volumes = forward(models, rendering_images)
+            loss = utils.mixed_precision.binary_cross_entropy(generated_volumes, ground_truth_volumes, dtype_name)
+        solver.zero_grad()
+        grad_scaler.scale(loss).backward()
+        grad_scaler.step(solver)
+        grad_scaler.update()
+    synchronize()
+
+    return rendering_images.size(0) * n_iterations / (perf_counter() - start_time), get_peak_memory_mb()
+
+
+@click.command()
+@click.option(
+    "-m",
+    "--model-type",
+    "model_type_name",
+    type=click.Choice([model_type.name for model_type in Pix2VoxTypes]),
+    default=Pix2VoxTypes.Pix2Vox_Plus_Plus_F.name,
+)
+@click.option(
+    "-w",
+    "--weights",
+    "weights_path",
+    type=click.Path(dir_okay=False),
+    default=None,
+    help="Checkpoint to load, the models are initialized randomly without it.",
+)
+@click.option("-b", "--batch-size", "batch_size", type=int, default=cfg.CONST.BATCH_SIZE)
+@click.option("-v", "--n-views", "n_views", type=int, default=1)
+@click.option("-n", "--n-iterations", "n_iterations", type=int, default=10)
+@click.option(
+    "-t",
+    "--train",
+    "with_training",
+    type=bool,
+    default=True,
+)
+def main(model_type_name, weights_path, batch_size, n_views, n_iterations, with_training):
+    torch.backends.cudnn.benchmark = True
+    device = utils.mixed_precision.get_device_type()
+    model_type = Pix2VoxTypes[model_type_name]
+    rendering_images = torch.randn(batch_size, n_views, 3, cfg.CONST.IMG_H, cfg.CONST.IMG_W, device=device)
+    ground_truth_volumes = torch.ge(torch.rand(batch_size, 32, 32, 32, device=device), .5).float()
+    thresholds = torch.tensor(cfg.TEST.VOXEL_THRESH, device=device)
+
+    print('%10s %16s %16s %14s %14s %24s' % ('dtype', 'test (samples/s)', 'train (samples/s)', 'test mem (MB)',
+                                            'train mem (MB)', 'IoU with fp32'))
+    fp32_volumes = None
+    for dtype_name in DTYPE_NAMES:
+        # The same weights for every dtype
+        torch.manual_seed(cfg.CONST.RNG_SEED)
+        models = build_models(model_type, weights_path)
+        try:
+            generated_volumes, test_throughput, test_memory = benchmark_inference(models, rendering_images, dtype_name,
+                                                                                 n_iterations)
+            train_throughput, train_memory = benchmark_training(
+                models, rendering_images, ground_truth_volumes, dtype_name,
+                n_iterations) if with_training else (float('nan'), float('nan'))
+        except (RuntimeError, ValueError) as e:
+            print('%10s not supported on %s: %s' % (dtype_name or 'float32', device, str(e).splitlines()[0]))
+            continue
+
+        if fp32_volumes is None:
+            fp32_volumes = generated_volumes
+        # IoU of the thresholded volumes with the fp32 volumes thresholded the same way
+        ious = [get_volume_ious(generated_volumes, torch.ge(fp32_volumes, th).float(), th.view(1)).mean().item()
+                for th in thresholds]
+        print('%10s %16.2f %16.2f %14.1f %14.1f %24s' % (dtype_name or 'float32', test_throughput, train_throughput,
+                                                         test_memory, train_memory,
+                                                         ' '.join('%.4f' % iou for iou in ious)))
+
+
+if __name__ == '__main__':
+    main()  # pylint: disable=no-value-for-parameter
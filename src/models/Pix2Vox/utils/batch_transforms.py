@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+#
+# The random augmentations of utils.data_transforms applied to collated batches of shape (B, V, C, H, W) on the
+# device of the batch. Every sample gets its own random parameters, shared by its views where utils.data_transforms
+# shares them between the views of a sample, so a batch is augmented like its samples would be in the DataLoader
+# workers. The transforms are chained with utils.data_transforms.Compose.
+
+import os
+
+import cv2
+import numpy as np
+import torch
+
+
+def _get_random_permutations(batch_size, n, device):
+    return torch.argsort(torch.rand(batch_size, n, device=device), dim=1)
+
+
+def _get_sample_values(values, rendering_images):
+    """Reshapes per-sample values of shape (B, C) to broadcast to the images"""
+    return values.to(rendering_images.dtype).view(values.size(0), 1, values.size(1), 1, 1)
+
+
+class Normalize(object):
+    def __init__(self, mean, std):
+        self.mean = mean
+        self.std = std
+
+    def __call__(self, rendering_images):
+        mean = torch.tensor(self.mean, dtype=rendering_images.dtype, device=rendering_images.device)
+        std = torch.tensor(self.std, dtype=rendering_images.dtype, device=rendering_images.device)
+        return (rendering_images - mean.view(1, 1, -1, 1, 1)) / std.view(1, 1, -1, 1, 1)
+
+
+class RandomPermuteRGB(object):
+    def __call__(self, rendering_images):
+        batch_size, n_views, img_channels, img_height, img_width = rendering_images.size()
+        random_permutations = _get_random_permutations(batch_size, img_channels, rendering_images.device)
+        return torch.gather(rendering_images, 2,
+                            random_permutations.view(batch_size, 1, img_channels, 1, 1).expand_as(rendering_images))
+
+
+class RandomFlip(object):
+    def __call__(self, rendering_images):
+        # Every view is flipped horizontally with a probability of 0.5
+        batch_size, n_views = rendering_images.size()[:2]
+        flipped = torch.rand(batch_size, n_views, 1, 1, 1, device=rendering_images.device) < .5
+        return torch.where(flipped, torch.flip(rendering_images, [4]), rendering_images)
+
+
+class ColorJitter(object):
+    ATTR_NAMES = ['brightness', 'contrast', 'saturation']
+
+    def __init__(self, brightness, contrast, saturation):
+        self.brightness = brightness
+        self.contrast = contrast
+        self.saturation = saturation
+
+    def __call__(self, rendering_images):
+        batch_size = rendering_images.size(0)
+        device = rendering_images.device
+
+        # Randomize the value and the order of changing brightness, contrast, and saturation of every sample
+        ranges = torch.tensor([self.brightness, self.contrast, self.saturation], device=device)
+        attr_values = 1 + (torch.rand(batch_size, len(self.ATTR_NAMES), device=device) * 2 - 1) * ranges
+        attr_indexes = _get_random_permutations(batch_size, len(self.ATTR_NAMES), device)
+
+        return self.adjust(rendering_images, attr_values, attr_indexes)
+
+    def adjust(self, rendering_images, attr_values, attr_indexes):
+        """
+        Blends the images of every sample with black, their mean intensity and their grayscale images
+
+        Args:
+            rendering_images: Images in BGR format
+                Tensor of shape (B, V, 3, H, W)
+            attr_values: Alpha of the brightness, contrast and saturation blending of every sample
+                Tensor of shape (B, 3)
+            attr_indexes: Order of the attributes of every sample, a permutation of 0, 1, 2
+                Tensor of shape (B, 3)
+
+        Returns:
+            Output images in BGR format
+            Tensor of the same shape as input
+        """
+        for step_idx in range(attr_indexes.size(1)):
+            attr_index = attr_indexes[:, step_idx].view(-1, 1, 1, 1, 1)
+            alpha = torch.gather(attr_values, 1, attr_indexes[:, step_idx:step_idx + 1]).view(-1, 1, 1, 1, 1)
+
+            gs = self._bgr_to_gray(rendering_images)
+            blend_target = torch.where(attr_index == self.ATTR_NAMES.index('contrast'),
+                                       gs.mean(dim=(2, 3, 4), keepdim=True), gs)
+            blend_target = torch.where(attr_index == self.ATTR_NAMES.index('brightness'),
+                                       torch.zeros_like(blend_target), blend_target)
+            rendering_images = alpha * rendering_images + (1 - alpha) * blend_target
+
+        return rendering_images
+
+    def _bgr_to_gray(self, bgr):
+        return 0.114 * bgr[:, :, 0:1] + 0.587 * bgr[:, :, 1:2] + 0.299 * bgr[:, :, 2:3]
+
+
+class RandomNoise(object):
+    def __init__(self,
+                 noise_std,
+                 eigvals=(0.2175, 0.0188, 0.0045),
+                 eigvecs=((-0.5675, 0.7192, 0.4009), (-0.5808, -0.0045, -0.8140), (-0.5836, -0.6948, 0.4203))):
+        self.noise_std = noise_std
+        self.eigvals = eigvals
+        self.eigvecs = eigvecs
+
+    def __call__(self, rendering_images):
+        batch_size, n_views, img_channels = rendering_images.size()[:3]
+        assert (img_channels == 3), "Please use RandomBackground to normalize image channels"
+
+        device = rendering_images.device
+        eigvals = torch.tensor(self.eigvals, device=device)
+        eigvecs = torch.tensor(self.eigvecs, device=device)
+        alpha = torch.randn(batch_size, 1, 3, device=device) * self.noise_std
+        noise_rgb = torch.sum(eigvecs * alpha * eigvals, dim=2)
+
+        return rendering_images + _get_sample_values(torch.flip(noise_rgb, [1]), rendering_images)  # RGB -> BGR
+
+
+class RandomBackground(object):
+    def __init__(self, random_bg_color_range, random_bg_folder_path=None):
+        self.random_bg_color_range = random_bg_color_range
+        self.random_bg_files = []
+        if random_bg_folder_path is not None:
+            self.random_bg_files = os.listdir(random_bg_folder_path)
+            self.random_bg_files = [os.path.join(random_bg_folder_path, rbf) for rbf in self.random_bg_files]
+        self.random_bgs = None
+
+    def __call__(self, rendering_images):
+        batch_size, n_views, img_channels = rendering_images.size()[:3]
+        # If the images have the alpha channel, add the background
+        if not img_channels == 4:
+            return rendering_images
+
+        # Generate a random background color for every sample
+        device = rendering_images.device
+        color_range = torch.tensor(self.random_bg_color_range, dtype=torch.float, device=device)
+        random_bg_colors = torch.floor(color_range[:, 0] + torch.rand(batch_size, 3, device=device) *
+                                       (color_range[:, 1] - color_range[:, 0] + 1)) / 255.
+        bg_colors = _get_sample_values(random_bg_colors, rendering_images)
+
+        # Every view uses the background image of its sample with a probability of 0.5
+        if len(self.random_bg_files) > 0:
+            random_bgs = self._get_random_bgs(device)
+            random_bg_indexes = torch.randint(len(random_bgs), (batch_size, ), device=device)
+            use_random_bg = torch.rand(batch_size, n_views, 1, 1, 1, device=device) < .5
+            bg_colors = torch.where(use_random_bg, random_bgs[random_bg_indexes].unsqueeze(1).to(bg_colors.dtype),
+                                    bg_colors)
+
+        return torch.where(rendering_images[:, :, 3:] == 0, bg_colors, rendering_images[:, :, :3])
+
+    def _get_random_bgs(self, device):
+        # The background images are read once and kept on the device, as a tensor of shape (N, 3, H, W)
+        if self.random_bgs is None or self.random_bgs.device != device:
+            random_bgs = np.stack([cv2.imread(rbf).astype(np.float32) / 255. for rbf in self.random_bg_files])
+            self.random_bgs = torch.from_numpy(random_bgs.transpose(0, 3, 1, 2)).to(device)
+
+        return self.random_bgs
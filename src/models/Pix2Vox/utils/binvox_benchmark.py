@@ -0,0 +1,76 @@
+import io
+import sys
+from time import perf_counter
+
+import numpy as np
+
+import binvox_rw
+
+GRID_SIZES = [32, 64, 128, 256]
+N_REPEATS = 3
+
+
+def write_reference(voxel_model, fp):
+    """ The original per-voxel state machine writer, kept as a baseline. """
+    dense_voxel_data = voxel_model.data.astype(int)
+    voxels_flat = np.transpose(dense_voxel_data, (0, 2, 1)).flatten()
+
+    state = voxels_flat[0]
+    ctr = 0
+    for c in voxels_flat:
+        if c == state:
+            ctr += 1
+            if ctr == 255:
+                fp.write(chr(state).encode('latin-1'))
+                fp.write(chr(ctr).encode('latin-1'))
+                ctr = 0
+        else:
+            fp.write(chr(state).encode('latin-1'))
+            fp.write(chr(ctr).encode('latin-1'))
+            state = c
+            ctr = 1
+    if ctr > 0:
+        fp.write(chr(state).encode('latin-1'))
+        fp.write(chr(ctr).encode('latin-1'))
+
+
+def write_vectorized(voxel_model, fp):
+    dense_voxel_data = voxel_model.data.astype(int)
+    voxels_flat = np.transpose(dense_voxel_data, (0, 2, 1)).flatten()
+    fp.write(binvox_rw.encode_rle(voxels_flat))
+
+
+def make_voxels(grid_size, seed=0):
+    """ A solid sphere with random holes, roughly the occupancy of a voxelized scan. """
+    rng = np.random.RandomState(seed)
+    coords = np.indices((grid_size, grid_size, grid_size)) - (grid_size - 1) / 2.
+    sphere = np.sum(coords ** 2, axis=0) <= (grid_size / 3.) ** 2
+    data = sphere & (rng.rand(grid_size, grid_size, grid_size) > .1)
+    return binvox_rw.Voxels(data, [grid_size] * 3, [0., 0., 0.], 1., 'xyz')
+
+
+def time_writer(writer, voxel_model):
+    best_time = float('inf')
+    for _ in range(N_REPEATS):
+        fp = io.BytesIO()
+        start_time = perf_counter()
+        writer(voxel_model, fp)
+        best_time = min(best_time, perf_counter() - start_time)
+    return best_time, fp.getvalue()
+
+
+def main():
+    grid_sizes = [int(arg) for arg in sys.argv[1:]] or GRID_SIZES
+
+    print('%8s %14s %14s %10s %10s' % ('grid', 'reference (s)', 'vectorized (s)', 'speedup', 'identical'))
+    for grid_size in grid_sizes:
+        voxel_model = make_voxels(grid_size)
+        reference_time, reference_bytes = time_writer(write_reference, voxel_model)
+        vectorized_time, vectorized_bytes = time_writer(write_vectorized, voxel_model)
+        print('%8d %14.4f %14.4f %9.1fx %10s' % (grid_size, reference_time, vectorized_time,
+                                                 reference_time / vectorized_time,
+                                                 reference_bytes == vectorized_bytes))
+
+
+if __name__ == '__main__':
+    main()
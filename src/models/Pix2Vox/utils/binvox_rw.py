@@ -65,8 +65,9 @@ import numpy as np
 
 class Voxels(object):
     """ Holds a binvox model.
-    data is either a three-dimensional numpy boolean array (dense representation)
-    or a two-dimensional numpy float array (coordinate representation).
+    data is either a three-dimensional numpy boolean array (dense representation),
+    a two-dimensional numpy float array (coordinate representation) or a
+    PackedVoxels grid (bit-packed dense representation).
 
     dims, translate and scale are the model metadata.
 
@@ -103,6 +104,76 @@ class Voxels(object):
         write(self, fp)
 
 
+# number of set bits for every possible byte, used when np.bitwise_count is not available
+_POPCOUNT_TABLE = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+
+def popcount(bits):
+    """ Total number of set bits in a uint8 array. """
+    if hasattr(np, 'bitwise_count'):
+        return int(np.bitwise_count(bits).sum(dtype=np.int64))
+    return int(_POPCOUNT_TABLE[bits].sum(dtype=np.int64))
+
+
+# voxels decoded at once by read_as_packed_array, bounds the dense bool array of a read to about 1 MB
+PACKED_READ_CHUNK_SIZE = 1 << 20
+
+
+class PackedVoxels(object):
+    """ Holds a dense occupancy grid packed to 1 bit per voxel.
+
+    bits is the C-order flattened grid packed with numpy.packbits and shape is
+    the shape of the unpacked grid. Unpacking is lazy, so the grid takes
+    d^3 / 8 bytes until to_bool or to_float is called. Occupied voxel counts,
+    intersection and IoU are computed directly on the packed bytes.
+    """
+
+    def __init__(self, bits, shape):
+        self.bits = bits
+        self.shape = tuple(shape)
+
+    @classmethod
+    def from_dense(cls, data):
+        data = np.asarray(data)
+        return cls(np.packbits(data.ravel() != 0), data.shape)
+
+    @property
+    def size(self):
+        return int(np.prod(self.shape))
+
+    @property
+    def nbytes(self):
+        return self.bits.nbytes
+
+    def copy(self):
+        return PackedVoxels(self.bits.copy(), self.shape)
+
+    def to_bool(self):
+        return np.unpackbits(self.bits, count=self.size).view(bool).reshape(self.shape)
+
+    def to_float(self, dtype=np.float32):
+        return np.unpackbits(self.bits, count=self.size).astype(dtype).reshape(self.shape)
+
+    def count(self):
+        return popcount(self.bits)
+
+    def intersection(self, other):
+        self._check_shape(other)
+        return popcount(self.bits & other.bits)
+
+    def union(self, other):
+        self._check_shape(other)
+        return popcount(self.bits | other.bits)
+
+    def iou(self, other):
+        return self.intersection(other) / self.union(other)
+
+    def _check_shape(self, other):
+        if self.shape != other.shape:
+            raise ValueError('[ERROR] Packed voxel grids have different shapes: %s and %s.' %
+                             (self.shape, other.shape))
+
+
 def read_header(fp):
     """ Read binvox header. Mostly meant for internal use.
     """
@@ -153,6 +224,60 @@ def read_as_3d_array(fp, fix_coords=True):
     return Voxels(data, dims, translate, scale, axis_order)
 
 
+def read_as_packed_array(fp, fix_coords=True):
+    """ Read binary binvox format as a bit-packed array.
+
+    Returns the model with a PackedVoxels grid as data, which needs d^3 / 8
+    bytes instead of the 4*(d^3) bytes of read_as_3d_array. Use it to keep
+    many dense models in memory at once.
+
+    The runs are decoded and packed a few x slices at a time. Besides the
+    packed grid, a read needs memory proportional to the file size for the
+    runs and about twice PACKED_READ_CHUNK_SIZE bytes for the dense voxels of
+    one chunk, never the whole dense grid.
+
+    Doesn't do any checks on input except for the '#binvox' line.
+    """
+    dims, translate, scale = read_header(fp)
+    raw_data = np.frombuffer(fp.read(), dtype=np.uint8)
+    values, counts = raw_data[::2] != 0, raw_data[1::2]
+    n_voxels = int(np.prod(dims))
+    run_ends = np.cumsum(counts, dtype=np.int32 if n_voxels < 2 ** 31 else np.int64)
+    if len(run_ends) == 0 or run_ends[-1] != n_voxels:
+        raise ValueError('[ERROR] The binvox runs hold %d voxels instead of %d.' %
+                         (run_ends[-1] if len(run_ends) else 0, n_voxels))
+
+    # fix_coords only swaps the axes within an x slice, so every chunk of
+    # whole slices is packed on its own. Chunks hold a multiple of 8 voxels,
+    # so that their packed bytes can be placed one after another.
+    slice_size = dims[1] * dims[2]
+    slices_per_byte = 8 // np.gcd(slice_size, 8)
+    slices_per_chunk = max(PACKED_READ_CHUNK_SIZE // (slice_size * slices_per_byte), 1) * slices_per_byte
+    bits = np.empty((n_voxels + 7) // 8, dtype=np.uint8)
+    for start_slice in range(0, dims[0], slices_per_chunk):
+        end_slice = min(start_slice + slices_per_chunk, dims[0])
+        start, end = start_slice * slice_size, end_slice * slice_size
+        first_run = np.searchsorted(run_ends, start, side='right')
+        last_run = np.searchsorted(run_ends, end - 1, side='right')
+        chunk_run_ends = run_ends[first_run:last_run + 1]
+        chunk_counts = (np.minimum(chunk_run_ends, end) -
+                        np.maximum(chunk_run_ends - counts[first_run:last_run + 1], start))
+        chunk = np.repeat(values[first_run:last_run + 1], chunk_counts).reshape(end_slice - start_slice, dims[1],
+                                                                                 dims[2])
+        if fix_coords:
+            chunk = np.transpose(chunk, (0, 2, 1))
+        chunk_bits = np.packbits(chunk.ravel())
+        bits[start // 8:start // 8 + len(chunk_bits)] = chunk_bits
+
+    if fix_coords:
+        shape = (dims[0], dims[2], dims[1])
+        axis_order = 'xyz'
+    else:
+        shape = tuple(dims)
+        axis_order = 'xzy'
+    return Voxels(PackedVoxels(bits, shape), dims, translate, scale, axis_order)
+
+
 def read_as_coord_array(fp, fix_coords=True):
     """ Read binary binvox format as coordinates.
 
@@ -172,26 +297,23 @@ def read_as_coord_array(fp, fix_coords=True):
 
     values, counts = raw_data[::2], raw_data[1::2]
 
-    # sz = np.prod(dims)
-    index, end_index = 0, 0
-    end_indices = np.cumsum(counts)
-    indices = np.concatenate(([0], end_indices[:-1])).astype(end_indices.dtype)
+    # start and end linear index of every run of occupied voxels
+    end_indices = np.cumsum(counts, dtype=np.int64)
+    occupied = values.astype(bool)
+    run_lengths = counts[occupied].astype(np.int64)
+    run_starts = end_indices[occupied] - run_lengths
 
-    values = values.astype(np.bool)
-    indices = indices[values]
-    end_indices = end_indices[values]
-
-    nz_voxels = []
-    for index, end_index in zip(indices, end_indices):
-        nz_voxels.extend(range(index, end_index))
-    nz_voxels = np.array(nz_voxels)
+    # expand the runs into linear indices without materializing the whole grid:
+    # every voxel is its run start plus its position within the run
+    run_offsets = np.cumsum(run_lengths) - run_lengths
+    nz_voxels = np.repeat(run_starts - run_offsets, run_lengths) + np.arange(run_lengths.sum(), dtype=np.int64)
     # TODO are these dims correct?
     # according to docs,
     # index = x * wxh + z * width + y; // wxh = width * height = d * d
 
-    x = nz_voxels / (dims[0] * dims[1])
+    x = nz_voxels // (dims[0] * dims[1])
     zwpy = nz_voxels % (dims[0] * dims[1])  # z*w + y
-    z = zwpy / dims[0]
+    z = zwpy // dims[0]
     y = zwpy % dims[0]
     if fix_coords:
         data = np.vstack((x, y, z))
@@ -239,18 +361,12 @@ def sparse_to_dense(voxel_data, dims, dtype=np.bool):
 def write(voxel_model, fp):
     """ Write binary binvox format.
 
-    Note that when saving a model in sparse (coordinate) format, it is first
-    converted to dense format.
+    Models in sparse (coordinate) format are encoded straight from their
+    coordinates, without a conversion to dense format.
 
     Doesn't check if the model is 'sane'.
 
     """
-    if voxel_model.data.ndim == 2:
-        # TODO avoid conversion to dense
-        dense_voxel_data = sparse_to_dense(voxel_model.data, voxel_model.dims).astype(int)
-    else:
-        dense_voxel_data = voxel_model.data.astype(int)
-
     file_header = [
         '#binvox 1\n',
         'dim %s\n' % ' '.join(map(str, voxel_model.dims)),
@@ -264,33 +380,109 @@ def write(voxel_model, fp):
     if voxel_model.axis_order not in ('xzy', 'xyz'):
         raise ValueError('[ERROR] Unsupported voxel model axis order')
 
+    if not isinstance(voxel_model.data, PackedVoxels) and voxel_model.data.ndim == 2:
+        fp.write(encode_sparse_rle(voxel_model.data, voxel_model.dims, voxel_model.axis_order))
+        return
+
+    if isinstance(voxel_model.data, PackedVoxels):
+        dense_voxel_data = voxel_model.data.to_bool().astype(int)
+    else:
+        dense_voxel_data = voxel_model.data.astype(int)
     if voxel_model.axis_order == 'xzy':
         voxels_flat = dense_voxel_data.flatten()
     elif voxel_model.axis_order == 'xyz':
         voxels_flat = np.transpose(dense_voxel_data, (0, 2, 1)).flatten()
 
-    # keep a sort of state machine for writing run length encoding
-    state = voxels_flat[0]
-    ctr = 0
-    for c in voxels_flat:
-        if c == state:
-            ctr += 1
-            # if ctr hits max, dump
-            if ctr == 255:
-                fp.write(chr(state).encode('latin-1'))
-                fp.write(chr(ctr).encode('latin-1'))
-                ctr = 0
-        else:
-            # if switch state, dump
-            fp.write(chr(state).encode('latin-1'))
-            fp.write(chr(ctr).encode('latin-1'))
-            state = c
-            ctr = 1
-    # flush out remainders
-    if ctr > 0:
-        fp.write(chr(state).encode('latin-1'))
-        fp.write(chr(ctr).encode('latin-1'))
+    fp.write(encode_rle(voxels_flat))
+
+
+def encode_rle(voxels_flat):
+    """ Run length encode a flat voxel array into the binvox (value, count) byte pairs.
 
+    Runs longer than 255 are split into chunks of 255. A run whose length is an
+    exact multiple of 255 is followed by a zero-count pair unless it is the last
+    run, which keeps the output byte-identical to the original state machine
+    writer.
+    """
+    voxels_flat = np.asarray(voxels_flat)
+    if voxels_flat.size == 0:
+        return b''
+
+    # start index, length and value of every run of equal voxels
+    run_starts = np.concatenate(([0], np.flatnonzero(np.diff(voxels_flat)) + 1))
+    run_lengths = np.diff(np.append(run_starts, voxels_flat.size))
+    run_values = voxels_flat[run_starts]
+
+    return _runs_to_rle(run_values, run_lengths)
+
+
+def encode_sparse_rle(voxel_data, dims, axis_order='xyz'):
+    """ Run length encode a 3 x N coordinate array into binvox (value, count) byte pairs.
+
+    Works on the linear indices of the occupied voxels only, so memory is
+    proportional to N instead of the grid size. Voxels outside dims are
+    discarded and duplicates are written once, like in sparse_to_dense.
+    The output is identical to encoding the equivalent dense array.
+    """
+    if voxel_data.ndim != 2 or voxel_data.shape[0] != 3:
+        raise ValueError('[ERROR] voxel_data is wrong shape; should be 3xN array.')
+    if np.isscalar(dims):
+        dims = [dims] * 3
+    if axis_order not in ('xzy', 'xyz'):
+        raise ValueError('[ERROR] Unsupported voxel model axis order')
+
+    # truncate to integers and discard voxels that fall outside dims
+    coords = voxel_data.astype(np.int64)
+    valid_ix = ~np.any((coords < 0) | (coords >= np.atleast_2d(dims).T), 0)
+    coords = coords[:, valid_ix]
+
+    # linear index in the binvox layout, y increasing fastest
+    if axis_order == 'xzy':
+        x, z, y = coords
+        linear_indices = (x * dims[1] + z) * dims[2] + y
+    else:
+        x, y, z = coords
+        linear_indices = (x * dims[2] + z) * dims[1] + y
+    linear_indices = np.unique(linear_indices)
+    size = int(np.prod(dims))
+
+    if linear_indices.size == 0:
+        return _runs_to_rle(np.zeros(1, dtype=np.uint8), np.array([size]))
+
+    # occupied runs are maximal ranges of consecutive indices, empty runs are the gaps between them
+    breaks = np.flatnonzero(np.diff(linear_indices) != 1) + 1
+    occupied_starts = linear_indices[np.concatenate(([0], breaks))]
+    occupied_ends = linear_indices[np.append(breaks - 1, linear_indices.size - 1)] + 1
+    empty_lengths = occupied_starts - np.concatenate(([0], occupied_ends[:-1]))
+
+    run_lengths = np.empty(2 * occupied_starts.size + 1, dtype=np.int64)
+    run_lengths[0:-1:2] = empty_lengths
+    run_lengths[1::2] = occupied_ends - occupied_starts
+    run_lengths[-1] = size - occupied_ends[-1]
+    run_values = np.zeros(run_lengths.size, dtype=np.uint8)
+    run_values[1::2] = 1
+
+    # only the leading and trailing empty runs can have zero length
+    keep = run_lengths > 0
+    return _runs_to_rle(run_values[keep], run_lengths[keep])
+
+
+def _runs_to_rle(run_values, run_lengths):
+    """ Split runs into binvox (value, count) byte pairs with counts of at most 255. """
+    # every run is written as full 255 chunks followed by a remainder chunk
+    remainders = run_lengths % 255
+    n_chunks = run_lengths // 255 + 1
+    if remainders[-1] == 0:
+        n_chunks[-1] -= 1
+    last_chunks = np.cumsum(n_chunks) - 1
+
+    counts = np.full(last_chunks[-1] + 1, 255, dtype=np.uint8)
+    counts[last_chunks[:-1]] = remainders[:-1]
+    if remainders[-1] != 0:
+        counts[last_chunks[-1]] = remainders[-1]
+    values = np.repeat(run_values, n_chunks).astype(np.uint8)
+
+    return np.column_stack((values, counts)).tobytes()
 
 if __name__ == '__main__':
     import doctest
@@ -7,15 +7,19 @@ import logging
 import os
 import random
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from enum import Enum, unique
 
 import numpy as np
 import scipy.io
 import scipy.ndimage
+import torch.utils.data
 import torch.utils.data.dataset
 from PIL import Image
 
 import utils.binvox_rw
+from utils.file_index import FileIndex
+from utils.image_cache import ResizedImageCache
 
 
 @unique
@@ -28,14 +32,71 @@ class DatasetType(Enum):
 # //////////////////////////////// = End of DatasetType Class Definition = ///////////////////////////////// #
 
 
+class RenderingImageReader(object):
+    """Reads the rendering images of one sample into one float32 array of shape (V, H, W, C) in [0, 1]
+
+    The images are decoded by a pool of n_threads threads, PIL releases the GIL while it decodes a PNG file, so the
+    views of a sample are decoded in parallel within one DataLoader worker. Every image is copied into the array as
+    soon as it is decoded. The pool is created in the process that reads, DataLoader workers get their own.
+    """
+
+    def __init__(self, n_threads=1):
+        self.n_threads = n_threads
+        self.executor = None
+        self.executor_pid = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['executor'] = None
+        return state
+
+    def read(self, image_paths, read_image):
+        """read_image returns the uint8 image of a path as a NumPy array of shape (H, W, C)"""
+        first_image = self._check_image(read_image(image_paths[0]), image_paths[0])
+        rendering_images = np.empty(shape=(len(image_paths), ) + first_image.shape, dtype=np.float32)
+        rendering_images[0] = first_image
+
+        def read_into(image_idx):
+            rendering_images[image_idx] = self._check_image(read_image(image_paths[image_idx]), image_paths[image_idx])
+
+        if self.n_threads > 1 and len(image_paths) > 2:
+            for future in [self._get_executor().submit(read_into, i) for i in range(1, len(image_paths))]:
+                future.result()
+        else:
+            for image_idx in range(1, len(image_paths)):
+                read_into(image_idx)
+
+        rendering_images /= 255.
+        return rendering_images
+
+    def _check_image(self, rendering_image, image_path):
+        if len(rendering_image.shape) < 3:
+            logging.error('It seems that there is something wrong with the image file %s' % (image_path))
+            sys.exit(2)
+
+        return rendering_image
+
+    def _get_executor(self):
+        # Threads do not survive a fork, a DataLoader worker forked after a read creates its own pool
+        if self.executor is None or self.executor_pid != os.getpid():
+            self.executor = ThreadPoolExecutor(max_workers=self.n_threads)
+            self.executor_pid = os.getpid()
+
+        return self.executor
+
+
+# //////////////////////////// = End of RenderingImageReader Class Definition = ///////////////////////////// #
+
+
 class ShapeNetDataset(torch.utils.data.dataset.Dataset):
     """ShapeNetDataset class used for PyTorch DataLoader"""
 
-    def __init__(self, dataset_type, file_list, n_views_rendering, transforms=None):
+    def __init__(self, dataset_type, file_list, n_views_rendering, transforms=None, n_decode_threads=1):
         self.dataset_type = dataset_type
         self.file_list = file_list
         self.transforms = transforms
         self.n_views_rendering = n_views_rendering
+        self.image_reader = RenderingImageReader(n_decode_threads)
 
     def __len__(self):
         return len(self.file_list)
@@ -66,14 +127,7 @@ class ShapeNetDataset(torch.utils.data.dataset.Dataset):
         else:
             selected_rendering_image_paths = [rendering_image_paths[i] for i in range(self.n_views_rendering)]
 
-        rendering_images = []
-        for image_path in selected_rendering_image_paths:
-            rendering_image = np.asarray(Image.open(image_path)).astype(np.float32) / 255.
-            if len(rendering_image.shape) < 3:
-                logging.error('It seems that there is something wrong with the image file %s' % (image_path))
-                sys.exit(2)
-
-            rendering_images.append(rendering_image)
+        rendering_images = self.image_reader.read(selected_rendering_image_paths, self.read_image)
 
         # Get data of volume
         _, suffix = os.path.splitext(volume_path)
@@ -86,7 +140,10 @@ class ShapeNetDataset(torch.utils.data.dataset.Dataset):
                 volume = utils.binvox_rw.read_as_3d_array(f)
                 volume = volume.data.astype(np.float32)
 
-        return taxonomy_name, sample_name, np.asarray(rendering_images), volume
+        return taxonomy_name, sample_name, rendering_images, volume
+
+    def read_image(self, image_path):
+        return np.asarray(Image.open(image_path))
 
 
 # //////////////////////////////// = End of ShapeNetDataset Class Definition = ///////////////////////////////// #
@@ -97,10 +154,18 @@ class ShapeNetDataLoader:
         self.dataset_taxonomy = None
         self.rendering_image_path_template = cfg.DATASETS.SHAPENET.RENDERING_PATH
         self.volume_path_template = cfg.DATASETS.SHAPENET.VOXEL_PATH
+        self.n_decode_threads = cfg.CONST.N_DECODE_THREADS
 
         # Load all taxonomies of the dataset
         with open(cfg.DATASETS.SHAPENET.TAXONOMY_FILE_PATH, encoding='utf-8') as file:
-            self.dataset_taxonomy = json.loads(file.read())
+            taxonomy_file_content = file.read()
+            self.dataset_taxonomy = json.loads(taxonomy_file_content)
+
+        self.file_index = FileIndex(cfg.DATASETS.FILE_INDEX.INDEX_DIR, [
+            taxonomy_file_content,
+            os.path.abspath(self.rendering_image_path_template),
+            os.path.abspath(self.volume_path_template)
+        ], cfg.DATASETS.FILE_INDEX.REVALIDATE)
 
     def get_dataset(self, dataset_type, n_views_rendering, transforms=None, ratio=1):
         files = []
@@ -124,45 +189,48 @@ class ShapeNetDataLoader:
 
             files.extend(files_of_taxonomy[:number_of_files_to_be_selected])
 
+        self.file_index.save()
         logging.info('Complete collecting files of the dataset. Total files: %d.' % (len(files)))
-        return ShapeNetDataset(dataset_type, files, n_views_rendering, transforms)
+        return ShapeNetDataset(dataset_type, files, n_views_rendering, transforms, self.n_decode_threads)
 
     def get_files_of_taxonomy(self, taxonomy_folder_name, samples):
-        files_of_taxonomy = []
-
-        for sample_idx, sample_name in enumerate(samples):
-            # Get file path of volumes
-            volume_file_path = self.volume_path_template % (taxonomy_folder_name, sample_name)
-            if not os.path.exists(volume_file_path):
-                logging.warn('Ignore sample %s/%s since volume file not exists.' % (taxonomy_folder_name, sample_name))
+        return self.file_index.get_files_of_taxonomy(self, taxonomy_folder_name, samples)
+
+    def get_sample_folders(self, taxonomy_folder_name, sample_name):
+        volume_file_path = self.volume_path_template % (taxonomy_folder_name, sample_name)
+        img_file_path = self.rendering_image_path_template % (taxonomy_folder_name, sample_name, 0)
+        return [os.path.dirname(volume_file_path), os.path.dirname(img_file_path)]
+
+    def get_files_of_sample(self, taxonomy_folder_name, sample_name):
+        # Get file path of volumes
+        volume_file_path = self.volume_path_template % (taxonomy_folder_name, sample_name)
+        if not os.path.exists(volume_file_path):
+            logging.warn('Ignore sample %s/%s since volume file not exists.' % (taxonomy_folder_name, sample_name))
+            return None
+
+        # Get file list of rendering images
+        img_file_path = self.rendering_image_path_template % (taxonomy_folder_name, sample_name, 0)
+        img_folder = os.path.dirname(img_file_path)
+        total_views = len(os.listdir(img_folder))
+        rendering_image_indexes = range(total_views)
+        rendering_images_file_path = []
+        for image_idx in rendering_image_indexes:
+            img_file_path = self.rendering_image_path_template % (taxonomy_folder_name, sample_name, image_idx)
+            if not os.path.exists(img_file_path):
                 continue
 
-            # Get file list of rendering images
-            img_file_path = self.rendering_image_path_template % (taxonomy_folder_name, sample_name, 0)
-            img_folder = os.path.dirname(img_file_path)
-            total_views = len(os.listdir(img_folder))
-            rendering_image_indexes = range(total_views)
-            rendering_images_file_path = []
-            for image_idx in rendering_image_indexes:
-                img_file_path = self.rendering_image_path_template % (taxonomy_folder_name, sample_name, image_idx)
-                if not os.path.exists(img_file_path):
-                    continue
-
-                rendering_images_file_path.append(img_file_path)
-
-            if len(rendering_images_file_path) == 0:
-                logging.warn('Ignore sample %s/%s since image files not exists.' % (taxonomy_folder_name, sample_name))
-                continue
+            rendering_images_file_path.append(img_file_path)
 
-            # Append to the list of rendering images
-            files_of_taxonomy.append({
-                'taxonomy_name': taxonomy_folder_name,
-                'sample_name': sample_name,
-                'rendering_images': rendering_images_file_path,
-                'volume': volume_file_path,
-            })
+        if len(rendering_images_file_path) == 0:
+            logging.warn('Ignore sample %s/%s since image files not exists.' % (taxonomy_folder_name, sample_name))
+            return None
 
-        return files_of_taxonomy
+        return {
+            'taxonomy_name': taxonomy_folder_name,
+            'sample_name': sample_name,
+            'rendering_images': rendering_images_file_path,
+            'volume': volume_file_path,
+        }
 
 
 # /////////////////////////////// = End of ShapeNetDataLoader Class Definition = /////////////////////////////// #
@@ -171,12 +239,15 @@ class ShapeNetDataLoader:
 class MVSDataset(torch.utils.data.dataset.Dataset):
     """MVSDataset class used for PyTorch DataLoader"""
 
-    def __init__(self, dataset_type, file_list, n_views_rendering, transforms=None, target_size=(224, 224)):
+    def __init__(self, dataset_type, file_list, n_views_rendering, transforms=None, target_size=(224, 224),
+                 image_cache=None, n_decode_threads=1):
         self.dataset_type = dataset_type
         self.file_list = file_list
         self.transforms = transforms
         self.n_views_rendering = n_views_rendering
         self.target_size = target_size
+        self.image_cache = image_cache
+        self.image_reader = RenderingImageReader(n_decode_threads)
 
     def __len__(self):
         return len(self.file_list)
@@ -207,17 +278,7 @@ class MVSDataset(torch.utils.data.dataset.Dataset):
         else:
             selected_rendering_image_paths = [rendering_image_paths[i] for i in range(self.n_views_rendering)]
 
-        rendering_images = []
-        for image_path in selected_rendering_image_paths:
-            pil_image = Image.open(image_path)
-            image_resized = pil_image.resize(self.target_size)
-            rendering_image = np.asarray(image_resized).astype(np.float32) / 255.
-
-            if len(rendering_image.shape) < 3:
-                logging.error('It seems that there is something wrong with the image file %s' % (image_path))
-                sys.exit(2)
-
-            rendering_images.append(rendering_image)
+        rendering_images = self.image_reader.read(selected_rendering_image_paths, self.read_image)
 
         # Get data of volume
         _, suffix = os.path.splitext(volume_path)
@@ -230,7 +291,13 @@ class MVSDataset(torch.utils.data.dataset.Dataset):
                 volume = utils.binvox_rw.read_as_3d_array(f)
                 volume = volume.data.astype(np.float32)
 
-        return taxonomy_name, sample_name, np.asarray(rendering_images), volume
+        return taxonomy_name, sample_name, rendering_images, volume
+
+    def read_image(self, image_path):
+        if self.image_cache is not None:
+            return self.image_cache.read(image_path)
+
+        return np.asarray(Image.open(image_path).resize(self.target_size))
 
 
 # //////////////////////////////// = End of MVSDataset Class Definition = ///////////////////////////////// #
@@ -242,10 +309,21 @@ class MVSDataLoader:
         self.rendering_image_path_template = cfg.DATASETS.MVS.RENDERING_PATH
         self.volume_path_template = cfg.DATASETS.MVS.VOXEL_PATH
         self.target_size = (cfg.CONST.IMG_W, cfg.CONST.IMG_H)
+        self.n_decode_threads = cfg.CONST.N_DECODE_THREADS
+        self.image_cache = None
+        if cfg.DATASETS.MVS.IMAGE_CACHE_DIR is not None:
+            self.image_cache = ResizedImageCache(cfg.DATASETS.MVS.IMAGE_CACHE_DIR, self.target_size)
 
         # Load all taxonomies of the dataset
         with open(cfg.DATASETS.MVS.TAXONOMY_FILE_PATH, encoding='utf-8') as file:
-            self.dataset_taxonomy = json.loads(file.read())
+            taxonomy_file_content = file.read()
+            self.dataset_taxonomy = json.loads(taxonomy_file_content)
+
+        self.file_index = FileIndex(cfg.DATASETS.FILE_INDEX.INDEX_DIR, [
+            taxonomy_file_content,
+            os.path.abspath(self.rendering_image_path_template),
+            os.path.abspath(self.volume_path_template)
+        ], cfg.DATASETS.FILE_INDEX.REVALIDATE)
 
     def get_dataset(self, dataset_type, n_views_rendering, transforms=None):
         files = []
@@ -265,48 +343,53 @@ class MVSDataLoader:
 
             files.extend(self.get_files_of_taxonomy(taxonomy_folder_name, samples))
 
+        self.file_index.save()
         logging.info('Complete collecting files of the dataset. Total files: %d.' % (len(files)))
-        return MVSDataset(dataset_type, files, n_views_rendering, transforms, self.target_size)
+        return MVSDataset(dataset_type, files, n_views_rendering, transforms, self.target_size, self.image_cache,
+                          self.n_decode_threads)
 
     def get_files_of_taxonomy(self, taxonomy_folder_name, samples):
-        files_of_taxonomy = []
-
-        for sample_idx, sample_name in enumerate(samples):
-            # Get file path of volumes
-            sample_number = int(sample_name[4:])
-            sample_str = f"{int(sample_number):03d}"
-
-            volume_file_path = self.volume_path_template % (sample_str)
-            if not os.path.exists(volume_file_path):
-                logging.warn('Ignore sample %s/%s since volume file not exists.' % (taxonomy_folder_name, sample_name))
+        return self.file_index.get_files_of_taxonomy(self, taxonomy_folder_name, samples)
+
+    def get_sample_folders(self, taxonomy_folder_name, sample_name):
+        sample_number = int(sample_name[4:])
+        volume_file_path = self.volume_path_template % (f"{sample_number:03d}")
+        img_file_path = self.rendering_image_path_template % (sample_number, 1)
+        return [os.path.dirname(volume_file_path), os.path.dirname(img_file_path)]
+
+    def get_files_of_sample(self, taxonomy_folder_name, sample_name):
+        # Get file path of volumes
+        sample_number = int(sample_name[4:])
+        sample_str = f"{int(sample_number):03d}"
+
+        volume_file_path = self.volume_path_template % (sample_str)
+        if not os.path.exists(volume_file_path):
+            logging.warn('Ignore sample %s/%s since volume file not exists.' % (taxonomy_folder_name, sample_name))
+            return None
+
+        # Get file list of rendering images
+        img_file_path = self.rendering_image_path_template % (sample_number, 1)
+        img_folder = os.path.dirname(img_file_path)
+        total_views = len(os.listdir(img_folder))
+        rendering_image_indexes = range(total_views)
+        rendering_images_file_path = []
+        for image_idx in rendering_image_indexes:
+            img_file_path = self.rendering_image_path_template % (sample_number, image_idx + 1)
+            if not os.path.exists(img_file_path):
                 continue
 
-            # Get file list of rendering images
-            img_file_path = self.rendering_image_path_template % (sample_number, 1)
-            img_folder = os.path.dirname(img_file_path)
-            total_views = len(os.listdir(img_folder))
-            rendering_image_indexes = range(total_views)
-            rendering_images_file_path = []
-            for image_idx in rendering_image_indexes:
-                img_file_path = self.rendering_image_path_template % (sample_number, image_idx + 1)
-                if not os.path.exists(img_file_path):
-                    continue
-
-                rendering_images_file_path.append(img_file_path)
-
-            if len(rendering_images_file_path) == 0:
-                logging.warn('Ignore sample %s/%s since image files not exists.' % (taxonomy_folder_name, sample_name))
-                continue
+            rendering_images_file_path.append(img_file_path)
 
-            # Append to the list of rendering images
-            files_of_taxonomy.append({
-                'taxonomy_name': taxonomy_folder_name,
-                'sample_name': sample_name,
-                'rendering_images': rendering_images_file_path,
-                'volume': volume_file_path,
-            })
+        if len(rendering_images_file_path) == 0:
+            logging.warn('Ignore sample %s/%s since image files not exists.' % (taxonomy_folder_name, sample_name))
+            return None
 
-        return files_of_taxonomy
+        return {
+            'taxonomy_name': taxonomy_folder_name,
+            'sample_name': sample_name,
+            'rendering_images': rendering_images_file_path,
+            'volume': volume_file_path,
+        }
 
 
 # /////////////////////////////// = End of MVSDataLoader Class Definition = /////////////////////////////// #
@@ -362,8 +445,221 @@ class MixedDataLoader:
 # /////////////////////////////// = End of MixedDataLoader Class Definition = /////////////////////////////// #
 
 
+def get_shard_paths(shard_dir, dataset_name, dataset_type):
+    """Paths of the images, volumes and index files of one packed dataset split"""
+    prefix = os.path.join(shard_dir, '%s_%s' % (dataset_name, dataset_type.name.lower()))
+    return prefix + '_images.npy', prefix + '_volumes.npy', prefix + '_index.json'
+
+
+class ShardedDataset(torch.utils.data.dataset.Dataset):
+    """ShardedDataset class used for PyTorch DataLoader
+
+    Reads samples packed by utils/shard_packer.py. Rendering images are stored as decoded uint8 arrays of a fixed
+    shape and volumes as bit-packed grids, both in .npy files that are memory-mapped, so a sample is read without
+    decoding a PNG or a binvox file.
+    """
+
+    def __init__(self, dataset_type, file_list, n_views_rendering, images_path, volumes_path, volume_shape,
+                 transforms=None):
+        self.dataset_type = dataset_type
+        self.file_list = file_list
+        self.transforms = transforms
+        self.n_views_rendering = n_views_rendering
+        self.images_path = images_path
+        self.volumes_path = volumes_path
+        self.volume_shape = volume_shape
+        self.images = None
+        self.volumes = None
+
+    def __len__(self):
+        return len(self.file_list)
+
+    def __getitem__(self, idx):
+        taxonomy_name, sample_name, rendering_images, volume = self.get_datum(idx)
+
+        if self.transforms:
+            rendering_images = self.transforms(rendering_images)
+
+        return taxonomy_name, sample_name, rendering_images, volume
+
+    def __getstate__(self):
+        # Memory maps are reopened in every DataLoader worker instead of being pickled with their contents
+        state = self.__dict__.copy()
+        state['images'] = None
+        state['volumes'] = None
+        return state
+
+    def set_n_views_rendering(self, n_views_rendering):
+        self.n_views_rendering = n_views_rendering
+
+    def get_datum(self, idx):
+        if self.images is None:
+            self.images = np.load(self.images_path, mmap_mode='r')
+            self.volumes = np.load(self.volumes_path, mmap_mode='r')
+
+        taxonomy_name = self.file_list[idx]['taxonomy_name']
+        sample_name = self.file_list[idx]['sample_name']
+        image_offset = self.file_list[idx]['image_offset']
+        n_views = self.file_list[idx]['n_views']
+
+        # Get data of rendering images
+        if self.dataset_type == DatasetType.TRAIN:
+            selected_views = random.sample(range(n_views), self.n_views_rendering)
+        else:
+            selected_views = range(self.n_views_rendering)
+        selected_images = self.images[[image_offset + i for i in selected_views]]
+        rendering_images = selected_images.astype(np.float32) / 255.
+
+        # Get data of volume
+        volume = utils.binvox_rw.PackedVoxels(self.volumes[self.file_list[idx]['volume_index']], self.volume_shape)
+        volume = volume.to_float()
+
+        return taxonomy_name, sample_name, rendering_images, volume
+
+
+# //////////////////////////////// = End of ShardedDataset Class Definition = ///////////////////////////////// #
+
+
+class ShardedDataLoader:
+    """Loads the splits of one source dataset from the shards written by utils/shard_packer.py"""
+
+    dataset_name = None
+
+    def __init__(self, cfg):
+        self.shard_dir = cfg.DATASETS.SHARDED.SHARD_DIR
+
+    def get_dataset(self, dataset_type, n_views_rendering, transforms=None, ratio=1):
+        images_path, volumes_path, index_path = get_shard_paths(self.shard_dir, self.dataset_name, dataset_type)
+        with open(index_path, encoding='utf-8') as file:
+            index = json.loads(file.read())
+
+        # Keep the same share of samples of each taxonomy as the loaders reading the raw files
+        samples_of_taxonomies = {}
+        for sample in index['samples']:
+            samples_of_taxonomies.setdefault(sample['taxonomy_name'], []).append(sample)
+        files = []
+        for samples in samples_of_taxonomies.values():
+            files.extend(samples[:round(len(samples) / ratio)])
+
+        logging.info('Complete collecting files of the dataset %s from %s. Total files: %d.' %
+                     (self.dataset_name, index_path, len(files)))
+        return ShardedDataset(dataset_type, files, n_views_rendering, images_path, volumes_path,
+                              tuple(index['volume_shape']), transforms)
+
+
+class ShapeNetShardedDataLoader(ShardedDataLoader):
+    dataset_name = 'ShapeNet'
+
+
+class MVSShardedDataLoader(ShardedDataLoader):
+    dataset_name = 'MVS'
+
+
+class MixedShardedDataLoader:
+    def __init__(self, cfg):
+        self.shapenet_data_loader = ShapeNetShardedDataLoader(cfg)
+        self.mvs_data_loader = MVSShardedDataLoader(cfg)
+        self.shapenet_ratio = cfg.CONST.SHAPENET_RATIO
+
+    def get_dataset(self, dataset_type, n_views_rendering, transforms=None):
+        return MixedDataset(self.shapenet_data_loader.get_dataset(dataset_type, n_views_rendering, transforms,
+                                                                  ratio=self.shapenet_ratio),
+                            self.mvs_data_loader.get_dataset(dataset_type, n_views_rendering, transforms))
+
+
+# /////////////////////////////// = End of ShardedDataLoader Class Definition = /////////////////////////////// #
+
+
+class ViewCountDataset(torch.utils.data.dataset.Dataset):
+    """Reads the samples of dataset with the view count given with every index, as (idx, n_views_rendering)
+
+    Used with ViewCountBatchSampler. Every DataLoader worker has its own copy of the dataset and reads one sample at
+    a time, so the view count is set on the dataset right before each sample is read.
+    """
+
+    def __init__(self, dataset):
+        self.dataset = dataset
+
+    def __len__(self):
+        return len(self.dataset)
+
+    def __getitem__(self, idx_and_n_views):
+        idx, n_views_rendering = idx_and_n_views
+        self.dataset.set_n_views_rendering(n_views_rendering)
+        return self.dataset[idx]
+
+
+# ////////////////////////////// = End of ViewCountDataset Class Definition = ////////////////////////////// #
+
+
+class ViewCountBatchSampler(torch.utils.data.Sampler):
+    """Batches of shuffled samples, with a view count drawn at random for every batch
+
+    All samples of a batch are read with the same view count, so the rendering images still collate into one
+    tensor of shape (B, V, C, H, W). The batch size shrinks as the view count grows, so that every batch holds about
+    n_images_per_batch images: max(1, n_images_per_batch // n_views). Incomplete batches at the end of an epoch are
+    dropped. The batches of an epoch are planned when its length is asked for or when it starts, so len() is exact.
+    """
+
+    def __init__(self, n_samples, n_views_choices, n_images_per_batch):
+        self.n_samples = n_samples
+        self.n_views_choices = list(n_views_choices)
+        self.n_images_per_batch = n_images_per_batch
+        self.batches = None
+
+    def __iter__(self):
+        if self.batches is None:
+            self.batches = self._plan_batches()
+
+        # The plan is kept until the epoch ends, the DataLoader may ask for the length while it iterates
+        for batch in self.batches:
+            yield batch
+        self.batches = None
+
+    def __len__(self):
+        if self.batches is None:
+            self.batches = self._plan_batches()
+
+        return len(self.batches)
+
+    def get_batch_size(self, n_views_rendering):
+        return max(1, self.n_images_per_batch // n_views_rendering)
+
+    def _plan_batches(self):
+        indexes = list(range(self.n_samples))
+        random.shuffle(indexes)
+
+        batches = []
+        start = 0
+        while True:
+            n_views_rendering = random.choice(self.n_views_choices)
+            batch_size = self.get_batch_size(n_views_rendering)
+            if start + batch_size > self.n_samples:
+                break
+
+            batches.append([(idx, n_views_rendering) for idx in indexes[start:start + batch_size]])
+            start += batch_size
+
+        return batches
+
+
+def collate_view_count_batch(batch):
+    """default_collate for the batches of ViewCountBatchSampler, which fails if their view counts differ"""
+    n_views = set(len(rendering_images) for _, _, rendering_images, _ in batch)
+    if len(n_views) > 1:
+        raise ValueError('[ERROR] A batch mixes samples with %s views.' % sorted(n_views))
+
+    return torch.utils.data.dataloader.default_collate(batch)
+
+
+# //////////////////////////// = End of ViewCountBatchSampler Class Definition = //////////////////////////// #
+
+
 DATASET_LOADER_MAPPING = {
     'ShapeNet': ShapeNetDataLoader,
     'MVS': MVSDataLoader,
-    'Mixed': MixedDataLoader
+    'Mixed': MixedDataLoader,
+    'ShapeNetSharded': ShapeNetShardedDataLoader,
+    'MVSSharded': MVSShardedDataLoader,
+    'MixedSharded': MixedShardedDataLoader
 }
@@ -21,6 +21,9 @@ class Compose(object):
     >>>     transforms.RandomBackground(),
     >>>     transforms.CenterCrop(127, 127, 3),
     >>>  ])
+
+    The crops and RandomBackground write all views into one preallocated float32 array of shape (V, H, W, C), the
+    other transforms modify that array in place, so the input images should not be used after the transforms.
     """
 
     def __init__(self, transforms):
@@ -89,7 +92,8 @@ class CenterCrop(object):
             return rendering_images
 
         crop_size_c = rendering_images[0].shape[2]
-        processed_images = np.empty(shape=(0, self.img_size_h, self.img_size_w, crop_size_c))
+        processed_images = np.empty(shape=(len(rendering_images), self.img_size_h, self.img_size_w, crop_size_c),
+                                    dtype=np.float32)
         for img_idx, img in enumerate(rendering_images):
             img_height, img_width, _ = img.shape
 
@@ -151,7 +155,7 @@ class CenterCrop(object):
 
                 processed_image = cv2.resize(img[y_top:y_bottom, x_left:x_right], (self.img_size_w, self.img_size_h))
 
-            processed_images = np.append(processed_images, [processed_image], axis=0)
+            processed_images[img_idx] = processed_image
             # Debug
             # fig = plt.figure()
             # ax1 = fig.add_subplot(1, 2, 1)
@@ -183,7 +187,8 @@ class RandomCrop(object):
             return rendering_images
 
         crop_size_c = rendering_images[0].shape[2]
-        processed_images = np.empty(shape=(0, self.img_size_h, self.img_size_w, crop_size_c))
+        processed_images = np.empty(shape=(len(rendering_images), self.img_size_h, self.img_size_w, crop_size_c),
+                                    dtype=np.float32)
         for img_idx, img in enumerate(rendering_images):
             img_height, img_width, _ = img.shape
 
@@ -247,11 +252,24 @@ class RandomCrop(object):
 
                 processed_image = cv2.resize(img[y_top:y_bottom, x_left:x_right], (self.img_size_w, self.img_size_h))
 
-            processed_images = np.append(processed_images, [processed_image], axis=0)
+            processed_images[img_idx] = processed_image
 
         return processed_images
 
 
+class AddAlphaChannel(object):
+    """Adds an opaque alpha channel to RGB images, so that they can be collated with RGBA images and get their
+    background from utils.batch_transforms.RandomBackground, which leaves them unchanged like RandomBackground."""
+
+    def __call__(self, rendering_images):
+        if len(rendering_images) == 0 or rendering_images[0].shape[2] == 4:
+            return rendering_images
+
+        processed_images = np.ones(shape=rendering_images.shape[:3] + (4, ), dtype=np.float32)
+        processed_images[..., :3] = rendering_images
+        return processed_images
+
+
 class RandomFlip(object):
     def __call__(self, rendering_images):
         assert (isinstance(rendering_images, np.ndarray))
@@ -273,9 +291,8 @@ class ColorJitter(object):
         if len(rendering_images) == 0:
             return rendering_images
 
-        # Allocate new space for storing processed images
-        img_height, img_width, img_channels = rendering_images[0].shape
-        processed_images = np.empty(shape=(0, img_height, img_width, img_channels))
+        # The images are adjusted in place
+        rendering_images = np.asarray(rendering_images, dtype=np.float32)
 
         # Randomize the value of changing brightness, contrast, and saturation
         brightness = 1 + np.random.uniform(low=-self.brightness, high=self.brightness)
@@ -288,40 +305,39 @@ class ColorJitter(object):
         attr_indexes = np.array(range(len(attr_names)))  # The order of changing attrs
         np.random.shuffle(attr_indexes)
 
-        for img_idx, img in enumerate(rendering_images):
-            processed_image = img
-            for idx in attr_indexes:
-                processed_image = self._adjust_image_attr(processed_image, attr_names[idx], attr_values[idx])
-
-            processed_images = np.append(processed_images, [processed_image], axis=0)
-            # print('ColorJitter', np.mean(ori_img), np.mean(processed_image))
-            # fig = plt.figure(figsize=(8, 4))
-            # ax1 = fig.add_subplot(1, 2, 1)
-            # ax1.imshow(ori_img)
-            # ax2 = fig.add_subplot(1, 2, 2)
-            # ax2.imshow(processed_image)
-            # plt.show()
-        return processed_images
+        # All views are adjusted at once
+        for idx in attr_indexes:
+            self._adjust_image_attr(rendering_images, attr_names[idx], attr_values[idx])
+
+        # print('ColorJitter', np.mean(ori_img), np.mean(rendering_images))
+        # fig = plt.figure(figsize=(8, 4))
+        # ax1 = fig.add_subplot(1, 2, 1)
+        # ax1.imshow(ori_img)
+        # ax2 = fig.add_subplot(1, 2, 2)
+        # ax2.imshow(rendering_images[0])
+        # plt.show()
+        return rendering_images
 
     def _adjust_image_attr(self, img, attr_name, attr_value):
         """
         Adjust or randomize the specified attribute of the image
 
         Args:
-            img: Image in BGR format
-                Numpy array of shape (h, w, 3)
+            img: Images in BGR format, adjusted in place
+                Numpy array of shape (n, h, w, 3) or (h, w, 3)
             attr_name: Image attribute to adjust or randomize
                        'brightness', 'saturation', or 'contrast'
             attr_value: the alpha for blending is randomly drawn from [1 - d, 1 + d]
 
         Returns:
-            Output image in BGR format
+            Output images in BGR format
             Numpy array of the same shape as input
         """
         gs = self._bgr_to_gray(img)
 
         if attr_name == 'contrast':
-            img = self._alpha_blend(img, np.mean(gs[:, :, 0]), attr_value)
+            # The mean intensity of every image
+            img = self._alpha_blend(img, np.mean(gs, axis=(-3, -2, -1), keepdims=True), attr_value)
         elif attr_name == 'saturation':
             img = self._alpha_blend(img, gs, attr_value)
         elif attr_name == 'brightness':
@@ -338,15 +354,16 @@ class ColorJitter(object):
                 2. Output image has three repeated channels, other than a single channel
 
         Args:
-            bgr: Image in BGR format
-                 Numpy array of shape (h, w, 3)
+            bgr: Images in BGR format
+                 Numpy array of shape (n, h, w, 3) or (h, w, 3)
 
         Returns:
-            gs: Grayscale image
-                Numpy array of the same shape as input; the three channels are the same
+            gs: Grayscale images
+                Numpy array of shape (n, h, w, 1) or (h, w, 1), which broadcasts to the three channels
         """
-        ch = 0.114 * bgr[:, :, 0] + 0.587 * bgr[:, :, 1] + 0.299 * bgr[:, :, 2]
-        gs = np.dstack((ch, ch, ch))
+        gs = 0.114 * bgr[..., 0:1]
+        gs += 0.587 * bgr[..., 1:2]
+        gs += 0.299 * bgr[..., 2:3]
         return gs
 
     def _alpha_blend(self, im1, im2, alpha):
@@ -355,7 +372,7 @@ class ColorJitter(object):
 
         Args:
             im1, im2: Image or scalar
-                Numpy array and a scalar or two numpy arrays of the same shape
+                Numpy array and a scalar or two numpy arrays that broadcast to im1, im1 is blended in place
             alpha: Weight of im1
                 Float ranging usually from 0 to 1
 
@@ -363,8 +380,9 @@ class ColorJitter(object):
             im_blend: Blended image -- alpha * im1 + (1 - alpha) * im2
                 Numpy array of the same shape as input image
         """
-        im_blend = alpha * im1 + (1 - alpha) * im2
-        return im_blend
+        im1 *= alpha
+        im1 += (1 - alpha) * im2
+        return im1
 
 
 class RandomNoise(object):
@@ -390,29 +408,23 @@ class RandomNoise(object):
                 axis=1
             )
 
-        # Allocate new space for storing processed images
-        img_height, img_width, img_channels = rendering_images[0].shape
+        # The noise is added to all images in place
+        rendering_images = np.asarray(rendering_images, dtype=np.float32)
+        img_channels = rendering_images.shape[-1]
         assert (img_channels == 3), "Please use RandomBackground to normalize image channels"
-        processed_images = np.empty(shape=(0, img_height, img_width, img_channels))
 
-        for img_idx, img in enumerate(rendering_images):
-            processed_image = img[:, :, ::-1]  # BGR -> RGB
-            for i in range(img_channels):
-                processed_image[:, :, i] += noise_rgb[i]
-
-            processed_image = processed_image[:, :, ::-1]  # RGB -> BGR
-            processed_images = np.append(processed_images, [processed_image], axis=0)
-            # from copy import deepcopy
-            # ori_img = deepcopy(img)
-            # print(noise_rgb, np.mean(processed_image), np.mean(ori_img))
-            # print('RandomNoise', np.mean(ori_img), np.mean(processed_image))
-            # fig = plt.figure(figsize=(8, 4))
-            # ax1 = fig.add_subplot(1, 2, 1)
-            # ax1.imshow(ori_img)
-            # ax2 = fig.add_subplot(1, 2, 2)
-            # ax2.imshow(processed_image)
-            # plt.show()
-        return processed_images
+        rendering_images += noise_rgb[::-1].astype(np.float32)  # RGB -> BGR
+        # from copy import deepcopy
+        # ori_img = deepcopy(img)
+        # print(noise_rgb, np.mean(rendering_images), np.mean(ori_img))
+        # print('RandomNoise', np.mean(ori_img), np.mean(rendering_images))
+        # fig = plt.figure(figsize=(8, 4))
+        # ax1 = fig.add_subplot(1, 2, 1)
+        # ax1.imshow(ori_img)
+        # ax2 = fig.add_subplot(1, 2, 2)
+        # ax2.imshow(rendering_images[0])
+        # plt.show()
+        return rendering_images
 
 
 class RandomBackground(object):
@@ -442,14 +454,12 @@ class RandomBackground(object):
             random_bg_file_path = random.choice(self.random_bg_files)
             random_bg = cv2.imread(random_bg_file_path).astype(np.float32) / 255.
 
-        # Apply random background
-        processed_images = np.empty(shape=(0, img_height, img_width, img_channels - 1))
+        # Apply random background to the transparent pixels
+        processed_images = np.empty(shape=(len(rendering_images), img_height, img_width, img_channels - 1),
+                                    dtype=np.float32)
         for img_idx, img in enumerate(rendering_images):
-            alpha = (np.expand_dims(img[:, :, 3], axis=2) == 0).astype(np.float32)
-            img = img[:, :, :3]
             bg_color = random_bg if random.randint(0, 1) and random_bg is not None else np.array([[[r, g, b]]])
-            img = alpha * bg_color + (1 - alpha) * img
-
-            processed_images = np.append(processed_images, [img], axis=0)
+            processed_images[img_idx] = img[:, :, :3]
+            np.copyto(processed_images[img_idx], bg_color, casting='unsafe', where=img[:, :, 3:] == 0)
 
         return processed_images
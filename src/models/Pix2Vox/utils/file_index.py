@@ -0,0 +1,84 @@
+import hashlib
+import json
+import logging
+import os
+
+
+class FileIndex(object):
+    """Persistent cache of the files resolved for every sample of a dataset.
+
+    Resolving the rendering images and the volume of a sample needs a listdir and a stat call per file. The index
+    keeps the result in a JSON file named after a hash of key_parts (the taxonomy file contents and the path
+    templates), together with the mtimes of the folders the sample was resolved from. A sample is resolved again only
+    if one of these folders changed, which costs one stat call per folder instead of one per file. With revalidate
+    set to False cached samples are trusted without touching the file system at all.
+
+    Data loaders using the index implement get_sample_folders and get_files_of_sample.
+    """
+
+    def __init__(self, index_dir, key_parts, revalidate=True):
+        self.revalidate = revalidate
+        self.index_path = None
+        self.entries = {}
+        self.is_dirty = False
+
+        if index_dir is None:
+            return
+
+        key = hashlib.sha1(json.dumps(key_parts).encode('utf-8')).hexdigest()
+        self.index_path = os.path.join(index_dir, 'file_index_%s.json' % key)
+        if os.path.exists(self.index_path):
+            with open(self.index_path, encoding='utf-8') as file:
+                self.entries = json.loads(file.read())
+            logging.info('Loaded file index %s with %d samples.' % (self.index_path, len(self.entries)))
+
+    def get_files_of_taxonomy(self, data_loader, taxonomy_folder_name, samples):
+        files_of_taxonomy = []
+        folder_mtimes = {}
+
+        for sample_name in samples:
+            entry_key = '%s/%s' % (taxonomy_folder_name, sample_name)
+            entry = self.entries.get(entry_key)
+
+            if entry is None or self.revalidate:
+                mtimes = []
+                for folder in data_loader.get_sample_folders(taxonomy_folder_name, sample_name):
+                    if folder not in folder_mtimes:
+                        folder_mtimes[folder] = self._get_mtime(folder)
+                    mtimes.append(folder_mtimes[folder])
+
+                if entry is None or entry['mtimes'] != mtimes:
+                    entry = {
+                        'mtimes': mtimes,
+                        'files': data_loader.get_files_of_sample(taxonomy_folder_name, sample_name),
+                    }
+                    self.entries[entry_key] = entry
+                    self.is_dirty = True
+
+            if entry['files'] is not None:
+                files_of_taxonomy.append(entry['files'])
+
+        return files_of_taxonomy
+
+    def save(self):
+        if self.index_path is None or not self.is_dirty:
+            return
+
+        index_dir = os.path.dirname(self.index_path)
+        if index_dir and not os.path.exists(index_dir):
+            os.makedirs(index_dir)
+
+        # Write to a temporary file first, so an interrupted run never leaves a truncated index behind
+        tmp_index_path = '%s.%d.tmp' % (self.index_path, os.getpid())
+        with open(tmp_index_path, 'w', encoding='utf-8') as file:
+            json.dump(self.entries, file)
+        os.replace(tmp_index_path, self.index_path)
+        self.is_dirty = False
+        logging.info('Saved file index %s with %d samples.' % (self.index_path, len(self.entries)))
+
+    @staticmethod
+    def _get_mtime(folder):
+        try:
+            return os.stat(folder).st_mtime_ns
+        except FileNotFoundError:
+            return None
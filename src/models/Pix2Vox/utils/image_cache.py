@@ -0,0 +1,116 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# Resized MVS images, read by utils.data_loaders.MVSDataset instead of the full-resolution PNG files. The cache is
+# filled lazily while reading, this script fills it in advance for the splits of the MVS taxonomy file:
+#   python -m utils.image_cache -s TRAIN -s TEST -j 8
+
+import hashlib
+import json
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import click
+import numpy as np
+from PIL import Image
+
+from config import cfg
+
+
+class ResizedImageCache(object):
+    """Images decoded and resized to target_size (width, height) once, stored as uint8 .npy files in cache_dir.
+
+    A cached image is named after a hash of the absolute path and the mtime of the source image and target_size, so
+    it is resized again when the source image changes or the network input size does. The cached arrays are exactly
+    what resizing the source image with PIL gives, only the PNG decode and the resize are skipped.
+    """
+
+    def __init__(self, cache_dir, target_size):
+        self.cache_dir = cache_dir
+        self.target_size = tuple(target_size)
+
+    def get_cache_path(self, image_path):
+        key = [os.path.abspath(image_path), os.stat(image_path).st_mtime_ns, self.target_size]
+        return os.path.join(self.cache_dir, '%s.npy' % hashlib.sha1(json.dumps(key).encode('utf-8')).hexdigest())
+
+    def read(self, image_path):
+        cache_path = self.get_cache_path(image_path)
+        if os.path.exists(cache_path):
+            return np.load(cache_path)
+
+        image = self._resize(image_path)
+        self._write(cache_path, image)
+        return image
+
+    def build(self, image_path):
+        """Caches the image if it is not cached yet, returns whether it was resized"""
+        cache_path = self.get_cache_path(image_path)
+        if os.path.exists(cache_path):
+            return False
+
+        self._write(cache_path, self._resize(image_path))
+        return True
+
+    def _resize(self, image_path):
+        return np.asarray(Image.open(image_path).resize(self.target_size))
+
+    def _write(self, cache_path, image):
+        if not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+        # Write to a temporary file first, so that DataLoader workers never read a partial array
+        tmp_cache_path = '%s.%d.tmp' % (cache_path, os.getpid())
+        with open(tmp_cache_path, 'wb') as file:
+            np.save(file, image)
+        os.replace(tmp_cache_path, cache_path)
+
+
+@click.command()
+@click.option(
+    "-s",
+    "--split",
+    "splits",
+    type=click.Choice(['TRAIN', 'TEST', 'VAL']),
+    multiple=True,
+    default=['TRAIN', 'TEST', 'VAL'],
+)
+@click.option(
+    "-t",
+    "--mvs-taxonomy-file",
+    "mvs_taxonomy_file",
+    type=click.Path(dir_okay=False),
+    default=cfg.DATASETS.MVS.TAXONOMY_FILE_PATH,
+)
+@click.option(
+    "-o",
+    "--cache-dir",
+    "cache_dir",
+    type=click.Path(file_okay=False),
+    default=cfg.DATASETS.MVS.IMAGE_CACHE_DIR,
+)
+@click.option("-j", "--jobs", "jobs", type=int, default=os.cpu_count())
+def main(splits, mvs_taxonomy_file, cache_dir, jobs):
+    # Imported here, since utils.data_loaders imports this module
+    from utils.data_loaders import DatasetType, MVSDataLoader
+
+    logging.basicConfig(format='[%(levelname)s] %(asctime)s %(message)s', level=logging.INFO)
+    cfg.DATASETS.MVS.TAXONOMY_FILE_PATH = mvs_taxonomy_file
+    data_loader = MVSDataLoader(cfg)
+    image_cache = ResizedImageCache(cache_dir, data_loader.target_size)
+
+    image_paths = []
+    for split in splits:
+        for file in data_loader.get_dataset(DatasetType[split], 1).file_list:
+            image_paths.extend(file['rendering_images'])
+    image_paths = list(dict.fromkeys(image_paths))
+
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        n_resized = sum(executor.map(image_cache.build, image_paths, chunksize=16))
+
+    logging.info('Resized %d of %d images to %dx%d in %s.' %
+                 (n_resized, len(image_paths), image_cache.target_size[0], image_cache.target_size[1], cache_dir))
+
+
+if __name__ == '__main__':
+    main()  # pylint: disable=no-value-for-parameter
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+
+import contextlib
+
+import torch
+
+
+def get_device_type():
+    return 'cuda' if torch.cuda.is_available() else 'cpu'
+
+
+def autocast(dtype_name):
+    """Runs the enclosed forward pass in mixed precision, dtype_name is 'float16', 'bfloat16' or None for fp32.
+
+    torch.autocast (PyTorch >= 1.10) is used when available, it also runs bfloat16 on CPU. Older versions only
+    have CUDA autocast to float16. With torch.nn.DataParallel on several GPUs, older versions do not apply autocast
+    in the replica threads, so the models then run in fp32.
+    """
+    if dtype_name is None:
+        return contextlib.nullcontext()
+
+    dtype = getattr(torch, dtype_name)
+    if hasattr(torch, 'autocast'):
+        return torch.autocast(get_device_type(), dtype=dtype)
+    if get_device_type() == 'cuda' and dtype == torch.float16:
+        return torch.cuda.amp.autocast()
+    raise ValueError('[ERROR] Autocast to %s on %s is not supported by PyTorch %s.' %
+                     (dtype_name, get_device_type(), torch.__version__))
+
+
+def no_autocast():
+    if hasattr(torch, 'autocast'):
+        return torch.autocast(get_device_type(), enabled=False)
+    return torch.cuda.amp.autocast(enabled=False)
+
+
+def get_grad_scaler(dtype_name):
+    # Only float16 gradients underflow, bfloat16 has the range of fp32. A disabled scaler passes losses and
+    # optimizer steps through unchanged
+    enabled = dtype_name == 'float16' and torch.cuda.is_available()
+    if hasattr(torch, 'amp') and hasattr(torch.amp, 'GradScaler'):
+        return torch.amp.GradScaler('cuda', enabled=enabled)
+    return torch.cuda.amp.GradScaler(enabled=enabled)
+
+
+def binary_cross_entropy(generated_volumes, ground_truth_volumes, dtype_name=None, reduction='mean'):
+    """BCE of the generated volumes, always computed in fp32.
+
+    binary_cross_entropy refuses to run under autocast, and the volumes are probabilities merged from sigmoid
+    outputs, so there are no logits for binary_cross_entropy_with_logits. With a dtype_name the volumes are clamped
+    to [eps, 1 - eps] of that dtype: fp16 and bf16 sigmoids round to exactly 0 or 1 long before fp32 ones do, and the
+    loss of a wrong voxel at exactly 0 or 1 would be clipped at 100 with a gradient of 1e12. The gradient is passed
+    through the clamp, so saturated wrong voxels are still corrected.
+    """
+    with no_autocast():
+        generated_volumes = generated_volumes.float()
+        if dtype_name is not None:
+            eps = torch.finfo(getattr(torch, dtype_name)).eps
+            clamped_volumes = torch.clamp(generated_volumes, min=eps, max=1 - eps)
+            generated_volumes = generated_volumes + (clamped_volumes - generated_volumes).detach()
+
+        return torch.nn.functional.binary_cross_entropy(generated_volumes, ground_truth_volumes.float(),
+                                                        reduction=reduction)
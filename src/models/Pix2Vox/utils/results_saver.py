@@ -14,7 +14,12 @@ def save_test_results_to_csv(samples_names, edlosses, rlosses, ious_dict, path_t
     results_df.to_csv(path_to_csv, index=False)
 
 
-def save_times_to_csv(times, n_views_list, path_to_csv):
+def save_times_to_csv(times, n_views_list, path_to_csv, mode=None, batch_sizes=None):
     df = pd.DataFrame(data={"time": times,
                             "n_views": n_views_list})
+    if batch_sizes is not None:
+        # time is the time of a whole batch of batch_size samples
+        df["batch_size"] = batch_sizes
+    if mode is not None:
+        df["mode"] = mode
     df.to_csv(path_to_csv, index=False)
@@ -0,0 +1,156 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# This script packs the splits of the ShapeNet and MVS datasets into shards read by utils.data_loaders.ShardedDataset.
+# Every split is stored as three files:
+# - <dataset>_<split>_images.npy  - decoded uint8 rendering images of all samples, [n_images, H, W, C]
+# - <dataset>_<split>_volumes.npy - bit-packed volumes, [n_samples, n_bytes]
+# - <dataset>_<split>_index.json  - sample names with the offsets of their images and volumes
+
+import json
+import logging
+import os
+import sys
+
+import click
+import numpy as np
+import scipy.io
+from PIL import Image
+
+import utils.binvox_rw
+from config import cfg
+from utils.data_loaders import DatasetType, MVSDataLoader, ShapeNetDataLoader, get_shard_paths
+
+SOURCE_DATA_LOADERS = {
+    'ShapeNet': ShapeNetDataLoader,
+    'MVS': MVSDataLoader,
+}
+
+
+def read_image(image_path, target_size=None):
+    image = Image.open(image_path)
+    if target_size is not None:
+        image = image.resize(target_size)
+
+    image = np.asarray(image)
+    if len(image.shape) < 3:
+        logging.error('It seems that there is something wrong with the image file %s' % (image_path))
+        sys.exit(2)
+
+    return image
+
+
+def read_volume(volume_path):
+    _, suffix = os.path.splitext(volume_path)
+
+    if suffix == '.mat':
+        volume = scipy.io.loadmat(volume_path)
+        return utils.binvox_rw.PackedVoxels.from_dense(volume['Volume'])
+    elif suffix == '.binvox':
+        with open(volume_path, 'rb') as f:
+            return utils.binvox_rw.read_as_packed_array(f).data
+    else:
+        raise ValueError('[ERROR] Unsupported volume file %s' % volume_path)
+
+
+def pack_split(data_loader, dataset_name, dataset_type, shard_dir):
+    file_list = data_loader.get_dataset(dataset_type, 1).file_list
+    if len(file_list) == 0:
+        logging.warning('Nothing to pack for %s %s.' % (dataset_name, dataset_type.name))
+        return
+
+    # MVS images are resized to the network input size, ShapeNet renderings are stored as they are
+    target_size = getattr(data_loader, 'target_size', None)
+    images_path, volumes_path, index_path = get_shard_paths(shard_dir, dataset_name, dataset_type)
+
+    image_shape = read_image(file_list[0]['rendering_images'][0], target_size).shape
+    first_volume = read_volume(file_list[0]['volume'])
+    n_images = sum(len(file['rendering_images']) for file in file_list)
+    images = np.lib.format.open_memmap(images_path, mode='w+', dtype=np.uint8, shape=(n_images, ) + image_shape)
+    volumes = np.lib.format.open_memmap(volumes_path,
+                                        mode='w+',
+                                        dtype=np.uint8,
+                                        shape=(len(file_list), first_volume.nbytes))
+
+    samples = []
+    image_offset = 0
+    for sample_idx, file in enumerate(file_list):
+        logging.info('Packing %s %s [%d/%d] Taxonomy = %s Sample = %s' %
+                     (dataset_name, dataset_type.name, sample_idx + 1, len(file_list), file['taxonomy_name'],
+                      file['sample_name']))
+        for image_idx, image_path in enumerate(file['rendering_images']):
+            image = read_image(image_path, target_size)
+            if image.shape != image_shape:
+                raise ValueError('[ERROR] Image %s has shape %s, but the shard stores images of shape %s' %
+                                 (image_path, image.shape, image_shape))
+            images[image_offset + image_idx] = image
+
+        volume = read_volume(file['volume'])
+        if volume.shape != first_volume.shape:
+            raise ValueError('[ERROR] Volume %s has shape %s, but the shard stores volumes of shape %s' %
+                             (file['volume'], volume.shape, first_volume.shape))
+        volumes[sample_idx] = volume.bits
+
+        samples.append({
+            'taxonomy_name': file['taxonomy_name'],
+            'sample_name': file['sample_name'],
+            'image_offset': image_offset,
+            'n_views': len(file['rendering_images']),
+            'volume_index': sample_idx,
+        })
+        image_offset += len(file['rendering_images'])
+
+    images.flush()
+    volumes.flush()
+    with open(index_path, 'w', encoding='utf-8') as file:
+        json.dump({'image_shape': image_shape, 'volume_shape': first_volume.shape, 'samples': samples}, file)
+
+    logging.info('Packed %d samples and %d images of %s %s to %s.' %
+                 (len(samples), n_images, dataset_name, dataset_type.name, shard_dir))
+
+
+@click.command()
+@click.option(
+    "-d",
+    "--dataset",
+    "dataset_names",
+    type=click.Choice(list(SOURCE_DATA_LOADERS.keys())),
+    multiple=True,
+    default=list(SOURCE_DATA_LOADERS.keys()),
+)
+@click.option(
+    "-s",
+    "--split",
+    "splits",
+    type=click.Choice([dataset_type.name for dataset_type in DatasetType]),
+    multiple=True,
+    default=[dataset_type.name for dataset_type in DatasetType],
+)
+@click.option(
+    "-o",
+    "--shard-dir",
+    "shard_dir",
+    type=click.Path(file_okay=False),
+    default=cfg.DATASETS.SHARDED.SHARD_DIR,
+)
+@click.option(
+    "-t",
+    "--mvs-taxonomy-file",
+    "mvs_taxonomy_file",
+    type=click.Path(dir_okay=False),
+    default=cfg.DATASETS.MVS.TAXONOMY_FILE_PATH,
+)
+def main(dataset_names, splits, shard_dir, mvs_taxonomy_file):
+    logging.basicConfig(format='[%(levelname)s] %(asctime)s %(message)s', level=logging.INFO)
+    cfg.DATASETS.MVS.TAXONOMY_FILE_PATH = mvs_taxonomy_file
+    if not os.path.exists(shard_dir):
+        os.makedirs(shard_dir)
+
+    for dataset_name in dataset_names:
+        data_loader = SOURCE_DATA_LOADERS[dataset_name](cfg)
+        for split in splits:
+            pack_split(data_loader, dataset_name, DatasetType[split], shard_dir)
+
+
+if __name__ == '__main__':
+    main()  # pylint: disable=no-value-for-parameter
@@ -0,0 +1,154 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# This script compares the training transforms of utils.data_transforms with the previous implementation, which
+# grew a float64 array with np.append for every view. Both run with the same random seeds, so the outputs should be
+# equal up to float32 rounding. Run it from src/models/Pix2Vox:
+#   python -m utils.transforms_benchmark 1 5 20 40
+
+import random
+import sys
+from time import perf_counter
+
+import cv2
+import numpy as np
+
+import utils.data_transforms
+from config import cfg
+
+N_VIEWS = [1, 5, 20, 40]
+N_REPEATS = 5
+RENDERING_SIZE = (137, 137)
+IMG_SIZE = cfg.CONST.IMG_H, cfg.CONST.IMG_W
+CROP_SIZE = cfg.CONST.CROP_IMG_H, cfg.CONST.CROP_IMG_W
+
+
+class ReferenceCrop(utils.data_transforms.CenterCrop):
+    """ The previous crop without a bounding box, the images are appended to a float64 array. """
+    def __call__(self, rendering_images, bounding_box=None):
+        processed_images = np.empty(shape=(0, self.img_size_h, self.img_size_w, rendering_images[0].shape[2]))
+        for img in rendering_images:
+            img_height, img_width, _ = img.shape
+            x_left = int(img_width - self.crop_size_w) // 2
+            y_top = int(img_height - self.crop_size_h) // 2
+            processed_image = cv2.resize(img[y_top:y_top + self.crop_size_h, x_left:x_left + self.crop_size_w],
+                                         (self.img_size_w, self.img_size_h))
+            processed_images = np.append(processed_images, [processed_image], axis=0)
+
+        return processed_images
+
+
+class ReferenceBackground(utils.data_transforms.RandomBackground):
+    def __call__(self, rendering_images):
+        r, g, b = np.array([
+            np.random.randint(self.random_bg_color_range[i][0], self.random_bg_color_range[i][1] + 1) for i in range(3)
+        ]) / 255.
+        random_bg = None
+
+        img_height, img_width, img_channels = rendering_images[0].shape
+        processed_images = np.empty(shape=(0, img_height, img_width, img_channels - 1))
+        for img in rendering_images:
+            alpha = (np.expand_dims(img[:, :, 3], axis=2) == 0).astype(np.float32)
+            bg_color = random_bg if random.randint(0, 1) and random_bg is not None else np.array([[[r, g, b]]])
+            img = alpha * bg_color + (1 - alpha) * img[:, :, :3]
+            processed_images = np.append(processed_images, [img], axis=0)
+
+        return processed_images
+
+
+class ReferenceColorJitter(utils.data_transforms.ColorJitter):
+    def __call__(self, rendering_images):
+        brightness = 1 + np.random.uniform(low=-self.brightness, high=self.brightness)
+        contrast = 1 + np.random.uniform(low=-self.contrast, high=self.contrast)
+        saturation = 1 + np.random.uniform(low=-self.saturation, high=self.saturation)
+        attr_names = ['brightness', 'contrast', 'saturation']
+        attr_values = [brightness, contrast, saturation]
+        attr_indexes = np.array(range(len(attr_names)))
+        np.random.shuffle(attr_indexes)
+
+        processed_images = np.empty(shape=(0, ) + rendering_images[0].shape)
+        for img in rendering_images:
+            for idx in attr_indexes:
+                gs = np.dstack([0.114 * img[:, :, 0] + 0.587 * img[:, :, 1] + 0.299 * img[:, :, 2]] * 3)
+                if attr_names[idx] == 'contrast':
+                    img = attr_values[idx] * img + (1 - attr_values[idx]) * np.mean(gs[:, :, 0])
+                elif attr_names[idx] == 'saturation':
+                    img = attr_values[idx] * img + (1 - attr_values[idx]) * gs
+                else:
+                    img = attr_values[idx] * img
+            processed_images = np.append(processed_images, [img], axis=0)
+
+        return processed_images
+
+
+class ReferenceNoise(utils.data_transforms.RandomNoise):
+    def __call__(self, rendering_images):
+        alpha = np.random.normal(loc=0, scale=self.noise_std, size=3)
+        noise_rgb = np.sum(self.eigvecs * np.tile(alpha, (3, 1)) * np.tile(self.eigvals, (3, 1)), axis=1)
+
+        processed_images = np.empty(shape=(0, ) + rendering_images[0].shape)
+        for img in rendering_images:
+            processed_image = img[:, :, ::-1]  # BGR -> RGB
+            for i in range(3):
+                processed_image[:, :, i] += noise_rgb[i]
+            processed_images = np.append(processed_images, [processed_image[:, :, ::-1]], axis=0)
+
+        return processed_images
+
+
+def get_transforms(reference):
+    crop = ReferenceCrop if reference else utils.data_transforms.RandomCrop
+    background = ReferenceBackground if reference else utils.data_transforms.RandomBackground
+    color_jitter = ReferenceColorJitter if reference else utils.data_transforms.ColorJitter
+    noise = ReferenceNoise if reference else utils.data_transforms.RandomNoise
+
+    return utils.data_transforms.Compose([
+        crop(IMG_SIZE, CROP_SIZE),
+        background(cfg.TRAIN.RANDOM_BG_COLOR_RANGE),
+        color_jitter(cfg.TRAIN.BRIGHTNESS, cfg.TRAIN.CONTRAST, cfg.TRAIN.SATURATION),
+        noise(cfg.TRAIN.NOISE_STD),
+        utils.data_transforms.Normalize(mean=cfg.DATASET.MEAN, std=cfg.DATASET.STD),
+        utils.data_transforms.RandomFlip(),
+        utils.data_transforms.RandomPermuteRGB(),
+        utils.data_transforms.ToTensor(),
+    ])
+
+
+def make_rendering_images(n_views, seed=0):
+    """ RGBA renderings with a transparent border, like the ShapeNet renderings read by the data loaders. """
+    rng = np.random.RandomState(seed)
+    rendering_images = rng.rand(n_views, RENDERING_SIZE[0], RENDERING_SIZE[1], 4).astype(np.float32)
+    rendering_images[:, :16, :, 3] = 0
+    rendering_images[:, :, :16, 3] = 0
+    return rendering_images
+
+
+def time_transforms(transforms, n_views):
+    best_time = float('inf')
+    for _ in range(N_REPEATS):
+        # The transforms modify the input in place
+        rendering_images = make_rendering_images(n_views)
+        np.random.seed(cfg.CONST.RNG_SEED)
+        random.seed(cfg.CONST.RNG_SEED)
+        start_time = perf_counter()
+        tensor = transforms(rendering_images)
+        best_time = min(best_time, perf_counter() - start_time)
+    return best_time, tensor
+
+
+def main():
+    n_views = [int(arg) for arg in sys.argv[1:]] or N_VIEWS
+    reference_transforms = get_transforms(reference=True)
+    transforms = get_transforms(reference=False)
+
+    print('%8s %16s %16s %10s %14s' % ('views', 'reference (ms)', 'preallocated (ms)', 'speedup', 'max abs diff'))
+    for n in n_views:
+        reference_time, reference_tensor = time_transforms(reference_transforms, n)
+        preallocated_time, tensor = time_transforms(transforms, n)
+        print('%8d %16.2f %16.2f %9.1fx %14.2e' % (n, reference_time * 1000, preallocated_time * 1000,
+                                                   reference_time / preallocated_time,
+                                                   (reference_tensor - tensor).abs().max().item()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+import os
+import shutil
+from itertools import product
+from typing import Dict, List
+
+import numpy as np
+import open3d as o3d
+
+from mvs import VOXEL_SIZE_RATIO, get_mvs_result_ply_path, get_mvs_truth_ply_path
+
+COARSE_DISTANCE_RATIO = 5
+FINE_DISTANCE_RATIO = 1.5
+MAX_ITERATIONS = 100
+
+
+def get_similarity_transformation(rotation: np.ndarray, scale: float, source_center: np.ndarray,
+                                  target_center: np.ndarray) -> np.ndarray:
+    transformation = np.eye(4)
+    transformation[:3, :3] = scale * rotation
+    transformation[:3, 3] = target_center - scale * rotation @ source_center
+
+    return transformation
+
+
+def get_initial_transformations(source_points: np.ndarray, target_points: np.ndarray) -> List[np.ndarray]:
+    """Guesses for ICP, which only converges from a rough alignment.
+
+    The reconstruction comes out of SfM in its own frame and scale, so the clouds are matched by centroid and RMS
+    radius, and their principal axes are aligned. The sign of every principal axis is ambiguous, which gives the
+    four proper rotations tried here, together with the plain centroid and scale match.
+    """
+    source_center = source_points.mean(0)
+    target_center = target_points.mean(0)
+    source_centered = source_points - source_center
+    target_centered = target_points - target_center
+    scale = np.sqrt(np.mean(np.sum(target_centered ** 2, 1)) / np.mean(np.sum(source_centered ** 2, 1)))
+
+    # Columns are the principal axes, sorted by decreasing variance
+    source_axes = np.linalg.svd(source_centered, full_matrices=False)[2].T
+    target_axes = np.linalg.svd(target_centered, full_matrices=False)[2].T
+
+    transformations = [get_similarity_transformation(np.eye(3), scale, source_center, target_center)]
+    for signs in product([1, -1], repeat=3):
+        rotation = target_axes @ np.diag(signs) @ source_axes.T
+        if np.linalg.det(rotation) > 0:
+            transformations.append(get_similarity_transformation(rotation, scale, source_center, target_center))
+
+    return transformations
+
+
+def align_point_clouds(
+    source: o3d.geometry.PointCloud,
+    target: o3d.geometry.PointCloud,
+    voxel_size_ratio: float = VOXEL_SIZE_RATIO,
+    max_iterations: int = MAX_ITERATIONS,
+) -> o3d.pipelines.registration.RegistrationResult:
+    """Finds the similarity transformation of source onto target with voxel-downsampled point-to-point ICP.
+
+    The voxel size is voxel_size_ratio of the diagonal of the target bounding box. Every initial guess is refined
+    with a coarse ICP, the best one is refined again with a tight correspondence distance. Correspondences are
+    searched in open3d's KD-tree of the downsampled target.
+    """
+    voxel_size = voxel_size_ratio * np.linalg.norm(target.get_max_bound() - target.get_min_bound())
+    source_down = source.voxel_down_sample(voxel_size)
+    target_down = target.voxel_down_sample(voxel_size)
+
+    estimation = o3d.pipelines.registration.TransformationEstimationPointToPoint(with_scaling=True)
+    criteria = o3d.pipelines.registration.ICPConvergenceCriteria(max_iteration=max_iterations)
+
+    def run_icp(init: np.ndarray, distance_ratio: float) -> o3d.pipelines.registration.RegistrationResult:
+        return o3d.pipelines.registration.registration_icp(source_down, target_down, distance_ratio * voxel_size,
+                                                           init, estimation, criteria)
+
+    coarse_results = [
+        run_icp(init, COARSE_DISTANCE_RATIO)
+        for init in get_initial_transformations(np.asarray(source_down.points), np.asarray(target_down.points))
+    ]
+    best_result = max(coarse_results, key=lambda result: (result.fitness, -result.inlier_rmse))
+
+    return run_icp(best_result.transformation, FINE_DISTANCE_RATIO)
+
+
+def run_mvs_position_alignment(scan_id: int, voxel_size_ratio: float = VOXEL_SIZE_RATIO) -> Dict:
+    """Headless replacement of run_mvs_position_correction.
+
+    Writes the reconstruction aligned to the ground truth as scene_dense_corrected.ply. Only the reconstruction is
+    moved, so an existing corrected ground truth (e.g. cropped by hand) is kept, otherwise the ground truth is copied
+    to its corrected path for the corrected voxelization.
+    """
+    source = o3d.io.read_point_cloud(get_mvs_result_ply_path(scan_id, False))
+    target = o3d.io.read_point_cloud(get_mvs_truth_ply_path(scan_id, False))
+    if source.is_empty() or target.is_empty():
+        raise ValueError(f"Scan {scan_id} has an empty reconstruction or ground truth point cloud")
+
+    result = align_point_clouds(source, target, voxel_size_ratio)
+    source.transform(result.transformation)
+    if not o3d.io.write_point_cloud(get_mvs_result_ply_path(scan_id, True), source):
+        raise IOError(f"Could not write {get_mvs_result_ply_path(scan_id, True)}")
+
+    if not os.path.exists(get_mvs_truth_ply_path(scan_id, True)):
+        shutil.copyfile(get_mvs_truth_ply_path(scan_id, False), get_mvs_truth_ply_path(scan_id, True))
+
+    return {
+        "fitness": result.fitness,
+        "inlier_rmse": result.inlier_rmse,
+        "transformation": np.asarray(result.transformation).tolist(),
+    }
@@ -1,15 +1,157 @@
+from typing import Any, List, Optional, Tuple
+
 import click
-from runners.reconstruction_runner import main as run_reconstruction
-from runners.point_cloud_correction_runner import main as run_correction
-from runners.voxelize_runner import main as run_voxelization
-from runners.maximize_voxels_runner import main as run_maximization
-from runners.iou_runner import main as run_iou
+from mvs import (
+    VOXEL_SIZE_RATIO,
+    get_mvs_img_paths,
+    get_mvs_iou_path,
+    get_mvs_pipeline_state_path,
+    get_mvs_reconstruction_times_path,
+    get_mvs_result_ply_path,
+    get_mvs_result_vox_path,
+    get_mvs_truth_ply_path,
+    get_mvs_truth_vox_path,
+    get_resolution_suffix,
+    run_mvs_position_correction,
+    run_mvs_reconstruction,
+)
+from evaluation import IOU_COLUMNS, evaluate_scans
+from pipeline import Pipeline, Task, TaskRunner
+from reconstruction_scheduler import (
+    CommandFactory,
+    get_docker_command_factory,
+    get_total_memory_gb,
+    run_reconstructions,
+    save_reconstruction_times,
+)
+from runners.voxelize_runner import voxelize_scan
+from runners.maximize_voxels_runner import maximize_scan
+from scheduler import get_scan_ids, run_tasks
+from sfm_utils import VOXEL_CACHE
 import pandas as pd
 import os
 from settings import REPORTS_DIR
 import plotly.express as px
 
 
+def save_charts(csv_path: str, sfm_path: str, resolution: int = 32):
+    df = pd.read_csv(csv_path, index_col=0)[list(IOU_COLUMNS)]
+
+    fig = px.box(df, points="all", title="SfM na zbiorze MVS - różne wersje modeli", )
+    fig.update_layout(xaxis_title="Wersja modeli", yaxis_title="IoU", showlegend=False)
+    fig.write_image(get_chart_path(sfm_path, "box", resolution))
+
+    df_mean = df.mean()
+    fig = px.bar(df_mean)
+    fig.update_layout(xaxis_title="Wersja modeli", yaxis_title="Średnie IoU", showlegend=False)
+    fig.write_image(get_chart_path(sfm_path, "bar", resolution))
+
+
+def get_chart_path(sfm_path: str, chart: str, resolution: int) -> str:
+    return os.path.join(sfm_path, f"sfm_mvs_results{get_resolution_suffix(resolution)}_{chart}.png")
+
+
+def get_reconstruction_task(scan_id: int) -> Task:
+    return Task(f"reconstruction/{scan_id}", run_mvs_reconstruction, (scan_id, False), get_mvs_img_paths(scan_id),
+                [get_mvs_result_ply_path(scan_id, False)])
+
+
+def get_reconstruction_runner(command_factory: CommandFactory, **kwargs) -> TaskRunner:
+    """Runs the reconstruction tasks with reconstruction_scheduler instead of a process pool, kwargs are the budget
+    of run_reconstructions. The reconstruction times of the run are saved to get_mvs_reconstruction_times_path."""
+
+    def run_reconstruction_tasks(tasks: List[Task]) -> List[Tuple[Any, Optional[str]]]:
+        results = run_reconstructions([task.args[0] for task in tasks], command_factory, **kwargs)
+        save_reconstruction_times(results, get_mvs_reconstruction_times_path())
+
+        return [
+            ({"attempts": result.attempts, "stage_times": result.stage_times}, None) if result.succeeded else
+            (None, f"return code {result.returncode} after {result.attempts} attempts, see {result.log_path}")
+            for result in results
+        ]
+
+    return run_reconstruction_tasks
+
+
+def get_correction_task(scan_id: int, cloud_compare_path: str) -> Task:
+    if cloud_compare_path is None:
+        # Imported here, open3d is only needed when the scans are aligned with ICP
+        from alignment import run_mvs_position_alignment
+
+        method, func, args = "icp", run_mvs_position_alignment, (scan_id, VOXEL_SIZE_RATIO)
+    else:
+        method, func, args = "cloudcompare", run_mvs_position_correction, (scan_id, cloud_compare_path, False)
+
+    return Task(f"correction/{scan_id}/{method}", func, args,
+                [get_mvs_result_ply_path(scan_id, False), get_mvs_truth_ply_path(scan_id, False)],
+                [get_mvs_result_ply_path(scan_id, True), get_mvs_truth_ply_path(scan_id, True)])
+
+
+def get_voxelization_task(scan_id: int, corrected: bool, resolution: int) -> Task:
+    return Task(f"voxelize/{scan_id}/corrected={corrected}/resolution={resolution}", voxelize_scan,
+                (scan_id, corrected, resolution),
+                [get_mvs_result_ply_path(scan_id, corrected), get_mvs_truth_ply_path(scan_id, corrected)],
+                [get_mvs_result_vox_path(scan_id, corrected, resolution=resolution),
+                 get_mvs_truth_vox_path(scan_id, corrected, resolution=resolution)])
+
+
+def get_maximization_task(scan_id: int, corrected: bool, resolution: int) -> Task:
+    return Task(f"maximize/{scan_id}/corrected={corrected}/resolution={resolution}", maximize_scan,
+                (scan_id, corrected, resolution),
+                [get_mvs_result_vox_path(scan_id, corrected, resolution=resolution),
+                 get_mvs_truth_vox_path(scan_id, corrected, resolution=resolution)],
+                [get_mvs_result_vox_path(scan_id, corrected, maximized=True, resolution=resolution)])
+
+
+def save_evaluation(scan_ids: List[int], iou_paths: List[str], with_precision_recall: bool, jobs: int,
+                    resolution: int):
+    df = evaluate_scans(scan_ids, with_precision_recall=with_precision_recall, jobs=jobs, resolution=resolution)
+    df.index = scan_ids
+    for scan_id, iou_path in zip(scan_ids, iou_paths):
+        os.makedirs(os.path.dirname(iou_path), exist_ok=True)
+        df.loc[[scan_id]].to_csv(iou_path, index_label="scan_id")
+
+
+def save_scan_evaluation(scan_id: int, iou_path: str, with_precision_recall: bool, jobs: int, resolution: int):
+    save_evaluation([scan_id], [iou_path], with_precision_recall, jobs, resolution)
+
+
+def get_evaluation_task(scan_id: int, with_precision_recall: bool, jobs: int, resolution: int) -> Task:
+    voxel_paths = [
+        path
+        for corrected, maximized in IOU_COLUMNS.values()
+        for path in (get_mvs_result_vox_path(scan_id, corrected, maximized, resolution),
+                     get_mvs_truth_vox_path(scan_id, corrected, resolution))
+    ]
+    # A scan without voxels gets a row of NaN, it only has to be evaluated again once its voxels appear
+    iou_path = get_mvs_iou_path(scan_id, with_precision_recall, resolution)
+    return Task(f"evaluation/{scan_id}/precision_recall={with_precision_recall}/resolution={resolution}",
+                save_scan_evaluation, (scan_id, iou_path, with_precision_recall, jobs, resolution),
+                [path for path in dict.fromkeys(voxel_paths) if os.path.exists(path)], [iou_path])
+
+
+def run_evaluation_tasks(tasks: List[Task]) -> List[Tuple[Any, Optional[str]]]:
+    """Evaluates the scans of all evaluation tasks in one evaluate_scans pass, every voxel file is read once"""
+    _, _, with_precision_recall, jobs, resolution = tasks[0].args
+    (result, ) = run_tasks(save_evaluation, [([task.args[0] for task in tasks], [task.args[1] for task in tasks],
+                                              with_precision_recall, jobs, resolution)], progress=False)
+    return [result] * len(tasks)
+
+
+def save_results(iou_paths: List[str], csv_path: str, sfm_path: str, resolution: int):
+    df = pd.concat([pd.read_csv(iou_path, index_col=0) for iou_path in iou_paths], ignore_index=True)
+    df.to_csv(csv_path)
+    save_charts(csv_path, sfm_path, resolution)
+
+
+def get_results_task(scan_ids: List[int], csv_path: str, sfm_path: str, with_precision_recall: bool,
+                     resolution: int) -> Task:
+    iou_paths = [get_mvs_iou_path(scan_id, with_precision_recall, resolution) for scan_id in scan_ids]
+    return Task(f"results/precision_recall={with_precision_recall}/resolution={resolution}", save_results,
+                (iou_paths, csv_path, sfm_path, resolution), iou_paths,
+                [csv_path] + [get_chart_path(sfm_path, chart, resolution) for chart in ("box", "bar")])
+
+
 @click.command()
 @click.argument("scan_id_start", type=int, required=True)
 @click.argument("scan_id_end", type=int, required=True)
@@ -20,6 +162,18 @@ import plotly.express as px
     type=bool,
     default=True,
 )
+@click.option(
+    "--containers",
+    "max_containers",
+    type=int,
+    default=0,
+    help="Max number of reconstruction containers running at once, 0 to only limit them by the CPU and memory budget.",
+)
+@click.option("--container-cpus", "container_cpus", type=float, default=4)
+@click.option("--container-memory-gb", "container_memory_gb", type=float, default=8)
+@click.option("--total-cpus", "total_cpus", type=float, default=None)
+@click.option("--total-memory-gb", "total_memory_gb", type=float, default=None)
+@click.option("--retries", "retries", type=int, default=1)
 @click.option(
     "-c",
     "--correction",
@@ -33,38 +187,74 @@ import plotly.express as px
     "cloud_compare_path",
     type=click.Path(dir_okay=False),
 )
-def main(scan_id_start: int, scan_id_end: int, reconstruction: bool, correction: bool, cloud_compare_path: str):
+@click.option(
+    "-j",
+    "--jobs",
+    "jobs",
+    type=int,
+    default=1,
+)
+@click.option(
+    "-f",
+    "--force",
+    "force",
+    type=bool,
+    default=False,
+)
+@click.option(
+    "-m",
+    "--precision-recall",
+    "with_precision_recall",
+    type=bool,
+    default=False,
+)
+@click.option(
+    "--resolution",
+    "resolution",
+    type=int,
+    default=32,
+)
+def main(scan_id_start: int, scan_id_end: int, reconstruction: bool, max_containers: int, container_cpus: float,
+         container_memory_gb: float, total_cpus: float, total_memory_gb: float, retries: int, correction: bool,
+         cloud_compare_path: str, jobs: int, force: bool, with_precision_recall: bool, resolution: int):
+    # Every stage only reruns the scans whose inputs changed since its last successful run
+    pipeline = Pipeline(get_mvs_pipeline_state_path(), jobs=jobs, force=force)
+    scan_ids = get_scan_ids(scan_id_start, scan_id_end)
+
     if reconstruction:
-        run_reconstruction.callback(scan_id_start, scan_id_end, False)
+        # The containers share the CPU and memory budget instead of taking a process of the pool each
+        runner = get_reconstruction_runner(
+            get_docker_command_factory(False),
+            max_containers=max_containers,
+            total_cpus=total_cpus,
+            total_memory_gb=total_memory_gb or get_total_memory_gb(),
+            container_cpus=container_cpus,
+            container_memory_gb=container_memory_gb,
+            retries=retries,
+        )
+        pipeline.run_stage("RECONSTRUCTION", [get_reconstruction_task(scan_id) for scan_id in scan_ids], runner=runner)
     if correction:
-        run_correction.callback(scan_id_start, scan_id_end, cloud_compare_path, False)
-    
-    run_voxelization.callback(scan_id_start, scan_id_end, False)
-    run_voxelization.callback(scan_id_start, scan_id_end, True)
-
-    run_maximization.callback(scan_id_start, scan_id_end, False)
-    run_maximization.callback(scan_id_start, scan_id_end, True)
+        # Without a CloudCompare path the scans are aligned with ICP in parallel, CloudCompare is interactive and
+        # corrects one scan at a time
+        pipeline.run_stage("CORRECTION", [get_correction_task(scan_id, cloud_compare_path) for scan_id in scan_ids],
+                           jobs=None if cloud_compare_path is None else 1)
 
-    iou_cf_mf = run_iou.callback(scan_id_start, scan_id_end, False, False, False)
-    iou_cf_mt = run_iou.callback(scan_id_start, scan_id_end, False, True, False)
-    iou_ct_mf = run_iou.callback(scan_id_start, scan_id_end, True, False, False)
-    iou_ct_mt = run_iou.callback(scan_id_start, scan_id_end, True, True, False)
+    pipeline.run_stage("VOXELIZE", [get_voxelization_task(scan_id, corrected, resolution)
+                                    for corrected in (False, True) for scan_id in scan_ids])
+    pipeline.run_stage("MAXIMIZE", [get_maximization_task(scan_id, corrected, resolution)
+                                    for corrected in (False, True) for scan_id in scan_ids])
 
-    df = pd.DataFrame({"nothing": iou_cf_mf, "maximized": iou_cf_mt, "corrected": iou_ct_mf, "all": iou_ct_mt})
-    df.to_csv(os.path.join(REPORTS_DIR, os.path.join(REPORTS_DIR, "sfm_mvs_results.csv")))
+    # Every scan writes its own row, so only the changed scans are evaluated again, all of them in one pass
+    pipeline.run_stage("IOU", [get_evaluation_task(scan_id, with_precision_recall, jobs, resolution)
+                               for scan_id in scan_ids], runner=run_evaluation_tasks)
 
-    click.echo(f"Generating Charts")
+    csv_path = os.path.join(REPORTS_DIR, f"sfm_mvs_results{get_resolution_suffix(resolution)}.csv")
     SFM_PATH = os.path.join(REPORTS_DIR, "figures", "sfm")
+    pipeline.run_stage("RESULTS", [get_results_task(scan_ids, csv_path, SFM_PATH, with_precision_recall, resolution)],
+                       jobs=1)
 
-    fig = px.box(df, points="all", title="SfM na zbiorze MVS - różne wersje modeli", )
-    fig.update_layout(xaxis_title="Wersja modeli", yaxis_title="IoU", showlegend=False)
-    fig.write_image(os.path.join(SFM_PATH, "sfm_mvs_results_box.png"))
-
-    df_mean = df.mean()
-    fig = px.bar(df_mean)
-    fig.update_layout(xaxis_title="Wersja modeli", yaxis_title="Średnie IoU", showlegend=False)
-    fig.write_image(os.path.join(SFM_PATH, "sfm_mvs_results_bar.png"))
-
+    # Only counts the reads of this process, worker processes share the disk cache
+    click.echo(f"Voxel cache: {VOXEL_CACHE.get_stats()}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,153 @@
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from mvs import get_mvs_result_vox_path, get_mvs_truth_vox_path
+from scheduler import run_tasks
+from sfm_utils import read_packed_voxel
+import utils.binvox_rw as br
+
+try:
+    import torch
+except ImportError:
+    torch = None
+
+# DataFrame column for every (corrected, maximized) variant of the results, as in all_runner
+IOU_COLUMNS = {"nothing": (False, False), "maximized": (False, True), "corrected": (True, False), "all": (True, True)}
+PAIR_CHUNK_SIZE = 64
+
+
+def read_voxel_data(voxel_path: str) -> br.PackedVoxels:
+    return read_packed_voxel(voxel_path).data
+
+
+def load_voxel_grids(voxel_paths: List[str], jobs: int = 1) -> Dict[str, br.PackedVoxels]:
+    """Reads every distinct path once, paths that cannot be read are left out"""
+    voxel_paths = list(dict.fromkeys(voxel_paths))
+    results = run_tasks(read_voxel_data, [(voxel_path, ) for voxel_path in voxel_paths], jobs=jobs, progress=False)
+
+    return {voxel_path: data for voxel_path, (data, error) in zip(voxel_paths, results) if error is None}
+
+
+def get_popcounts(bits):
+    """Set bits of every row of a [N, B] uint8 array or tensor, counted in parallel within every byte"""
+    bits = bits - ((bits >> 1) & 0x55)
+    bits = (bits & 0x33) + ((bits >> 2) & 0x33)
+    bits = (bits + (bits >> 4)) & 0x0F
+
+    return bits.sum(1)
+
+
+def get_pair_counts(
+    grids: np.ndarray, result_indices: np.ndarray, truth_indices: np.ndarray, use_torch: Optional[bool] = None
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Intersection, result and truth voxel counts of the pairs (grids[result_indices[i]], grids[truth_indices[i]])
+
+    grids is a stacked [N, B] uint8 array of bit-packed grids (br.PackedVoxels.bits), so a 128^3 grid takes 256 KB.
+    The pairs are processed in chunks of PAIR_CHUNK_SIZE, on the GPU when torch can use one and use_torch is not
+    False, with NumPy otherwise.
+    """
+    if use_torch is None:
+        use_torch = torch is not None and torch.cuda.is_available()
+    occupied = np.empty(len(grids), dtype=np.int64)
+    for start in range(0, len(grids), PAIR_CHUNK_SIZE):
+        occupied[start:start + PAIR_CHUNK_SIZE] = get_popcounts(grids[start:start + PAIR_CHUNK_SIZE])
+    intersections = np.empty(len(result_indices), dtype=np.int64)
+
+    if use_torch:
+        device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        grids_tensor = torch.from_numpy(grids).to(device)
+        result_indices_tensor = torch.from_numpy(result_indices).to(device)
+        truth_indices_tensor = torch.from_numpy(truth_indices).to(device)
+        chunk_intersections = []
+        for start in range(0, len(result_indices), PAIR_CHUNK_SIZE):
+            results = grids_tensor[result_indices_tensor[start:start + PAIR_CHUNK_SIZE]]
+            truths = grids_tensor[truth_indices_tensor[start:start + PAIR_CHUNK_SIZE]]
+            chunk_intersections.append(get_popcounts(results & truths))
+        if chunk_intersections:
+            intersections[:] = torch.cat(chunk_intersections).cpu().numpy()
+    else:
+        for start in range(0, len(result_indices), PAIR_CHUNK_SIZE):
+            results = grids[result_indices[start:start + PAIR_CHUNK_SIZE]]
+            truths = grids[truth_indices[start:start + PAIR_CHUNK_SIZE]]
+            intersections[start:start + PAIR_CHUNK_SIZE] = get_popcounts(results & truths)
+
+    return intersections, occupied[result_indices], occupied[truth_indices]
+
+
+def get_batched_metrics(
+    grids: np.ndarray,
+    result_indices: np.ndarray,
+    truth_indices: np.ndarray,
+    with_precision_recall: bool = False,
+    use_torch: Optional[bool] = None,
+) -> Dict[str, np.ndarray]:
+    intersections, result_counts, truth_counts = get_pair_counts(grids, result_indices, truth_indices, use_torch)
+    unions = result_counts + truth_counts - intersections
+
+    # Division by zero gives NaN, like get_iou for two empty grids
+    with np.errstate(divide="ignore", invalid="ignore"):
+        metrics = {"iou": intersections / unions}
+        if with_precision_recall:
+            precision = intersections / result_counts
+            recall = intersections / truth_counts
+            metrics["precision"] = precision
+            metrics["recall"] = recall
+            metrics["fscore"] = 2 * precision * recall / (precision + recall)
+
+    return metrics
+
+
+def evaluate_scans(
+    scan_ids: List[int],
+    columns: Dict[str, Tuple[bool, bool]] = IOU_COLUMNS,
+    with_precision_recall: bool = False,
+    use_torch: Optional[bool] = None,
+    jobs: int = 1,
+    resolution: int = 32,
+) -> pd.DataFrame:
+    """IoU of the results of all scans for every (corrected, maximized) variant in columns, in one pass.
+
+    Every voxel file is read once and stacked, all pairs are evaluated together. Returns a DataFrame with a row per
+    scan and a column per variant, the same as all_runner builds from the per-scan IoUs. With with_precision_recall
+    there are also <column>_precision, <column>_recall and <column>_fscore columns. Pairs with a file that is
+    missing or cannot be read are NaN. resolution selects the voxels of get_mvs_result_vox_path and
+    get_mvs_truth_vox_path, the grids stay bit-packed so memory grows with resolution^3 / 8 bytes per file.
+    """
+    pair_paths = [
+        (get_mvs_result_vox_path(scan_id, corrected, maximized, resolution),
+         get_mvs_truth_vox_path(scan_id, corrected, resolution))
+        for corrected, maximized in columns.values()
+        for scan_id in scan_ids
+    ]
+    grids = load_voxel_grids([path for paths in pair_paths for path in paths], jobs=jobs)
+
+    metric_names = ["iou", "precision", "recall", "fscore"] if with_precision_recall else ["iou"]
+    values = {name: np.full(len(pair_paths), np.nan) for name in metric_names}
+
+    # Grids of different resolutions cannot be stacked, every resolution is evaluated on its own
+    pairs_by_shape: Dict[Tuple, List[int]] = {}
+    for pair_idx, (result_path, truth_path) in enumerate(pair_paths):
+        if result_path in grids and truth_path in grids and grids[result_path].shape == grids[truth_path].shape:
+            pairs_by_shape.setdefault(grids[result_path].shape, []).append(pair_idx)
+
+    for pair_indices in pairs_by_shape.values():
+        paths = list(dict.fromkeys(path for pair_idx in pair_indices for path in pair_paths[pair_idx]))
+        path_indices = {path: idx for idx, path in enumerate(paths)}
+        stacked_grids = np.stack([grids[path].bits for path in paths])
+        result_indices = np.array([path_indices[pair_paths[pair_idx][0]] for pair_idx in pair_indices])
+        truth_indices = np.array([path_indices[pair_paths[pair_idx][1]] for pair_idx in pair_indices])
+
+        metrics = get_batched_metrics(stacked_grids, result_indices, truth_indices, with_precision_recall, use_torch)
+        for name in metric_names:
+            values[name][pair_indices] = metrics[name]
+
+    data = {}
+    for column_idx, column in enumerate(columns):
+        column_slice = slice(column_idx * len(scan_ids), (column_idx + 1) * len(scan_ids))
+        data[column] = values["iou"][column_slice]
+        for name in metric_names[1:]:
+            data[f"{column}_{name}"] = values[name][column_slice]
+
+    return pd.DataFrame(data)
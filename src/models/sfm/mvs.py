@@ -3,10 +3,22 @@ import subprocess
 from settings import DATA_DIR, MVS_DATASET_DIR
 
 
+# Voxel size of the ICP alignment in alignment.py, as a fraction of the diagonal of the ground truth bounding box.
+# Kept here so that runners can use it without importing open3d
+VOXEL_SIZE_RATIO = 0.01
+
+
 def get_mvs_img_path(scan_id: int, image_name: str = "clean_032_max.png"):
     return os.path.join(MVS_DATASET_DIR, "images", f"scan{scan_id}", image_name)
 
 
+def get_mvs_img_paths(scan_id: int):
+    img_dir = os.path.dirname(get_mvs_img_path(scan_id))
+    if not os.path.isdir(img_dir):
+        return []
+    return [os.path.join(img_dir, image_name) for image_name in sorted(os.listdir(img_dir))]
+
+
 def get_mvs_result_ply_path(scan_id: int, corrected: bool):
     return os.path.join(
         MVS_DATASET_DIR,
@@ -18,14 +30,20 @@ def get_mvs_result_ply_path(scan_id: int, corrected: bool):
     )
 
 
-def get_mvs_result_vox_path(scan_id: int, corrected: bool, maximized: bool = False):
+def get_resolution_suffix(resolution: int):
+    # 32 is the resolution of Pix2Vox, its voxels keep the names without a suffix
+    return "" if resolution == 32 else f"_{resolution}"
+
+
+def get_mvs_result_vox_path(scan_id: int, corrected: bool, maximized: bool = False, resolution: int = 32):
     return os.path.join(
         MVS_DATASET_DIR,
         "results",
         "sfm",
         f"scan{scan_id}",
         "omvs",
-        f"scene_dense{'_corrected' if corrected else ''}{'_maximized' if maximized else ''}.binvox",
+        f"scene_dense{'_corrected' if corrected else ''}{'_maximized' if maximized else ''}"
+        f"{get_resolution_suffix(resolution)}.binvox",
     )
 
 
@@ -33,16 +51,58 @@ def get_mvs_truth_ply_path(scan_id: int, corrected: bool):
     return os.path.join(MVS_DATASET_DIR, "point_clouds", f"stl{scan_id:03d}_total{'_corrected' if corrected else ''}.ply")
 
 
-def get_mvs_truth_vox_path(scan_id: int, corrected: bool):
-    return os.path.join(MVS_DATASET_DIR, "voxels", f"stl{scan_id:03d}_total{'_corrected' if corrected else ''}.binvox")
+def get_mvs_truth_vox_path(scan_id: int, corrected: bool, resolution: int = 32):
+    return os.path.join(
+        MVS_DATASET_DIR,
+        "voxels",
+        f"stl{scan_id:03d}_total{'_corrected' if corrected else ''}{get_resolution_suffix(resolution)}.binvox",
+    )
+
+
+def get_mvs_iou_path(scan_id: int, with_precision_recall: bool = False, resolution: int = 32):
+    return os.path.join(
+        MVS_DATASET_DIR,
+        "results",
+        "sfm",
+        f"scan{scan_id}",
+        f"iou{'_precision_recall' if with_precision_recall else ''}{get_resolution_suffix(resolution)}.csv",
+    )
+
+
+def get_mvs_pipeline_state_path():
+    return os.path.join(MVS_DATASET_DIR, "results", "sfm", "pipeline_state.json")
+
+
+def get_mvs_reconstruction_log_path(scan_id: int):
+    return os.path.join(MVS_DATASET_DIR, "results", "sfm", "logs", f"scan{scan_id}.log")
+
+
+def get_mvs_reconstruction_times_path():
+    return os.path.join(MVS_DATASET_DIR, "results", "sfm", "reconstruction_times.csv")
+
+
+def get_mvs_reconstruction_command(scan_id: int, ultra: bool, cpus: float = None, memory_gb: float = None):
+    limits = []
+    if cpus is not None:
+        limits += ["--cpus", f"{cpus:g}"]
+    if memory_gb is not None:
+        limits += ["--memory", f"{int(memory_gb * 1024)}m"]
+
+    return (
+        ["docker", "run", "-v", f"{DATA_DIR}:/data", "--user", "0", "--rm"]
+        + limits
+        + ["spedenaave/dpg", "pipeline.py",
+           "--input", f"/data/mvs_dataset/images/scan{scan_id}",
+           "--output", f"/data/mvs_dataset/results/sfm/scan{scan_id}",
+           "--sfm-type", "global", "--flength", "1920"]
+        + (["--dpreset", "ULTRA"] if ultra else [])
+        + ["--geomodel", "e", "--run-openmvg", "--run-openmvs", "--rmcuda", "--output-obj", "--densify-only"]
+    )
 
 
 def run_mvs_reconstruction(scan_id: int, ultra: bool):
-    command = f"docker run -v {DATA_DIR}:/data --user 0 --rm -it spedenaave/dpg pipeline.py --input /data/mvs_dataset/images/scan{scan_id} --output /data/mvs_dataset/results/sfm/scan{scan_id} --sfm-type global --flength 1920 {'--dpreset ULTRA' if ultra else ''} --geomodel e --run-openmvg --run-openmvs --rmcuda --output-obj --densify-only"
-    try:
-        subprocess.run(command)
-    except:
-        print(f"\nERROR: MVS RECONSTRUCTION {scan_id}")
+    # Raises on failure, the scan schedulers report it together with the scan id
+    subprocess.run(get_mvs_reconstruction_command(scan_id, ultra), check=True)
 
 
 def run_mvs_position_correction(scan_id: int, cloud_compare_path: str, corrected: bool):
@@ -0,0 +1,137 @@
+import hashlib
+import json
+import os
+from functools import partial
+from itertools import groupby
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+import click
+
+from scheduler import run_tasks
+
+HASH_CHUNK_SIZE = 1 << 20
+
+
+class Task(NamedTuple):
+    key: str
+    func: Callable[..., Any]
+    args: Tuple
+    inputs: List[str]
+    outputs: List[str]
+
+
+# Runs the tasks of one function and returns their (value, error) pairs in the same order
+TaskRunner = Callable[[List[Task]], List[Tuple[Any, Optional[str]]]]
+
+
+def get_file_sha1(path: str) -> str:
+    sha1 = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            sha1.update(chunk)
+
+    return sha1.hexdigest()
+
+
+class Pipeline:
+    """Incremental executor for stages of per-scan tasks.
+
+    Every task names its input and output files. Files are fingerprinted by path, size, mtime and content hash; the
+    hash is computed again only when the size or mtime of a file changed. A task is skipped when its inputs hash the
+    same as on its last successful run and its outputs are still the files it wrote then, so rewriting a file with
+    the same content does not invalidate the tasks that read it. Values returned by tasks are kept in the state file
+    and returned for skipped tasks too.
+
+    Stages have to be run in dependency order, the tasks of one stage are independent and run with
+    scheduler.run_tasks, or with the runner given to run_stage.
+    """
+
+    def __init__(self, state_path: str, jobs: int = 1, force: bool = False):
+        self.state_path = state_path
+        self.jobs = jobs
+        self.force = force
+        self.files: Dict[str, Dict] = {}
+        self.tasks: Dict[str, Dict] = {}
+
+        if os.path.exists(state_path):
+            with open(state_path, encoding="utf-8") as f:
+                state = json.load(f)
+            self.files = state["files"]
+            self.tasks = state["tasks"]
+
+    def get_fingerprint(self, path: str) -> Optional[str]:
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+
+        cached = self.files.get(path)
+        if cached is None or cached["size"] != stat.st_size or cached["mtime_ns"] != stat.st_mtime_ns:
+            cached = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha1": get_file_sha1(path)}
+            self.files[path] = cached
+
+        return cached["sha1"]
+
+    def is_up_to_date(self, task: Task) -> bool:
+        record = self.tasks.get(task.key)
+        if self.force or record is None:
+            return False
+
+        return record["inputs"] == {path: self.get_fingerprint(path) for path in task.inputs} and record[
+            "outputs"
+        ] == {path: self.get_fingerprint(path) for path in task.outputs}
+
+    def run_stage(
+        self, name: str, tasks: List[Task], jobs: Optional[int] = None, runner: Optional[TaskRunner] = None
+    ) -> Dict[str, Any]:
+        stale_tasks = [task for task in tasks if not self.is_up_to_date(task)]
+        click.echo(f"\n==============STAGE {name}: {len(stale_tasks)} of {len(tasks)} tasks to run===============")
+
+        runnable_tasks = []
+        for task in stale_tasks:
+            missing_inputs = [path for path in task.inputs if self.get_fingerprint(path) is None]
+            if missing_inputs:
+                click.echo(f"\nERROR: {task.key} is missing inputs {missing_inputs}", err=True)
+                self.tasks.pop(task.key, None)
+            else:
+                runnable_tasks.append(task)
+
+        if runner is None:
+            runner = partial(self.run_tasks, jobs=self.jobs if jobs is None else jobs)
+
+        # Tasks calling the same function run in one pool
+        for _, func_tasks in groupby(runnable_tasks, key=lambda task: task.func):
+            func_tasks = list(func_tasks)
+            results = runner(func_tasks)
+            for task, (value, error) in zip(func_tasks, results):
+                missing_outputs = [path for path in task.outputs if self.get_fingerprint(path) is None]
+                if error is None and missing_outputs:
+                    error = f"outputs {missing_outputs} were not written"
+                if error is not None:
+                    click.echo(f"\nERROR: {task.key}\n{error}", err=True)
+                    self.tasks.pop(task.key, None)
+                    continue
+
+                self.tasks[task.key] = {
+                    "inputs": {path: self.get_fingerprint(path) for path in task.inputs},
+                    "outputs": {path: self.get_fingerprint(path) for path in task.outputs},
+                    "value": value,
+                }
+        self.save()
+
+        return {task.key: self.tasks[task.key]["value"] for task in tasks if task.key in self.tasks}
+
+    @staticmethod
+    def run_tasks(tasks: List[Task], jobs: int) -> List[Tuple[Any, Optional[str]]]:
+        return run_tasks(tasks[0].func, [task.args for task in tasks], jobs=jobs)
+
+    def save(self):
+        state_dir = os.path.dirname(self.state_path)
+        if state_dir and not os.path.exists(state_dir):
+            os.makedirs(state_dir)
+
+        # Write to a temporary file first, so an interrupted run never leaves a truncated state behind
+        tmp_state_path = f"{self.state_path}.{os.getpid()}.tmp"
+        with open(tmp_state_path, "w", encoding="utf-8") as f:
+            json.dump({"files": self.files, "tasks": self.tasks}, f)
+        os.replace(tmp_state_path, self.state_path)
@@ -0,0 +1,226 @@
+import asyncio
+import os
+import re
+import shlex
+import time
+from dataclasses import dataclass, field
+from functools import partial
+from typing import Callable, Dict, List, Optional, Pattern, Tuple
+
+import click
+import pandas as pd
+
+from mvs import get_mvs_reconstruction_command, get_mvs_reconstruction_log_path
+
+READ_CHUNK_SIZE = 1 << 16
+
+CommandFactory = Callable[[int, Optional[float], Optional[float]], List[str]]
+
+
+@dataclass
+class ReconstructionResult:
+    scan_id: int
+    returncode: Optional[int] = None
+    attempts: int = 0
+    stage_times: Dict[str, float] = field(default_factory=dict)
+    log_path: str = ""
+
+    @property
+    def succeeded(self) -> bool:
+        return self.returncode == 0
+
+
+def get_total_memory_gb() -> Optional[float]:
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") / 1024 ** 3
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def get_docker_command_factory(ultra: bool) -> CommandFactory:
+    return partial(get_mvs_reconstruction_command, ultra=ultra)
+
+
+def get_stub_command_factory(command_template: str) -> CommandFactory:
+    """Runs command_template with {scan_id} substituted instead of the container, e.g. for tests"""
+    return lambda scan_id, cpus, memory_gb: shlex.split(command_template.format(scan_id=scan_id))
+
+
+class ResourceBudget:
+    """CPUs and memory shared by the running containers, memory_gb=None means no memory limit.
+
+    A container asking for more than the whole budget gets the whole budget, so it still runs, alone.
+    """
+
+    def __init__(self, cpus: float, memory_gb: Optional[float]):
+        self.cpus = cpus
+        self.memory_gb = memory_gb
+        self.free_cpus = cpus
+        self.free_memory_gb = memory_gb
+        self.condition = asyncio.Condition()
+
+    def clip(self, cpus: float, memory_gb: Optional[float]) -> Tuple[float, Optional[float]]:
+        if self.memory_gb is not None and memory_gb is not None:
+            memory_gb = min(memory_gb, self.memory_gb)
+        return min(cpus, self.cpus), memory_gb
+
+    def fits(self, cpus: float, memory_gb: Optional[float]) -> bool:
+        if cpus > self.free_cpus:
+            return False
+        return self.free_memory_gb is None or memory_gb is None or memory_gb <= self.free_memory_gb
+
+    async def acquire(self, cpus: float, memory_gb: Optional[float]) -> Tuple[float, Optional[float]]:
+        cpus, memory_gb = self.clip(cpus, memory_gb)
+        async with self.condition:
+            await self.condition.wait_for(lambda: self.fits(cpus, memory_gb))
+            self.free_cpus -= cpus
+            if self.free_memory_gb is not None and memory_gb is not None:
+                self.free_memory_gb -= memory_gb
+
+        return cpus, memory_gb
+
+    async def release(self, cpus: float, memory_gb: Optional[float]):
+        async with self.condition:
+            self.free_cpus += cpus
+            if self.free_memory_gb is not None and memory_gb is not None:
+                self.free_memory_gb += memory_gb
+            self.condition.notify_all()
+
+
+async def run_command(
+    scan_id: int, command: List[str], log_file, stage_pattern: Optional[Pattern], verbose: bool
+) -> Tuple[int, Dict[str, float]]:
+    stage_times: Dict[str, float] = {}
+    stage, stage_start = "reconstruction", time.perf_counter()
+
+    def handle_line(raw_line: bytes):
+        nonlocal stage, stage_start
+        line = raw_line.decode("utf-8", errors="replace").rstrip("\r")
+        log_file.write(line + "\n")
+        if verbose:
+            click.echo(f"[scan {scan_id}] {line}")
+
+        match = stage_pattern.search(line) if stage_pattern is not None else None
+        if match:
+            now = time.perf_counter()
+            stage_times[stage] = stage_times.get(stage, 0) + now - stage_start
+            stage, stage_start = match.group(1).strip(), now
+
+    process = await asyncio.create_subprocess_exec(
+        *command, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT
+    )
+    # Read in chunks rather than lines, progress bars can write very long lines without a newline
+    buffer = b""
+    while True:
+        chunk = await process.stdout.read(READ_CHUNK_SIZE)
+        if not chunk:
+            break
+        lines = (buffer + chunk).split(b"\n")
+        buffer = lines.pop()
+        for line in lines:
+            handle_line(line)
+        log_file.flush()
+    if buffer:
+        handle_line(buffer)
+
+    returncode = await process.wait()
+    stage_times[stage] = stage_times.get(stage, 0) + time.perf_counter() - stage_start
+
+    return returncode, stage_times
+
+
+async def reconstruct_scan(
+    scan_id: int,
+    command_factory: CommandFactory,
+    budget: ResourceBudget,
+    container_cpus: float,
+    container_memory_gb: Optional[float],
+    retries: int,
+    retry_delay: float,
+    stage_pattern: Optional[Pattern],
+    verbose: bool,
+) -> ReconstructionResult:
+    result = ReconstructionResult(scan_id, log_path=get_mvs_reconstruction_log_path(scan_id))
+    os.makedirs(os.path.dirname(result.log_path), exist_ok=True)
+
+    with open(result.log_path, "w", encoding="utf-8") as log_file:
+        for attempt in range(retries + 1):
+            queued = time.perf_counter()
+            cpus, memory_gb = await budget.acquire(container_cpus, container_memory_gb)
+            result.stage_times["queue"] = result.stage_times.get("queue", 0) + time.perf_counter() - queued
+
+            command = command_factory(scan_id, cpus, memory_gb)
+            log_file.write(f"==== attempt {attempt + 1}: {' '.join(command)}\n")
+            try:
+                result.returncode, stage_times = await run_command(scan_id, command, log_file, stage_pattern, verbose)
+            except OSError as e:
+                result.returncode, stage_times = None, {}
+                log_file.write(f"==== could not start the command: {e}\n")
+            finally:
+                await budget.release(cpus, memory_gb)
+
+            result.attempts = attempt + 1
+            for stage, stage_time in stage_times.items():
+                result.stage_times[stage] = result.stage_times.get(stage, 0) + stage_time
+            if result.succeeded:
+                break
+
+            log_file.write(f"==== attempt {attempt + 1} failed with return code {result.returncode}\n")
+            log_file.flush()
+            click.echo(f"\nERROR: MVS RECONSTRUCTION {scan_id} attempt {attempt + 1}, see {result.log_path}", err=True)
+            if attempt < retries:
+                await asyncio.sleep(retry_delay * 2 ** attempt)
+
+    return result
+
+
+async def run_reconstructions_async(
+    scan_ids: List[int],
+    command_factory: CommandFactory,
+    max_containers: int = 0,
+    total_cpus: Optional[float] = None,
+    total_memory_gb: Optional[float] = None,
+    container_cpus: float = 4,
+    container_memory_gb: Optional[float] = 8,
+    retries: int = 1,
+    retry_delay: float = 10,
+    stage_pattern: Optional[str] = None,
+    verbose: bool = False,
+) -> List[ReconstructionResult]:
+    budget = ResourceBudget(total_cpus or os.cpu_count() or 1, total_memory_gb)
+    # The container count limit is one more resource of the budget, each container takes one unit of it
+    containers = asyncio.Semaphore(max_containers) if max_containers > 0 else None
+    compiled_stage_pattern = re.compile(stage_pattern) if stage_pattern else None
+
+    async def run(scan_id: int) -> ReconstructionResult:
+        if containers is None:
+            return await reconstruct_scan(scan_id, command_factory, budget, container_cpus, container_memory_gb,
+                                          retries, retry_delay, compiled_stage_pattern, verbose)
+        async with containers:
+            return await reconstruct_scan(scan_id, command_factory, budget, container_cpus, container_memory_gb,
+                                          retries, retry_delay, compiled_stage_pattern, verbose)
+
+    return list(await asyncio.gather(*(run(scan_id) for scan_id in scan_ids)))
+
+
+def run_reconstructions(scan_ids: List[int], command_factory: CommandFactory, **kwargs) -> List[ReconstructionResult]:
+    """Reconstructs the scans concurrently, as many at a time as max_containers and the CPU and memory budget allow.
+
+    Every container gets container_cpus CPUs and container_memory_gb GB of memory out of total_cpus (all cores by
+    default) and total_memory_gb (no limit by default). The output of each scan is streamed to its log file, a failed
+    scan is retried up to retries times with an exponential backoff starting at retry_delay seconds. Wall times are
+    recorded for waiting in the queue and for the whole run, or for every stage when stage_pattern is given: a log
+    line matching it starts the stage named by its first group.
+    """
+    return asyncio.run(run_reconstructions_async(scan_ids, command_factory, **kwargs))
+
+
+def save_reconstruction_times(results: List[ReconstructionResult], path_to_csv: str):
+    rows = [
+        {"scan_id": result.scan_id, "returncode": result.returncode, "attempts": result.attempts, "stage": stage,
+         "time": stage_time}
+        for result in results
+        for stage, stage_time in result.stage_times.items()
+    ]
+    os.makedirs(os.path.dirname(path_to_csv), exist_ok=True)
+    pd.DataFrame(rows, columns=["scan_id", "returncode", "attempts", "stage", "time"]).to_csv(path_to_csv, index=False)
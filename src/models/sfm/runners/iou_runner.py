@@ -1,10 +1,10 @@
 import click
 
-from tqdm.auto import tqdm
-from mvs import get_mvs_result_vox_path, get_mvs_truth_vox_path
 import numpy as np
 
-from sfm_utils import get_iou, is_correct_scan_id, read_voxel
+from evaluation import evaluate_scans
+from scheduler import get_scan_ids
+
 
 @click.command()
 @click.argument("scan_id_start", type=int, required=True)
@@ -30,24 +30,36 @@ from sfm_utils import get_iou, is_correct_scan_id, read_voxel
     type=bool,
     default=True,
 )
-def main(scan_id_start: int, scan_id_end: int, corrected: bool, maximized: bool, verbose: bool) -> np.ndarray:
+@click.option(
+    "-r",
+    "--resolution",
+    "resolution",
+    type=int,
+    default=32,
+)
+@click.option(
+    "-j",
+    "--jobs",
+    "jobs",
+    type=int,
+    default=1,
+)
+def main(scan_id_start: int, scan_id_end: int, corrected: bool, maximized: bool, verbose: bool, resolution: int,
+         jobs: int) -> np.ndarray:
     click.echo(
         f"\n==============MVS CALCULATE IOU from {scan_id_start} to {scan_id_end}==============="
     )
     click.echo(f"Corrected: {corrected}")
     click.echo(f"Maximized: {maximized}")
-    ious = []
-    for scan_id in range(scan_id_start, scan_id_end + 1):
-        if is_correct_scan_id(scan_id):
-            result = read_voxel(get_mvs_result_vox_path(scan_id, corrected, maximized))
-            truth = read_voxel(get_mvs_truth_vox_path(scan_id, corrected))
-            iou = get_iou(result.data, truth.data)
-            ious.append(iou)
-            if verbose:
-                click.echo(f"IOU {scan_id}: {iou}")
-    ious = np.array(ious)
+    click.echo(f"Resolution: {resolution}")
+    scan_ids = get_scan_ids(scan_id_start, scan_id_end)
+    # Scans without voxels are NaN, so the IoUs stay aligned with the scan ids
+    ious = evaluate_scans(scan_ids, {"iou": (corrected, maximized)}, jobs=jobs, resolution=resolution)["iou"].to_numpy()
+    if verbose:
+        for scan_id, iou in zip(scan_ids, ious):
+            click.echo(f"IOU {scan_id}: {iou}")
     if verbose:
-        click.echo(f"Mean {ious.mean():.2f}")
+        click.echo(f"Mean {np.nanmean(ious):.2f}")
 
     return ious
 
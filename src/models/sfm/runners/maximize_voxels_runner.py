@@ -1,9 +1,27 @@
 import click
 
-from tqdm.auto import tqdm
 from mvs import get_mvs_result_vox_path, get_mvs_truth_vox_path
 
-from sfm_utils import get_maximized_result_vox_data, is_correct_scan_id, read_voxel
+from scheduler import run_scans
+from sfm_utils import get_maximized_result_vox_data, read_voxel
+
+
+MAX_SHIFT = 10
+
+
+def maximize_scan(scan_id: int, corrected: bool, resolution: int = 32):
+    truth = read_voxel(get_mvs_truth_vox_path(scan_id, corrected=corrected, resolution=resolution))
+    result = read_voxel(get_mvs_result_vox_path(scan_id, corrected=corrected, resolution=resolution))
+
+    # Shifts cover the same part of the grid at every resolution, MAX_SHIFT voxels at 32
+    max_shift = MAX_SHIFT * resolution // 32
+    _, maximized_result_data, _ = get_maximized_result_vox_data(result.data, truth.data, max_shift)
+    result_maximized = result.clone()
+    result_maximized.data = maximized_result_data
+
+    with open(get_mvs_result_vox_path(scan_id, corrected, maximized=True, resolution=resolution), "wb") as f:
+        result_maximized.write(f)
+
 
 @click.command()
 @click.argument("scan_id_start", type=int, required=True)
@@ -15,24 +33,27 @@ from sfm_utils import get_maximized_result_vox_data, is_correct_scan_id, read_vo
     type=bool,
     default=True,
 )
-def main(scan_id_start: int, scan_id_end: int, corrected: bool):
+@click.option(
+    "-r",
+    "--resolution",
+    "resolution",
+    type=int,
+    default=32,
+)
+@click.option(
+    "-j",
+    "--jobs",
+    "jobs",
+    type=int,
+    default=1,
+)
+def main(scan_id_start: int, scan_id_end: int, corrected: bool, resolution: int, jobs: int):
     click.echo(
         f"\n==============MVS MAXIMIZE VOXELS from {scan_id_start} to {scan_id_end}==============="
     )
     click.echo(f"Corrected: {corrected}")
-    for scan_id in tqdm(range(scan_id_start, scan_id_end + 1)):
-        if is_correct_scan_id(scan_id):
-
-            truth = read_voxel(get_mvs_truth_vox_path(scan_id, corrected=corrected))
-            result = read_voxel(get_mvs_result_vox_path(scan_id, corrected=corrected))
-
-            _, maximized_result_data, _ = get_maximized_result_vox_data(result.data, truth.data)
-            result_maximized = result.clone()
-            result_maximized.data = maximized_result_data
-
-            with open(get_mvs_result_vox_path(scan_id, corrected, maximized=True), "wb") as f:
-                result_maximized.write(f)
-
+    click.echo(f"Resolution: {resolution}")
+    run_scans(maximize_scan, scan_id_start, scan_id_end, corrected, resolution, jobs=jobs)
 
 
 if __name__ == "__main__":
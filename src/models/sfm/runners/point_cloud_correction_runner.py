@@ -1,8 +1,9 @@
 import click
 
-from mvs import run_mvs_position_correction
+from mvs import VOXEL_SIZE_RATIO, run_mvs_position_correction
 from tqdm.auto import tqdm
 
+from scheduler import run_scans
 from sfm_utils import is_correct_scan_id
 
 
@@ -14,7 +15,8 @@ from sfm_utils import is_correct_scan_id
     "--cloud-compare-exe-path",
     "cloud_compare_path",
     type=click.Path(dir_okay=False),
-    required=True,
+    default=None,
+    help="Align the scans by hand in CloudCompare instead of with ICP.",
 )
 @click.option(
     "-c",
@@ -22,17 +24,52 @@ from sfm_utils import is_correct_scan_id
     "corrected",
     type=bool,
     default=False,
+    help="Open the already corrected point clouds in CloudCompare, only with --cloud-compare-exe-path.",
 )
-def main(scan_id_start: int, scan_id_end: int, cloud_compare_path: str, corrected: bool):
+@click.option(
+    "-r",
+    "--voxel-size-ratio",
+    "voxel_size_ratio",
+    type=float,
+    default=VOXEL_SIZE_RATIO,
+)
+@click.option(
+    "-j",
+    "--jobs",
+    "jobs",
+    type=int,
+    default=1,
+)
+def main(scan_id_start: int, scan_id_end: int, cloud_compare_path: str, corrected: bool, voxel_size_ratio: float,
+         jobs: int):
+    # ICP always aligns the uncorrected point clouds, only CloudCompare can refine a previous correction
+    if cloud_compare_path is None and corrected:
+        raise click.UsageError("--corrected is only supported with --cloud-compare-exe-path")
+
     click.echo(
         f"\n==============MVS POSITION CORRECTION from {scan_id_start} to {scan_id_end}==============="
     )
+    if cloud_compare_path is None:
+        # Imported here, open3d is only needed for ICP
+        from alignment import run_mvs_position_alignment
+
+        click.echo("Correction: ICP")
+        click.echo(f"ICP voxel size ratio: {voxel_size_ratio}")
+        for scan_result in run_scans(run_mvs_position_alignment, scan_id_start, scan_id_end, voxel_size_ratio,
+                                     jobs=jobs):
+            if scan_result.error is None:
+                click.echo(f"Scan {scan_result.scan_id}: fitness {scan_result.value['fitness']:.3f}, "
+                           f"inlier RMSE {scan_result.value['inlier_rmse']:.4f}")
+        return
+
+    # CloudCompare is interactive, so the scans are corrected one after another
+    click.echo("Correction: CloudCompare")
     click.echo(f"CloudCompare.exe path: {cloud_compare_path}")
     click.echo(f"Corrected: {corrected}")
     for scan_id in tqdm(range(scan_id_start, scan_id_end + 1)):
         if is_correct_scan_id(scan_id):
             run_mvs_position_correction(scan_id, cloud_compare_path, corrected)
-            
+
 
 if __name__ == "__main__":
-    main()  # pylint: disable=no-value-for-parameter
\ No newline at end of file
+    main()  # pylint: disable=no-value-for-parameter
@@ -1,9 +1,15 @@
 import click
 
-from mvs import run_mvs_reconstruction
-from tqdm.auto import tqdm
+from mvs import get_mvs_reconstruction_times_path
 
-from sfm_utils import is_correct_scan_id
+from reconstruction_scheduler import (
+    get_docker_command_factory,
+    get_stub_command_factory,
+    get_total_memory_gb,
+    run_reconstructions,
+    save_reconstruction_times,
+)
+from scheduler import get_scan_ids
 
 @click.command()
 @click.argument("scan_id_start", type=int, required=True)
@@ -15,12 +21,66 @@ from sfm_utils import is_correct_scan_id
     type=bool,
     default=False,
 )
-def main(scan_id_start: int, scan_id_end: int, ultra: bool):
+@click.option(
+    "-j",
+    "--jobs",
+    "jobs",
+    type=int,
+    default=0,
+    help="Max number of containers running at once, 0 to only limit them by the CPU and memory budget.",
+)
+@click.option("--container-cpus", "container_cpus", type=float, default=4)
+@click.option("--container-memory-gb", "container_memory_gb", type=float, default=8)
+@click.option("--total-cpus", "total_cpus", type=float, default=None)
+@click.option("--total-memory-gb", "total_memory_gb", type=float, default=None)
+@click.option("--retries", "retries", type=int, default=1)
+@click.option("--retry-delay", "retry_delay", type=float, default=10)
+@click.option(
+    "--stage-pattern",
+    "stage_pattern",
+    type=str,
+    default=None,
+    help="Regex matching log lines that start a stage, its first group is the stage name.",
+)
+@click.option(
+    "--stub-command",
+    "stub_command",
+    type=str,
+    default=None,
+    help="Command run instead of the Docker container, {scan_id} is replaced with the scan id.",
+)
+@click.option(
+    "-v",
+    "--verbose",
+    "verbose",
+    type=bool,
+    default=False,
+)
+def main(scan_id_start: int, scan_id_end: int, ultra: bool, jobs: int, container_cpus: float,
+         container_memory_gb: float, total_cpus: float, total_memory_gb: float, retries: int, retry_delay: float,
+         stage_pattern: str, stub_command: str, verbose: bool):
     click.echo(f"\n==============MVS RECONSTRUCTION from {scan_id_start} to {scan_id_end}===============")
-    for scan_id in tqdm(range(scan_id_start, scan_id_end + 1)):
-        if is_correct_scan_id(scan_id):
-            run_mvs_reconstruction(scan_id, ultra)
+    command_factory = get_stub_command_factory(stub_command) if stub_command else get_docker_command_factory(ultra)
+    results = run_reconstructions(
+        get_scan_ids(scan_id_start, scan_id_end),
+        command_factory,
+        max_containers=jobs,
+        total_cpus=total_cpus,
+        total_memory_gb=total_memory_gb or get_total_memory_gb(),
+        container_cpus=container_cpus,
+        container_memory_gb=container_memory_gb,
+        retries=retries,
+        retry_delay=retry_delay,
+        stage_pattern=stage_pattern,
+        verbose=verbose,
+    )
+    save_reconstruction_times(results, get_mvs_reconstruction_times_path())
+
+    failed_scan_ids = [result.scan_id for result in results if not result.succeeded]
+    click.echo(f"Reconstructed {len(results) - len(failed_scan_ids)} of {len(results)} scans")
+    if failed_scan_ids:
+        click.echo(f"Failed scans: {failed_scan_ids}")
 
 
 if __name__ == "__main__":
-    main()  # pylint: disable=no-value-for-parameter
\ No newline at end of file
+    main()  # pylint: disable=no-value-for-parameter
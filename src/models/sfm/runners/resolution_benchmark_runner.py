@@ -0,0 +1,101 @@
+import os
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Tuple
+
+import click
+import pandas as pd
+
+from evaluation import IOU_COLUMNS, evaluate_scans
+from mvs import get_mvs_result_vox_path, get_mvs_truth_vox_path
+from runners.maximize_voxels_runner import maximize_scan
+from runners.voxelize_runner import voxelize_scan
+from scheduler import get_scan_ids, run_scans
+from settings import REPORTS_DIR
+from sfm_utils import VOXEL_CACHE
+
+
+def measure(func: Callable, *args) -> Tuple[object, float, float]:
+    # Peak of the memory allocated while func runs, NumPy arrays included, in MB
+    tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        value = func(*args)
+    finally:
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    return value, elapsed, peak / 1024 ** 2
+
+
+def get_voxel_files_size(scan_ids: List[int], resolution: int) -> int:
+    paths = [
+        path
+        for corrected, maximized in IOU_COLUMNS.values()
+        for scan_id in scan_ids
+        for path in (get_mvs_result_vox_path(scan_id, corrected, maximized, resolution),
+                     get_mvs_truth_vox_path(scan_id, corrected, resolution))
+    ]
+
+    return sum(os.path.getsize(path) for path in dict.fromkeys(paths) if os.path.exists(path))
+
+
+def run_stage(func: Callable, scan_id_start: int, scan_id_end: int, resolution: int):
+    for corrected in (False, True):
+        run_scans(func, scan_id_start, scan_id_end, corrected, resolution, progress=False)
+
+
+def benchmark_resolution(scan_id_start: int, scan_id_end: int, resolution: int) -> Dict:
+    """Time and peak memory of the voxelize, maximize and evaluate stages of all_runner at one resolution
+
+    Every stage starts with an empty in-memory voxel cache, the disk cache is used like in all_runner.
+    """
+    scan_ids = get_scan_ids(scan_id_start, scan_id_end)
+    row = {"resolution": resolution}
+    for stage, func in (("voxelize", voxelize_scan), ("maximize", maximize_scan)):
+        VOXEL_CACHE.clear()
+        _, row[f"{stage}_time"], row[f"{stage}_peak_mb"] = measure(
+            run_stage, func, scan_id_start, scan_id_end, resolution
+        )
+
+    VOXEL_CACHE.clear()
+    df, row["evaluate_time"], row["evaluate_peak_mb"] = measure(
+        evaluate_scans, scan_ids, IOU_COLUMNS, False, None, 1, resolution
+    )
+    row["voxel_files_mb"] = get_voxel_files_size(scan_ids, resolution) / 1024 ** 2
+    row["packed_grid_kb"] = resolution ** 3 / 8 / 1024
+    for column in IOU_COLUMNS:
+        row[f"{column}_iou"] = df[column].mean()
+
+    return row
+
+
+@click.command()
+@click.argument("scan_id_start", type=int, required=True)
+@click.argument("scan_id_end", type=int, required=True)
+@click.option(
+    "-r",
+    "--resolution",
+    "resolutions",
+    type=int,
+    multiple=True,
+    default=(32, 64, 128),
+)
+def main(scan_id_start: int, scan_id_end: int, resolutions: Tuple[int]):
+    click.echo(
+        f"\n==============MVS RESOLUTION BENCHMARK from {scan_id_start} to {scan_id_end}==============="
+    )
+    click.echo(f"Resolutions: {list(resolutions)}")
+    # Runs in this process only, so that tracemalloc sees all the allocations
+    df = pd.DataFrame([benchmark_resolution(scan_id_start, scan_id_end, resolution) for resolution in resolutions])
+
+    with pd.option_context("display.max_columns", None, "display.width", None):
+        click.echo(df.round(3).to_string(index=False))
+    csv_path = os.path.join(REPORTS_DIR, "sfm_mvs_resolution_benchmark.csv")
+    df.to_csv(csv_path, index=False)
+    click.echo(f"Saved to {csv_path}")
+
+
+if __name__ == "__main__":
+    main()  # pylint: disable=no-value-for-parameter
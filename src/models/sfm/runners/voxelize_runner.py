@@ -1,9 +1,24 @@
+from typing import Dict
+
 import click
 
-from tqdm.auto import tqdm
 from mvs import get_mvs_result_ply_path, get_mvs_result_vox_path, get_mvs_truth_ply_path, get_mvs_truth_vox_path
 
-from sfm_utils import is_correct_scan_id, readAndSavePlyToBinvox
+from scheduler import run_scans
+from sfm_utils import get_point_count_stats, readAndSavePlyToBinvox
+
+
+def voxelize_scan(scan_id: int, corrected: bool, resolution: int) -> Dict[str, Dict[str, float]]:
+    """Voxelizes the result and truth clouds, returns the point count statistics of both"""
+    _, result_point_counts = readAndSavePlyToBinvox(get_mvs_result_ply_path(scan_id, corrected),
+                                                    get_mvs_result_vox_path(scan_id, corrected, resolution=resolution),
+                                                    resolution)
+    _, truth_point_counts = readAndSavePlyToBinvox(get_mvs_truth_ply_path(scan_id, corrected),
+                                                   get_mvs_truth_vox_path(scan_id, corrected, resolution=resolution),
+                                                   resolution)
+
+    return {"result": get_point_count_stats(result_point_counts), "truth": get_point_count_stats(truth_point_counts)}
+
 
 @click.command()
 @click.argument("scan_id_start", type=int, required=True)
@@ -15,15 +30,29 @@ from sfm_utils import is_correct_scan_id, readAndSavePlyToBinvox
     type=bool,
     default=True,
 )
-def main(scan_id_start: int, scan_id_end: int, corrected: bool):
+@click.option(
+    "-r",
+    "--resolution",
+    "resolution",
+    type=int,
+    default=32,
+)
+@click.option(
+    "-j",
+    "--jobs",
+    "jobs",
+    type=int,
+    default=1,
+)
+def main(scan_id_start: int, scan_id_end: int, corrected: bool, resolution: int, jobs: int):
     click.echo(
         f"\n==============MVS VOXELIZE from {scan_id_start} to {scan_id_end}==============="
     )
     click.echo(f"Corrected: {corrected}")
-    for scan_id in tqdm(range(scan_id_start, scan_id_end + 1)):
-        if is_correct_scan_id(scan_id):
-            readAndSavePlyToBinvox(get_mvs_result_ply_path(scan_id, corrected), get_mvs_result_vox_path(scan_id, corrected))
-            readAndSavePlyToBinvox(get_mvs_truth_ply_path(scan_id, corrected), get_mvs_truth_vox_path(scan_id, corrected))
+    click.echo(f"Resolution: {resolution}")
+    for result in run_scans(voxelize_scan, scan_id_start, scan_id_end, corrected, resolution, jobs=jobs):
+        if result.error is None:
+            click.echo(f"Scan {result.scan_id}: result {result.value['result']}, truth {result.value['truth']}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,75 @@
+import os
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Any, Callable, List, NamedTuple, Optional, Tuple
+
+import click
+from tqdm.auto import tqdm
+
+from sfm_utils import is_correct_scan_id
+
+
+class ScanResult(NamedTuple):
+    scan_id: int
+    value: Any
+    error: Optional[str]
+
+
+def get_scan_ids(scan_id_start: int, scan_id_end: int) -> List[int]:
+    return [scan_id for scan_id in range(scan_id_start, scan_id_end + 1) if is_correct_scan_id(scan_id)]
+
+
+def get_n_jobs(jobs: int) -> int:
+    return jobs if jobs > 0 else os.cpu_count() or 1
+
+
+def run_task(func: Callable[..., Any], *args) -> Tuple[Any, Optional[str]]:
+    try:
+        return func(*args), None
+    except Exception:
+        return None, traceback.format_exc()
+
+
+def run_tasks(
+    func: Callable[..., Any], args_list: List[Tuple], jobs: int = 1, progress: bool = True
+) -> List[Tuple[Any, Optional[str]]]:
+    """Runs func(*args) for every args in args_list and returns the (value, error) pairs in the same order.
+
+    With jobs > 1 the calls run in a pool of that many processes, jobs <= 0 uses one process per core. func has to be
+    a module level function, so that it can be sent to the worker processes. An exception raised by one call is
+    returned as its formatted traceback instead of stopping the other calls.
+    """
+    n_jobs = min(get_n_jobs(jobs), max(len(args_list), 1))
+
+    if n_jobs == 1:
+        return [run_task(func, *args) for args in tqdm(args_list, disable=not progress)]
+
+    results = [None] * len(args_list)
+    with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+        futures = {executor.submit(run_task, func, *args): idx for idx, args in enumerate(args_list)}
+        for future in tqdm(as_completed(futures), total=len(futures), disable=not progress):
+            results[futures[future]] = future.result()
+
+    return results
+
+
+def run_scans(
+    func: Callable[..., Any], scan_id_start: int, scan_id_end: int, *args, jobs: int = 1, progress: bool = True
+) -> List[ScanResult]:
+    """Runs func(scan_id, *args) for every valid scan id between scan_id_start and scan_id_end with run_tasks.
+
+    Results are returned in scan id order, errors are printed after all scans finished.
+    """
+    scan_ids = get_scan_ids(scan_id_start, scan_id_end)
+    results = [
+        ScanResult(scan_id, value, error)
+        for scan_id, (value, error) in zip(
+            scan_ids, run_tasks(func, [(scan_id, ) + args for scan_id in scan_ids], jobs=jobs, progress=progress)
+        )
+    ]
+
+    for result in results:
+        if result.error is not None:
+            click.echo(f"\nERROR: scan {result.scan_id}\n{result.error}", err=True)
+
+    return results
@@ -1,35 +1,67 @@
+from collections import OrderedDict
+import hashlib
 from itertools import product
 import os
 import subprocess
-from settings import VIEWVOX_EXE
-from typing import Callable, Tuple
+from settings import VIEWVOX_EXE, VOXEL_CACHE_DIR
+from typing import Callable, Dict, List, Optional, Tuple
 from pyntcloud import PyntCloud
 import utils.binvox_rw as br
 import numpy as np
 
 
-def convertPlyToBinvox(cloud: PyntCloud) -> br.Voxels:
-    voxelgrid_id = cloud.add_structure("voxelgrid", n_x=32, n_y=32, n_z=32)
-    voxelgrid = cloud.structures[voxelgrid_id]
-    x_cords = voxelgrid.voxel_x
-    y_cords = voxelgrid.voxel_y
-    z_cords = voxelgrid.voxel_z
+def get_voxel_indices(points: np.ndarray, resolution: int = 32) -> List[np.ndarray]:
+    # Same grid as the pyntcloud voxelgrid structure: the bounding box is made cubic around the cloud and every point
+    # goes to the segment it lies in, with points on the lower edge of the box in the first segment
+    xyz_range = np.ptp(points, axis=0)
+    margin = max(xyz_range) - xyz_range
+    xyzmin = points.min(0) - margin / 2
+    xyzmax = points.max(0) + margin / 2
 
-    voxel = np.zeros((32, 32, 32)).astype(np.bool)
+    return [
+        np.clip(np.searchsorted(np.linspace(xyzmin[i], xyzmax[i], num=resolution + 1), points[:, i]) - 1,
+                0, resolution - 1)
+        for i in range(3)
+    ]
 
-    for x, y, z in zip(x_cords, y_cords, z_cords):
-        voxel[x][y][z] = True
 
-    return br.Voxels(voxel, (32, 32, 32), (0, 0, 0), 1, "xyz")
+def voxelize_points_sparse(points: np.ndarray, resolution: int = 32) -> Tuple[np.ndarray, np.ndarray]:
+    """Occupied voxels as a 3 x N coordinate array, with the number of points in each of them.
 
+    Memory is proportional to the number of points instead of resolution^3, so the grid never has to be dense.
+    """
+    dims = (resolution, resolution, resolution)
+    occupied_indices, point_counts = np.unique(
+        np.ravel_multi_index(get_voxel_indices(points, resolution), dims), return_counts=True
+    )
 
-def readAndSavePlyToBinvox(input_path: str, output_path: str) -> br.Voxels:
+    return np.stack(np.unravel_index(occupied_indices, dims)), point_counts
+
+
+def convertPlyToBinvox(cloud: PyntCloud, resolution: int = 32) -> Tuple[br.Voxels, np.ndarray]:
+    # Coordinate arrays are run-length encoded without a dense grid by br.write
+    voxel, point_counts = voxelize_points_sparse(cloud.xyz, resolution)
+
+    return br.Voxels(voxel, (resolution, resolution, resolution), (0, 0, 0), 1, "xyz"), point_counts
+
+
+def get_point_count_stats(point_counts: np.ndarray) -> Dict[str, float]:
+    return {
+        "points": int(point_counts.sum()),
+        "occupied_voxels": len(point_counts),
+        "mean_points_per_voxel": float(point_counts.mean()) if len(point_counts) else 0.0,
+        "max_points_per_voxel": int(point_counts.max()) if len(point_counts) else 0,
+    }
+
+
+def readAndSavePlyToBinvox(input_path: str, output_path: str, resolution: int = 32) -> Tuple[br.Voxels, np.ndarray]:
+    """Writes the voxelized cloud, returns the voxels and the point counts of their occupied voxels"""
     cloud = PyntCloud.from_file(input_path)
-    voxels = convertPlyToBinvox(cloud)
+    voxels, point_counts = convertPlyToBinvox(cloud, resolution)
     with open(output_path, "wb") as f:
         voxels.write(f)
 
-    return voxels
+    return voxels, point_counts
 
 
 def get_iou(result_vox_data: np.ndarray, truth_vox_data: np.ndarray) -> float:
@@ -40,18 +72,68 @@ def get_iou(result_vox_data: np.ndarray, truth_vox_data: np.ndarray) -> float:
     return iou
 
 
+def get_shift_intersections(
+    result_vox_data: np.ndarray, truth_vox_data: np.ndarray
+) -> np.ndarray:
+    # Cross-correlation of the occupancies: element [sx, sy, sz] is the intersection of the truth with the result
+    # rolled by (sx, sy, sz) along the axes, negative shifts wrap around to the end of each axis
+    result_fft = np.fft.rfftn(result_vox_data.astype(np.float64))
+    truth_fft = np.fft.rfftn(truth_vox_data.astype(np.float64))
+    correlation = np.fft.irfftn(truth_fft * np.conj(result_fft), s=truth_vox_data.shape)
+
+    return np.rint(correlation).astype(np.int64)
+
+
 def get_maximized_result_vox_data(
     result_vox_data: np.ndarray,
     truth_vox_data: np.ndarray,
     max_shift: int = 10,
     comp_func: Callable[[np.ndarray, np.ndarray], float] = get_iou,
+) -> Tuple[float, np.ndarray, Tuple]:
+    if result_vox_data.shape != truth_vox_data.shape:
+        raise ValueError(
+            f"Result shape {result_vox_data.shape} does not match truth shape {truth_vox_data.shape}"
+        )
+    if comp_func is not get_iou:
+        return get_maximized_result_vox_data_brute_force(
+            result_vox_data, truth_vox_data, max_shift, comp_func
+        )
+
+    result_vox_data_bool = result_vox_data != 0
+    truth_vox_data_bool = truth_vox_data != 0
+
+    # The occupied counts do not change under a cyclic shift, so every union follows from its intersection
+    shift_range = np.arange(-max_shift, max_shift + 1)
+    intersections = get_shift_intersections(result_vox_data_bool, truth_vox_data_bool)[
+        np.ix_(*[shift_range % dim for dim in truth_vox_data.shape])
+    ]
+    unions = np.sum(result_vox_data_bool) + np.sum(truth_vox_data_bool) - intersections
+    ious = intersections / np.maximum(unions, 1)
+
+    # argmax returns the first maximum in the order of the brute-force search
+    best_idx = np.unravel_index(np.argmax(ious), ious.shape)
+    max_iou = ious[best_idx]
+    if max_iou <= 0:
+        return 0, None, None  # type: ignore
+
+    best_shift = tuple(int(shift_range[i]) for i in best_idx)
+    maximized_result_vox_data = np.roll(result_vox_data, best_shift, axis=(0, 1, 2))
+
+    return max_iou, maximized_result_vox_data, best_shift
+
+
+def get_maximized_result_vox_data_brute_force(
+    result_vox_data: np.ndarray,
+    truth_vox_data: np.ndarray,
+    max_shift: int = 10,
+    comp_func: Callable[[np.ndarray, np.ndarray], float] = get_iou,
 ) -> Tuple[float, np.ndarray, Tuple]:
     shifts = product(range(-max_shift, max_shift + 1), repeat=3)
     maximized_result_vox_data: np.ndarray = None  # type: ignore
     max_iou = 0
     best_shift: Tuple = None  # type: ignore
     for shift in shifts:
-        result_vox_shifted_data: np.ndarray = np.roll(result_vox_data, shift)  # type: ignore
+        result_vox_shifted_data: np.ndarray = np.roll(result_vox_data, shift, axis=(0, 1, 2))  # type: ignore
         iou = comp_func(result_vox_shifted_data, truth_vox_data)
         if iou > max_iou:
             max_iou = iou
@@ -66,9 +148,146 @@ def view_voxel(voxel_path: str):
         subprocess.run([VIEWVOX_EXE, voxel_path])
 
 
+class VoxelCache:
+    """LRU cache of decoded binvox files, keyed by path, mtime and size.
+
+    Grids are kept bit-packed (br.PackedVoxels), up to max_bytes of them in memory. With a disk_cache_dir the packed
+    grids are also saved there as .npz files together with their binvox header, which outlive the process and are
+    shared by worker processes. Once the files take more than disk_cache_max_bytes, the least recently used ones are
+    removed down to DISK_CACHE_EVICTION_RATIO of it, so the directory is not listed on every write.
+    """
+
+    DISK_CACHE_EVICTION_RATIO = 0.9
+
+    def __init__(self, max_bytes: int = 256 * 1024 ** 2, disk_cache_dir: Optional[str] = None,
+                 disk_cache_max_bytes: int = 1024 ** 3):
+        self.max_bytes = max_bytes
+        self.disk_cache_dir = disk_cache_dir
+        self.disk_cache_max_bytes = disk_cache_max_bytes
+        self.entries: "OrderedDict[Tuple, br.Voxels]" = OrderedDict()
+        self.n_bytes = 0
+        # Size of the disk cache as of the last listing plus the files written since, None until it is listed
+        self.disk_n_bytes: Optional[int] = None
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def read(self, voxel_path: str) -> br.Voxels:
+        stat = os.stat(voxel_path)
+        key = (os.path.abspath(voxel_path), stat.st_mtime_ns, stat.st_size)
+        voxels = self.entries.get(key)
+        if voxels is not None:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return voxels
+
+        voxels = self.read_from_disk_cache(key)
+        if voxels is None:
+            self.misses += 1
+            with open(voxel_path, "rb") as f:
+                voxels = br.read_as_packed_array(f)
+            self.write_to_disk_cache(key, voxels)
+        else:
+            self.disk_hits += 1
+
+        self.entries[key] = voxels
+        self.n_bytes += voxels.data.nbytes
+        while self.n_bytes > self.max_bytes and len(self.entries) > 1:
+            _, evicted_voxels = self.entries.popitem(last=False)
+            self.n_bytes -= evicted_voxels.data.nbytes
+
+        return voxels
+
+    def get_disk_cache_path(self, key: Tuple) -> str:
+        return os.path.join(self.disk_cache_dir, hashlib.sha1(repr(key).encode("utf-8")).hexdigest() + ".npz")
+
+    def read_from_disk_cache(self, key: Tuple) -> Optional[br.Voxels]:
+        if self.disk_cache_dir is None:
+            return None
+        cache_path = self.get_disk_cache_path(key)
+        if not os.path.exists(cache_path):
+            return None
+
+        with np.load(cache_path) as cached:
+            dims = cached["dims"].tolist()
+            voxels = br.Voxels(br.PackedVoxels(cached["bits"], dims), dims, cached["translate"].tolist(),
+                               cached["scale"].item(), "xyz")
+        # Mark the file as recently used for the eviction
+        os.utime(cache_path)
+        return voxels
+
+    def write_to_disk_cache(self, key: Tuple, voxels: br.Voxels):
+        if self.disk_cache_dir is None:
+            return
+        os.makedirs(self.disk_cache_dir, exist_ok=True)
+        if self.disk_n_bytes is None:
+            self.disk_n_bytes = sum(size for _, size, _ in self.list_disk_cache())
+
+        # Write to a temporary file first, so other processes never read a partial array
+        cache_path = self.get_disk_cache_path(key)
+        tmp_cache_path = f"{cache_path}.{os.getpid()}.tmp"
+        with open(tmp_cache_path, "wb") as f:
+            np.savez(f, bits=voxels.data.bits, dims=np.array(voxels.dims), translate=np.array(voxels.translate),
+                     scale=np.array(voxels.scale))
+        self.disk_n_bytes += os.path.getsize(tmp_cache_path)
+        os.replace(tmp_cache_path, cache_path)
+
+        # Other processes write to the same directory, so the listing gives the actual size before evicting
+        if self.disk_n_bytes > self.disk_cache_max_bytes:
+            self.evict_from_disk_cache()
+
+    def list_disk_cache(self) -> List[Tuple[str, int, int]]:
+        """Path, size and mtime of every cached file"""
+        cache_files = []
+        for entry in os.scandir(self.disk_cache_dir):
+            if not entry.name.endswith(".npz"):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                # Removed by another process in the meantime
+                continue
+            cache_files.append((entry.path, stat.st_size, stat.st_mtime_ns))
+
+        return cache_files
+
+    def evict_from_disk_cache(self):
+        cache_files = self.list_disk_cache()
+        n_bytes = sum(size for _, size, _ in cache_files)
+        for path, size, _ in sorted(cache_files, key=lambda cache_file: cache_file[2]):
+            if n_bytes <= self.disk_cache_max_bytes * self.DISK_CACHE_EVICTION_RATIO:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                # Removed by another process in the meantime
+                pass
+            n_bytes -= size
+        self.disk_n_bytes = n_bytes
+
+    def get_stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "disk_hits": self.disk_hits, "misses": self.misses,
+                "entries": len(self.entries), "bytes": self.n_bytes}
+
+    def clear(self):
+        self.entries.clear()
+        self.n_bytes = 0
+
+
+VOXEL_CACHE = VoxelCache(disk_cache_dir=VOXEL_CACHE_DIR)
+
+
+def read_packed_voxel(voxel_path: str) -> br.Voxels:
+    # The returned model is shared with the cache and must not be modified
+    return VOXEL_CACHE.read(voxel_path)
+
+
 def read_voxel(voxel_path: str) -> br.Voxels:
-    with open(voxel_path, "rb") as f:
-        return br.read_as_3d_array(f)
+    voxels = read_packed_voxel(voxel_path)
+    # Same int32 grid as br.read_as_3d_array
+    return br.Voxels(voxels.data.to_bool().astype(np.int32), list(voxels.dims), list(voxels.translate),
+                     voxels.scale, voxels.axis_order)
+
 
 def is_correct_scan_id(scan_id: int) -> bool:
     return (scan_id >= 1 and scan_id <=77) or (scan_id >= 82 and scan_id <= 84) or (scan_id >= 93 and scan_id <= 136)
\ No newline at end of file
@@ -78,11 +78,14 @@ def visualize_processing_time(path_to_results: str, path_to_plots: str, files: L
     dfs = []
     for f in files:
         df = pd.read_csv(os.path.join(path_to_results, f))
+        # results saved before the folded views mode was added were measured with the per-view loop
+        if 'mode' not in df:
+            df['mode'] = 'per-view loop'
         dfs.append(df)
 
     full_df = pd.concat(objs=dfs)
 
-    sns.lineplot(data=full_df, x='n_views', y='time')
+    sns.lineplot(data=full_df, x='n_views', y='time', hue='mode')
     plt.ylabel("Processing time for one model (in ms)")
     plt.xlabel("Number of images")
     plt.title(f"Processing times in relation to number of images for one object")